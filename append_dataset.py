@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Append new documents to a dataset exported by preprocess.py, without re-processing the whole corpus.
+The vocab is frozen: the new json lines are tokenized, filtered and mapped to ids with the existing word2id, and exported as a new shard
+    (<data_prefix>.<data_type>.shard-XXXXX.one2one.pt/.one2many.pt), which is then recorded in <data_prefix>.<data_type>.index.json.
+    pykp.io.load_examples() loads the base dataset together with all the shards in the index.
+Documents already ingested are skipped by the hash of their tokenized source text (pykp.io.source_hash), the hashes of each shard are
+    kept in shard-XXXXX.hashes. The hashes of the base dataset are computed once from -base_json if given.
+    python append_dataset.py -dataset_name kp20k -source_json data/new_papers/2018-06-01.json -data_dir data/kp20k -base_json source_data/kp20k/kp20k_training.json
+"""
+import argparse
+import codecs
+import json
+import os
+import time
+
+import torch
+
+import config
+import pykp.io
+import pykp.vocab
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+DATASET_FIELDS = {
+    'kp20k': (['title', 'abstract'], ['keyword']),
+    'stackexchange': (['title', 'question'], ['tags']),
+}
+
+
+def load_tokenized_pairs(json_paths, src_fields, trg_fields, opt, valid_check):
+    '''
+    :return: the tokenized (src, trgs) pairs of all the lines in json_paths, and the number of broken lines
+    '''
+    src_trgs_pairs = []
+    num_broken = 0
+    for json_path in json_paths:
+        with codecs.open(json_path, 'r', 'utf-8') as json_file:
+            for line in json_file:
+                if len(line.strip()) == 0:
+                    continue
+                try:
+                    src_trgs_pairs.append(pykp.io.parse_json_line(line, src_fields, trg_fields))
+                except (ValueError, KeyError):
+                    num_broken += 1
+
+    return pykp.io.tokenize_filter_data(src_trgs_pairs, tokenize_fn=pykp.io.copyseq_tokenize, opt=opt, valid_check=valid_check), num_broken
+
+
+def base_hashes_path(data_prefix, data_type):
+    return '%s.%s.base.hashes' % (data_prefix, data_type)
+
+
+def load_hashes(path):
+    with open(path, 'r') as hash_file:
+        return set([line.strip() for line in hash_file if len(line.strip()) > 0])
+
+
+def sync_file(output_file):
+    '''
+    Flush an open file to disk, thus the file renamed by os.replace() afterwards is complete even if the machine crashes
+    '''
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+
+def save_hashes(hashes, path):
+    with open(path + '.tmp', 'w') as hash_file:
+        hash_file.writelines([h + '\n' for h in hashes])
+        sync_file(hash_file)
+    os.replace(path + '.tmp', path)
+
+
+def load_ingested_hashes(opt, data_prefix, index, src_fields, trg_fields):
+    '''
+    The hashes of the base dataset and all the shards in the index
+    '''
+    ingested_hashes = set()
+    base_path = base_hashes_path(data_prefix, opt.data_type)
+    if not os.path.exists(base_path) and opt.base_json:
+        print('Computing the hashes of the base dataset from %s' % ', '.join(opt.base_json))
+        base_pairs, _ = load_tokenized_pairs(opt.base_json, src_fields, trg_fields, opt, valid_check=(opt.data_type == 'train'))
+        save_hashes([pykp.io.source_hash(src_tokens) for src_tokens, _ in base_pairs], base_path)
+    if os.path.exists(base_path):
+        ingested_hashes.update(load_hashes(base_path))
+    else:
+        print('WARNING: %s is not found, documents of the base dataset are not deduplicated (see -base_json)' % base_path)
+
+    for shard in index['shards']:
+        ingested_hashes.update(load_hashes(pykp.io.dataset_shard_path(data_prefix, opt.data_type, shard['shard_id'], 'hashes')))
+
+    return ingested_hashes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='append_dataset.py', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-dataset_name', required=True, help="Name of dataset")
+    parser.add_argument('-source_json', required=True, nargs='+', help="The new documents (raw json, one per line)")
+    parser.add_argument('-data_dir', default=None, help="The dataset folder of preprocess.py, data/<dataset_name> by default")
+    parser.add_argument('-vocab', default=None, help="The frozen vocab (vocab.pt or vocab.bin), <data_dir>/<dataset_name>.vocab.pt by default")
+    parser.add_argument('-data_type', default='train', choices=['train', 'valid', 'test'], help="Which split to append to")
+    parser.add_argument('-base_json', default=None, nargs='+',
+                        help="The raw json of the base dataset, only read at the first append to compute its hashes for deduplication")
+    config.preprocess_opts(parser)
+    opt = parser.parse_args()
+
+    if opt.dataset_name not in DATASET_FIELDS:
+        raise Exception('Unsupported dataset name=%s' % opt.dataset_name)
+    src_fields, trg_fields = DATASET_FIELDS[opt.dataset_name]
+
+    data_dir = opt.data_dir if opt.data_dir else os.path.join('data', opt.dataset_name)
+    data_prefix = os.path.join(data_dir, opt.dataset_name)
+    vocab_path = opt.vocab if opt.vocab else data_prefix + '.vocab.pt'
+    if not os.path.exists('%s.%s.one2many.pt' % (data_prefix, opt.data_type)):
+        raise Exception('Base dataset is not found in %s, run preprocess.py first' % data_dir)
+
+    start_time = time.time()
+    word2id, id2word, _ = pykp.vocab.load_vocab(vocab_path)
+    index = pykp.io.load_dataset_index(data_prefix, opt.data_type)
+    ingested_hashes = load_ingested_hashes(opt, data_prefix, index, src_fields, trg_fields)
+    print('Loaded vocab (%d words) and %d hashes of ingested documents, %d shards appended before' % (len(id2word), len(ingested_hashes), len(index['shards'])))
+
+    tokenized_pairs, num_broken = load_tokenized_pairs(opt.source_json, src_fields, trg_fields, opt, valid_check=(opt.data_type == 'train'))
+    new_pairs = []
+    new_hashes = []
+    for src_tokens, trgs_tokens in tokenized_pairs:
+        doc_hash = pykp.io.source_hash(src_tokens)
+        # also skip the duplicates within the new documents
+        if doc_hash in ingested_hashes:
+            continue
+        ingested_hashes.add(doc_hash)
+        new_pairs.append((src_tokens, trgs_tokens))
+        new_hashes.append(doc_hash)
+    print('#(documents after filtering)=%d, #(duplicates)=%d, #(to append)=%d, #(broken lines)=%d'
+          % (len(tokenized_pairs), len(tokenized_pairs) - len(new_pairs), len(new_pairs), num_broken))
+    if len(new_pairs) == 0:
+        print('Nothing to append')
+        return
+
+    shard_id = max([shard['shard_id'] for shard in index['shards']]) + 1 if len(index['shards']) > 0 else 0
+    include_original = opt.data_type != 'train'
+    shard = {'shard_id': shard_id, 'source_json': [os.path.abspath(p) for p in opt.source_json], 'num_docs': len(new_pairs),
+             'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    for mode in ['one2one', 'one2many']:
+        examples = pykp.io.process_data_examples(new_pairs, word2id, id2word, opt, mode=mode, include_original=include_original)
+        shard['num_%s' % mode] = len(examples)
+        shard_path = pykp.io.dataset_shard_path(data_prefix, opt.data_type, shard_id, mode + '.pt')
+        with open(shard_path + '.tmp', 'wb') as shard_file:
+            torch.save(examples, shard_file)
+            sync_file(shard_file)
+        os.replace(shard_path + '.tmp', shard_path)
+        del examples
+    save_hashes(new_hashes, pykp.io.dataset_shard_path(data_prefix, opt.data_type, shard_id, 'hashes'))
+
+    # a shard takes effect only after it is in the index, thus a crashed run leaves no partial shard behind
+    index['shards'].append(shard)
+    index_path = pykp.io.dataset_index_path(data_prefix, opt.data_type)
+    with open(index_path + '.tmp', 'w') as index_file:
+        json.dump(index, index_file, indent=2)
+        sync_file(index_file)
+    os.replace(index_path + '.tmp', index_path)
+
+    print('Appended shard %d (%d one2one, %d one2many examples) to %s in %.1fs'
+          % (shard_id, shard['num_one2one'], shard['num_one2many'], data_prefix, time.time() - start_time))
+
+
+if __name__ == "__main__":
+    main()
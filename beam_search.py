@@ -131,6 +131,7 @@ class SequenceGenerator(object):
                  return_attention=True,
                  length_normalization_factor=0.0,
                  length_normalization_const=5.,
+                 shortlist_ids=None,
                  ):
         """Initializes the generator.
 
@@ -145,6 +146,9 @@ class SequenceGenerator(object):
             x > 0 then longer sequences will be favored.
             alpha in: https://arxiv.org/abs/1609.08144
           length_normalization_const: 5 in https://arxiv.org/abs/1609.08144
+          shortlist_ids: If not None, a list of frequent word indexes (see pykp.io.build_keyphrase_shortlist).
+            Beam search then only scores these words plus the source words of each batch (and oovs for copying),
+            instead of the full vocab.
         """
         self.model = model
         self.eos_id = eos_id
@@ -154,6 +158,15 @@ class SequenceGenerator(object):
         self.length_normalization_const = length_normalization_const
         self.return_attention = return_attention
         self.get_mask = GetMask()
+        self.shortlist_ids = torch.LongTensor(shortlist_ids) if shortlist_ids is not None else None
+
+    def batch_shortlist(self, src_input):
+        '''
+        The words to score for a batch: the shortlist plus all the source words (oovs have been replaced with <unk> in src_input)
+        :return: LongTensor (num_candidates), sorted unique word indexes
+        '''
+        shortlist_ids = self.shortlist_ids.cuda() if src_input.is_cuda else self.shortlist_ids
+        return torch.unique(torch.cat([shortlist_ids, src_input.data.view(-1)]), sorted=True)
 
     def sequence_to_batch(self, sequence_lists):
         '''
@@ -218,6 +231,8 @@ class SequenceGenerator(object):
         src_mask = self.get_mask(src_input)  # same size as input_src
         src_context, (src_h, src_c) = self.model.encode(src_input, src_len)
 
+        candidate_ids = self.batch_shortlist(src_input) if self.shortlist_ids is not None else None
+
         # prepare the init hidden vector, (batch_size, trg_seq_len, dec_hidden_dim)
         dec_hiddens = self.model.init_decoder_state(src_h, src_c)
 
@@ -269,11 +284,14 @@ class SequenceGenerator(object):
                 oov_list=oov_lists,
                 # k           =self.beam_size+1,
                 max_len=1,
-                return_attention=self.return_attention
+                return_attention=self.return_attention,
+                candidate_ids=candidate_ids
             )
 
             # squeeze these outputs, (hyp_seq_size, trg_len=1, K+1) -> (hyp_seq_size, K+1)
             probs, words = log_probs.data.topk(self.beam_size + 1, dim=-1)
+            if candidate_ids is not None:
+                words = self.model.map_from_candidates(words, candidate_ids)
             words = words.squeeze(1)
             probs = probs.squeeze(1)
             # (hyp_seq_size, trg_len=1, src_len) -> (hyp_seq_size, src_len)
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the hot paths, run each script as a module from the root folder, e.g.
+    python -m benchmarks.bench_merge_copy
+benchmarks.bench_suite times the whole pipeline on a synthetic corpus (benchmarks.synthetic_corpus) and compares with a json baseline.
+"""
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
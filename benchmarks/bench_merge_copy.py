@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark Seq2SeqLSTMAttention.merge_copy_probs in training (teacher forcing, forward + backward)
+    and in beam search (one step for batch_size * beam_size hypotheses, no grad, with and without the reused buffer),
+    against the previous implementation which built the extended-vocab logits from a python list and concatenated them.
+    python -m benchmarks.bench_merge_copy -vocab_size 50000 -batch_size 64
+"""
+import argparse
+
+import torch
+from torch.autograd import Variable
+
+from benchmarks.common import build_opt, timeit, report
+from pykp.model import Seq2SeqLSTMAttention
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+def merge_copy_probs_concat(model, decoder_logits, copy_logits, src_map, oov_list):
+    '''
+    The previous merge_copy_probs() for reference: build the extended logits from a python list, concatenate and scatter
+    '''
+    batch_size, max_length, output_size = decoder_logits.size()
+    src_len = src_map.size(1)
+    max_oov_number = max([len(oovs) for oovs in oov_list])
+
+    flattened_decoder_logits = decoder_logits.view(batch_size * max_length, output_size)
+    if max_oov_number > 0:
+        extended_logits = Variable(torch.FloatTensor([[0.0] * len(oov) + [float('-inf')] * (max_oov_number - len(oov)) for oov in oov_list]))
+        extended_logits = extended_logits.unsqueeze(1).expand(batch_size, max_length, max_oov_number).contiguous().view(batch_size * max_length, -1)
+        extended_logits = extended_logits.cuda() if torch.cuda.is_available() else extended_logits
+        flattened_decoder_logits = torch.cat((flattened_decoder_logits, extended_logits), dim=1)
+
+    expanded_src_map = src_map.unsqueeze(1).expand(batch_size, max_length, src_len).contiguous().view(batch_size * max_length, -1)
+    flattened_decoder_logits = flattened_decoder_logits.scatter_add_(1, expanded_src_map, copy_logits.view(batch_size * max_length, -1))
+    flattened_decoder_logits = torch.nn.functional.log_softmax(flattened_decoder_logits, dim=1)
+
+    return flattened_decoder_logits.view(batch_size, max_length, output_size + max_oov_number)
+
+
+def random_inputs(batch_size, trg_len, src_len, vocab_size, max_oov, requires_grad):
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    oov_list = [['oov%d' % j for j in range(i % (max_oov + 1))] for i in range(batch_size)]
+    src_map = torch.randint(0, vocab_size, (batch_size, src_len), dtype=torch.long)
+    for i, oovs in enumerate(oov_list):
+        for j in range(len(oovs)):
+            src_map[i, j] = vocab_size + j
+
+    decoder_logits = torch.randn(batch_size, trg_len, vocab_size, device=device, requires_grad=requires_grad)
+    copy_logits = torch.randn(batch_size, trg_len, src_len, device=device, requires_grad=requires_grad)
+
+    return decoder_logits, copy_logits, src_map.to(device), oov_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_merge_copy.py')
+    parser.add_argument('-vocab_size', type=int, default=50000)
+    parser.add_argument('-batch_size', type=int, default=64, help='Number of target sequences in a training batch')
+    parser.add_argument('-trg_len', type=int, default=6)
+    parser.add_argument('-src_len', type=int, default=300)
+    parser.add_argument('-max_oov', type=int, default=20)
+    parser.add_argument('-beam_batch_size', type=int, default=32, help='Number of source texts in a beam search batch')
+    parser.add_argument('-beam_size', type=int, default=32)
+    parser.add_argument('-repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    opt = build_opt(['-copy_attention', '-vocab_size', str(args.vocab_size), '-rnn_size', '8', '-word_vec_size', '8'])
+    model = Seq2SeqLSTMAttention(opt)
+
+    print('Training: batch=%d, trg_len=%d, src_len=%d, vocab=%d, forward + backward' % (args.batch_size, args.trg_len, args.src_len, args.vocab_size))
+    decoder_logits, copy_logits, src_map, oov_list = random_inputs(args.batch_size, args.trg_len, args.src_len, args.vocab_size, args.max_oov, True)
+
+    def train_step(merge_func):
+        def run():
+            log_probs = merge_func(decoder_logits, copy_logits, src_map, oov_list)
+            log_probs[:, :, 0].sum().backward()
+        return run
+
+    baseline = timeit(train_step(lambda *inputs: merge_copy_probs_concat(model, *inputs)), repeat=args.repeat)
+    report('concat (before)', baseline)
+    report('device mask + expanded cat', timeit(train_step(model.merge_copy_probs), repeat=args.repeat), baseline)
+
+    rows = args.beam_batch_size * args.beam_size
+    print('Beam search step: %d hypotheses, src_len=%d, vocab=%d, no grad' % (rows, args.src_len, args.vocab_size))
+    decoder_logits, copy_logits, src_map, oov_list = random_inputs(rows, 1, args.src_len, args.vocab_size, args.max_oov, False)
+
+    with torch.no_grad():
+        expected = merge_copy_probs_concat(model, decoder_logits, copy_logits.clone(), src_map, oov_list)
+        merged = model.merge_copy_probs(decoder_logits, copy_logits, src_map, oov_list, reuse_buffer=True)
+        finite = torch.isfinite(expected)
+        assert torch.equal(finite, torch.isfinite(merged))
+        print('max abs difference to concat: %.3e' % (expected[finite] - merged[finite]).abs().max().item())
+
+        baseline = timeit(lambda: merge_copy_probs_concat(model, decoder_logits, copy_logits, src_map, oov_list), repeat=args.repeat)
+        report('concat (before)', baseline)
+        report('device mask + expanded cat', timeit(lambda: model.merge_copy_probs(decoder_logits, copy_logits, src_map, oov_list), repeat=args.repeat), baseline)
+        report('preallocated, reused buffer', timeit(lambda: model.merge_copy_probs(decoder_logits, copy_logits, src_map, oov_list, reuse_buffer=True), repeat=args.repeat), baseline)
+
+
+if __name__ == '__main__':
+    main()
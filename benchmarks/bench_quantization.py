@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the fp32 and the dynamic int8 quantized Seq2SeqLSTMAttention on CPU: model size, beam search latency (one document)
+    and throughput (a batch of documents). Options not listed below are passed to the model, e.g.
+    python -m benchmarks.bench_quantization -copy_attention -bidirectional -train_from model/kp20k.ml.copy.model
+If -data and -vocab point to the processed kp20k data, F@5/F@10 on the valid set of both models are reported as well.
+"""
+import argparse
+import io
+import logging
+
+import numpy as np
+import torch
+
+import pykp.io
+from beam_search import SequenceGenerator
+from benchmarks.common import build_opt, timeit, report
+from evaluate import evaluate_beam_search
+from pykp.model import Seq2SeqLSTMAttention, quantize_model
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+def model_size(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def random_batch(batch_size, src_len, vocab_size):
+    src = torch.randint(5, vocab_size, (batch_size, src_len), dtype=torch.long)
+    src_oov = src.clone()
+    oov_lists = [[] for _ in range(batch_size)]
+    return src, [src_len] * batch_size, src_oov, oov_lists
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_quantization.py')
+    parser.add_argument('-num_docs', type=int, default=32, help='Number of documents in a batch for throughput')
+    parser.add_argument('-src_len', type=int, default=200)
+    parser.add_argument('-repeat', type=int, default=5)
+    parser.add_argument('-threads', type=int, default=1)
+    args, model_args = parser.parse_known_args()
+
+    torch.set_num_threads(args.threads)
+    opt = build_opt(model_args)
+
+    valid_data_loader = None
+    if opt.data != 'benchmark':
+        from train import load_data_vocab
+        _, valid_data_loader, _, _, _, _ = load_data_vocab(opt, load_train=False)
+
+    fp32_model = Seq2SeqLSTMAttention(opt)
+    if opt.train_from:
+        fp32_model.load_state_dict(torch.load(open(opt.train_from, 'rb'), map_location=lambda storage, loc: storage))
+    fp32_model.eval()
+    int8_model = quantize_model(fp32_model)
+
+    fp32_size = model_size(fp32_model)
+    int8_size = model_size(int8_model)
+    print('Model size: fp32=%.1f MB, int8=%.1f MB (x%.2f smaller)' % (fp32_size / 2 ** 20, int8_size / 2 ** 20, float(fp32_size) / int8_size))
+
+    generators = [(name, SequenceGenerator(model, eos_id=opt.word2id[pykp.io.EOS_WORD], beam_size=opt.beam_size, max_sequence_length=opt.max_sent_length))
+                  for name, model in [('fp32', fp32_model), ('int8', int8_model)]]
+
+    def run_beam_search(generator, batch):
+        src, src_len, src_oov, oov_lists = batch
+        with torch.no_grad():
+            generator.beam_search(src, src_len, src_oov, oov_lists, opt.word2id)
+
+    print('Latency: 1 document, src_len=%d, beam_size=%d, threads=%d' % (args.src_len, opt.beam_size, args.threads))
+    batch = random_batch(1, args.src_len, opt.vocab_size)
+    baseline = None
+    for name, generator in generators:
+        result = timeit(lambda: run_beam_search(generator, batch), repeat=args.repeat, warmup=1)
+        report(name, result, baseline)
+        baseline = baseline or result
+
+    print('Throughput: %d documents per batch' % args.num_docs)
+    batch = random_batch(args.num_docs, args.src_len, opt.vocab_size)
+    for name, generator in generators:
+        mean, std = timeit(lambda: run_beam_search(generator, batch), repeat=args.repeat, warmup=1)
+        print('%-40s %10.2f docs/s' % (name, args.num_docs / (mean / 1000.0)))
+
+    if valid_data_loader:
+        logging.info('Evaluating on the valid set')
+        scores = {}
+        for name, generator in generators:
+            score_dict = evaluate_beam_search(generator, valid_data_loader, opt, title='valid_%s' % name, predict_save_path=opt.pred_path + '/valid_%s/' % name)
+            scores[name] = dict([(score_name, np.average(score_dict[score_name])) for score_name in ['f_score@5_exact', 'f_score@10_exact', 'f_score@5_soft', 'f_score@10_soft']])
+        for score_name in sorted(scores['fp32'].keys()):
+            print('%-20s fp32=%.4f, int8=%.4f, diff=%.4f' % (score_name, scores['fp32'][score_name], scores['int8'][score_name], scores['int8'][score_name] - scores['fp32'][score_name]))
+
+
+if __name__ == '__main__':
+    main()
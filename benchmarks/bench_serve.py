@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Load generator for serve.py: send single-document requests from -concurrency clients and report the client-side throughput/latency
+    and the metrics of the server, e.g. compare the server started with -max_batch_size 1 and 16
+    python serve.py -model ... -vocab ... -port 8000
+    python -m benchmarks.bench_serve -port 8000 -num_requests 200 -concurrency 16 -input data/kp20k/kp20k_validation.json
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+
+import numpy as np
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+def load_documents(opt):
+    '''
+    Documents of a JSONL file (e.g. the kp20k json data) or random texts of -doc_length words
+    '''
+    if opt.input:
+        with open(opt.input, 'r') as input_file:
+            documents = [json.loads(line) for line in input_file if len(line.strip()) > 0]
+        return [{'title': d.get('title', ''), 'abstract': d.get('abstract', '')} for d in documents]
+
+    random.seed(opt.seed)
+    words = ['model', 'learning', 'network', 'data', 'neural', 'retrieval', 'query', 'graph', 'algorithm', 'system',
+             'keyphrase', 'generation', 'semantic', 'analysis', 'classification', 'the', 'of', 'a', 'and', 'for']
+    return [{'text': ' '.join(random.choice(words) for _ in range(opt.doc_length))} for _ in range(100)]
+
+
+def run_client(opt, documents, request_ids, latencies, errors):
+    connection = http.client.HTTPConnection(opt.host, opt.port, timeout=opt.timeout)
+    for request_id in request_ids:
+        body = json.dumps(dict(documents[request_id % len(documents)], top_k=opt.top_k))
+        start_time = time.time()
+        try:
+            connection.request('POST', '/extract', body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (http.client.HTTPException, OSError) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection(opt.host, opt.port, timeout=opt.timeout)
+            continue
+        latencies.append((time.time() - start_time) * 1000)
+    connection.close()
+
+
+def get_metrics(opt):
+    connection = http.client.HTTPConnection(opt.host, opt.port, timeout=opt.timeout)
+    connection.request('GET', '/metrics')
+    metrics = json.loads(connection.getresponse().read().decode('utf-8'))
+    connection.close()
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_serve.py')
+    parser.add_argument('-host', type=str, default='127.0.0.1')
+    parser.add_argument('-port', type=int, default=8000)
+    parser.add_argument('-num_requests', type=int, default=200)
+    parser.add_argument('-concurrency', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('-input', type=str, default=None, help='JSONL file of documents with title/abstract, random texts if not given')
+    parser.add_argument('-doc_length', type=int, default=200, help='Number of words of the random texts')
+    parser.add_argument('-top_k', type=int, default=10)
+    parser.add_argument('-timeout', type=float, default=600.0)
+    parser.add_argument('-seed', type=int, default=9527)
+    opt = parser.parse_args()
+
+    documents = load_documents(opt)
+    latencies, errors = [], []
+    threads = [threading.Thread(target=run_client, args=(opt, documents, range(i, opt.num_requests, opt.concurrency), latencies, errors))
+               for i in range(opt.concurrency)]
+
+    start_time = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start_time
+
+    print('#(requests)=%d, #(errors)=%d, concurrency=%d, elapsed=%.2fs' % (opt.num_requests, len(errors), opt.concurrency, elapsed))
+    print('client throughput: %.2f docs/s' % (len(latencies) / elapsed))
+    if len(latencies) > 0:
+        print('client latency: p50=%.1f ms, p99=%.1f ms' % (np.percentile(latencies, 50), np.percentile(latencies, 99)))
+    print('server metrics: %s' % json.dumps(get_metrics(opt), indent=2))
+
+
+if __name__ == '__main__':
+    main()
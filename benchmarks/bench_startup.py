@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Startup time of the inference path, from launching a new python process to the first prediction of KeyphraseExtractor,
+    with the vocab.pt and the binary vocab (pykp/vocab.py). Without -model a random model and a vocab of -vocab_size words are generated, e.g.
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup -model exp/.../xxx.model -vocab data/kp20k/kp20k.vocab.pt data/kp20k/kp20k.vocab.bin
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+# run in a new process, print the seconds elapsed since launch_time at each phase
+CHILD_SCRIPT = '''
+import json, sys, time
+launch_time = float(sys.argv[1])
+phases = {}
+from pykp.extractor import KeyphraseExtractor
+phases['import'] = time.time() - launch_time
+extractor = KeyphraseExtractor(sys.argv[2], sys.argv[3], beam_size=4, max_sent_length=3)
+phases['load'] = time.time() - launch_time
+extractor.extract(['keyphrase generation with a deep neural network model of sequence to sequence learning'], top_k=5)
+phases['first_prediction'] = time.time() - launch_time
+print(json.dumps(phases))
+'''
+
+
+def build_synthetic_experiment(exp_dir, vocab_size, model_vocab_size):
+    '''
+    A random model with the config next to it, and a vocab of vocab_size words in both vocab.pt and binary forms
+    '''
+    import torch
+    import pykp.io
+    import pykp.vocab
+    from benchmarks.common import build_opt
+    from pykp.model import Seq2SeqLSTMAttention
+
+    opt = build_opt(['-copy_attention', '-bidirectional', '-vocab_size', str(model_vocab_size)])
+    model_dir = os.path.join(exp_dir, 'model')
+    os.makedirs(model_dir)
+    model_path = os.path.join(model_dir, 'synthetic.model')
+    torch.save(Seq2SeqLSTMAttention(opt).state_dict(), open(model_path, 'wb'))
+    del opt.word2id, opt.id2word
+    torch.save(opt, open(os.path.join(model_dir, 'synthetic.initial.config'), 'wb'))
+
+    words = [pykp.io.PAD_WORD, pykp.io.BOS_WORD, pykp.io.EOS_WORD, pykp.io.UNK_WORD, pykp.io.SEP_WORD] + ['word%d' % i for i in range(vocab_size)]
+    word2id = dict([(w, i) for i, w in enumerate(words)])
+    id2word = dict([(i, w) for i, w in enumerate(words)])
+    vocab = dict([(w, vocab_size - i) for i, w in enumerate(words)])
+    torch.save([word2id, id2word, vocab], open(os.path.join(exp_dir, 'synthetic.vocab.pt'), 'wb'))
+    pykp.vocab.save_binary_vocab(id2word, os.path.join(exp_dir, 'synthetic.vocab.bin'))
+
+    return model_path, [os.path.join(exp_dir, 'synthetic.vocab.pt'), os.path.join(exp_dir, 'synthetic.vocab.bin')]
+
+
+def run_child(model_path, vocab_path):
+    launch_time = time.time()
+    output = subprocess.check_output([sys.executable, '-c', CHILD_SCRIPT, str(launch_time), model_path, vocab_path],
+                                     stderr=subprocess.DEVNULL, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    phases = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+    phases['total'] = time.time() - launch_time
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_startup.py')
+    parser.add_argument('-model', type=str, default=None, help='A checkpoint with its *.initial.config, a random one is generated if not given')
+    parser.add_argument('-vocab', type=str, nargs='+', default=None, help='Vocab files to compare')
+    parser.add_argument('-vocab_size', type=int, default=300000, help='Number of words of the synthetic vocab (preprocess.py keeps all the words)')
+    parser.add_argument('-model_vocab_size', type=int, default=50000, help='Vocab size of the synthetic model')
+    parser.add_argument('-repeat', type=int, default=3)
+    opt = parser.parse_args()
+
+    from pykp.vocab import load_vocab
+
+    exp_dir = None
+    if opt.model:
+        model_path, vocab_paths = opt.model, opt.vocab
+    else:
+        exp_dir = tempfile.mkdtemp(prefix='bench_startup_')
+        model_path, vocab_paths = build_synthetic_experiment(exp_dir, opt.vocab_size, opt.model_vocab_size)
+
+    for vocab_path in vocab_paths:
+        elapsed = []
+        for _ in range(opt.repeat):
+            start_time = time.time()
+            load_vocab(vocab_path)
+            elapsed.append((time.time() - start_time) * 1000)
+        print('%s (%.1f MB): load_vocab() %.1f ms' % (os.path.basename(vocab_path), os.path.getsize(vocab_path) / 1024.0 / 1024.0, np.mean(elapsed)))
+
+        runs = [run_child(model_path, vocab_path) for _ in range(opt.repeat)]
+        print('\tfrom launch: ' + ', '.join(['%s=%.2fs' % (phase, np.mean([r[phase] for r in runs]))
+                                             for phase in ['import', 'load', 'first_prediction', 'total']]))
+
+    if exp_dir:
+        import shutil
+        shutil.rmtree(exp_dir)
+
+
+if __name__ == '__main__':
+    main()
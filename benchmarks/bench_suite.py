@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Time every hot path of preprocessing, loading, training, decoding and evaluation on a synthetic kp20k-like corpus
+    (benchmarks/synthetic_corpus.py), write the results as json and compare them with a stored baseline, e.g.
+    python -m benchmarks.bench_suite -output bench_results.json -save_baseline benchmarks/baseline.json
+    (change something)
+    python -m benchmarks.bench_suite -output bench_results.json -baseline benchmarks/baseline.json
+benchmarks/baseline.json is a reference run of the first command with the default options (on the machine in its "environment"),
+    it is the default -baseline when run from the root of the repo, re-save it on your own machine before comparing.
+The benchmarks are run in the order of the pipeline, each one takes the outputs of the previous ones as inputs:
+    copyseq_tokenize -> tokenize_filter_data -> process_data_examples -> collate_fn_one2many -> train_step -> beam_search -> get_match_result
+Options not listed below are passed to the model (see config.py), e.g. -copy_attention -rnn_size 150 -vocab_size 50000.
+A benchmark slower than the baseline by more than -tolerance is reported as a regression (the exit code is 1 with -fail_on_regression),
+    unless the baseline is run with different TIMING_ARGS or model options, then every benchmark is incomparable.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+
+import numpy as np
+import torch
+
+import pykp.io
+from beam_search import SequenceGenerator
+from benchmarks.common import build_opt, timeit, report
+from benchmarks.synthetic_corpus import generate_corpus, corpus_stats
+from evaluate import get_match_result
+from pykp.model import Seq2SeqLSTMAttention
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+BENCHMARK_NAMES = ['copyseq_tokenize', 'tokenize_filter_data', 'process_data_examples', 'collate_fn_one2many', 'train_step',
+                   'beam_search', 'get_match_result_exact', 'get_match_result_partial', 'get_match_result_bleu']
+
+# the arguments that change the timings, a baseline run with any of them different is not comparable
+TIMING_ARGS = ['num_docs', 'corpus_vocab_size', 'batch_size', 'beam_batch_size', 'num_match_docs', 'num_predictions',
+               'repeat', 'train_repeat', 'threads', 'seed']
+
+# the reference results committed with the repo, relative to the root of the repo as the commands above
+DEFAULT_BASELINE = os.path.join('benchmarks', 'baseline.json')
+
+
+def quiet(func):
+    '''
+    Mute the progress prints of the functions under test, they are part of the hot paths but flood the output
+    '''
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return func()
+    return run
+
+
+def prepare_data(args, opt):
+    '''
+    :return: the raw (src, trgs) pairs, the tokenized pairs, word2id/id2word built on them, and the one2many examples
+    '''
+    docs = generate_corpus(args.num_docs, vocab_size=args.corpus_vocab_size, seed=args.seed)
+    src_trgs_pairs = [pykp.io.parse_json_line(json.dumps(doc), ['title', 'abstract'], ['keyword']) for doc in docs]
+    tokenized_pairs = quiet(lambda: pykp.io.tokenize_filter_data(src_trgs_pairs, tokenize_fn=pykp.io.copyseq_tokenize, opt=opt, valid_check=True))()
+    word2id, id2word, _ = pykp.io.build_vocab(tokenized_pairs, opt)
+    one2many_examples = quiet(lambda: pykp.io.process_data_examples(tokenized_pairs, word2id, id2word, opt, mode='one2many', include_original=True))()
+    return docs, src_trgs_pairs, tokenized_pairs, word2id, id2word, one2many_examples
+
+
+def run_benchmarks(args, opt):
+    '''
+    :return: {benchmark name: {'mean_ms', 'std_ms', 'items', 'items_per_sec', 'unit'}}
+    '''
+    torch.manual_seed(args.seed)
+    docs, src_trgs_pairs, tokenized_pairs, word2id, id2word, one2many_examples = prepare_data(args, opt)
+    opt.word2id, opt.id2word = word2id, id2word
+    results = {}
+
+    def record(name, func, items, unit, repeat=args.repeat, warmup=1):
+        if args.benchmarks and name not in args.benchmarks:
+            return
+        mean, std = timeit(quiet(func), repeat=repeat, warmup=warmup)
+        results[name] = {'mean_ms': mean, 'std_ms': std, 'items': items, 'unit': unit, 'items_per_sec': items / (mean / 1000.0)}
+        report('%s (%d %s)' % (name, items, unit), (mean, std))
+
+    '''
+    Preprocessing
+    '''
+    src_strs = [src.lower() for src, _ in src_trgs_pairs]
+    record('copyseq_tokenize', lambda: [pykp.io.copyseq_tokenize(src) for src in src_strs], len(src_strs), 'docs')
+    record('tokenize_filter_data', lambda: pykp.io.tokenize_filter_data(src_trgs_pairs, tokenize_fn=pykp.io.copyseq_tokenize, opt=opt, valid_check=True),
+           len(src_trgs_pairs), 'docs')
+    record('process_data_examples', lambda: pykp.io.process_data_examples(tokenized_pairs, word2id, id2word, opt, mode='one2many'),
+           len(tokenized_pairs), 'docs')
+
+    '''
+    Loading, batches of the first documents
+    '''
+    dataset = pykp.io.KeyphraseDataset(one2many_examples, word2id=word2id, id2word=id2word, type='one2many', include_original=True)
+    batches = [[dataset[i] for i in range(start, min(start + args.batch_size, len(dataset)))] for start in range(0, len(dataset), args.batch_size)]
+    record('collate_fn_one2many', lambda: [dataset.collate_fn_one2many(batch) for batch in batches], len(dataset), 'docs')
+
+    '''
+    Training, one step of forward (encode + decode) and backward on a one2one batch
+    '''
+    model = Seq2SeqLSTMAttention(opt)
+    if torch.cuda.is_available():
+        model.cuda()
+    optimizer = torch.optim.Adam(params=filter(lambda p: p.requires_grad, model.parameters()), lr=opt.learning_rate)
+    criterion = torch.nn.NLLLoss(ignore_index=word2id[pykp.io.PAD_WORD])
+    one2many_batch, one2one_batch = dataset.collate_fn_one2many(batches[0])
+    src, src_len, trg, trg_target, trg_copy_target, src_oov, oov_lists = one2one_batch
+    if torch.cuda.is_available():
+        src, trg, trg_target, trg_copy_target, src_oov = src.cuda(), trg.cuda(), trg_target.cuda(), trg_copy_target.cuda(), src_oov.cuda()
+    max_oov_number = max([len(oov) for oov in oov_lists])
+
+    def train_step():
+        model.train()
+        optimizer.zero_grad()
+        decoder_log_probs, _, _ = model.forward(src, src_len, trg, src_oov, oov_lists)
+        if opt.copy_attention:
+            loss = criterion(decoder_log_probs.contiguous().view(-1, opt.vocab_size + max_oov_number), trg_copy_target.contiguous().view(-1))
+        else:
+            loss = criterion(decoder_log_probs.contiguous().view(-1, opt.vocab_size), trg_target.contiguous().view(-1))
+        loss.backward()
+        optimizer.step()
+    record('train_step', train_step, src.size(0), 'target sequences', repeat=args.train_repeat)
+
+    '''
+    Decoding, beam search on the first documents
+    '''
+    model.eval()
+    generator = SequenceGenerator(model, eos_id=word2id[pykp.io.EOS_WORD], beam_size=opt.beam_size, max_sequence_length=opt.max_sent_length)
+    beam_batch = dataset.collate_fn_one2many(batches[0][: args.beam_batch_size])[0]
+    beam_src, beam_src_len, _, _, _, beam_src_oov, beam_oov_lists = beam_batch[:7]
+    if torch.cuda.is_available():
+        beam_src, beam_src_oov = beam_src.cuda(), beam_src_oov.cuda()
+
+    def beam_search():
+        with torch.no_grad():
+            generator.beam_search(beam_src, beam_src_len, beam_src_oov, beam_oov_lists, word2id)
+    record('beam_search', beam_search, beam_src.size(0), 'docs', repeat=args.train_repeat)
+
+    '''
+    Evaluation, match -num_predictions candidates (spans of the source, and the targets) against the targets of each document
+    '''
+    rng = np.random.RandomState(args.seed)
+    match_inputs = []
+    for src_tokens, trgs_tokens in tokenized_pairs[: args.num_match_docs]:
+        pred_seqs = [list(t) for t in trgs_tokens]
+        while len(pred_seqs) < args.num_predictions:
+            pred_len = rng.randint(1, 4)
+            start = rng.randint(0, max(len(src_tokens) - pred_len, 0) + 1)
+            pred_seqs.append(src_tokens[start: start + pred_len])
+        rng.shuffle(pred_seqs)
+        match_inputs.append((trgs_tokens, pred_seqs))
+    for match_type in ['exact', 'partial', 'bleu']:
+        record('get_match_result_%s' % match_type,
+               lambda: [get_match_result(true_seqs=trgs, pred_seqs=preds, type=match_type) for trgs, preds in match_inputs],
+               len(match_inputs), 'docs')
+
+    return results, corpus_stats(docs)
+
+
+def mismatched_settings(args, model_args, baseline):
+    '''
+    :return: the names of TIMING_ARGS (and 'model_args') that are different from the ones of the baseline
+    '''
+    baseline_args = baseline.get('args', {})
+    mismatched = [name for name in TIMING_ARGS if baseline_args.get(name) != getattr(args, name)]
+    if baseline.get('model_args') != model_args:
+        mismatched.append('model_args')
+    return mismatched
+
+
+def compare_with_baseline(results, baseline, tolerance, incomparable=False):
+    '''
+    :param incomparable: the baseline is run with different settings (see mismatched_settings()), no speedup is reported then
+    :return: {benchmark name: {'baseline_mean_ms', 'mean_ms', 'speedup', 'status'}}, speedup > 1 means faster than the baseline
+    '''
+    comparison = {}
+    for name, result in results.items():
+        if name not in baseline['results']:
+            comparison[name] = {'status': 'new'}
+            continue
+        baseline_mean = baseline['results'][name]['mean_ms']
+        if incomparable:
+            comparison[name] = {'baseline_mean_ms': baseline_mean, 'mean_ms': result['mean_ms'], 'speedup': None, 'status': 'incomparable'}
+            continue
+        speedup = baseline_mean / result['mean_ms']
+        if speedup < 1.0 / (1.0 + tolerance):
+            status = 'regression'
+        elif speedup > 1.0 + tolerance:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        comparison[name] = {'baseline_mean_ms': baseline_mean, 'mean_ms': result['mean_ms'], 'speedup': speedup, 'status': status}
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_suite.py')
+    parser.add_argument('-benchmarks', nargs='+', default=None, choices=BENCHMARK_NAMES, help='Run only these benchmarks, all by default')
+    parser.add_argument('-num_docs', type=int, default=1000, help='Number of synthetic documents to preprocess and load')
+    parser.add_argument('-corpus_vocab_size', type=int, default=50000, help='Number of word types in the synthetic corpus')
+    parser.add_argument('-batch_size', type=int, default=32, help='Number of documents per training batch')
+    parser.add_argument('-beam_batch_size', type=int, default=4, help='Number of documents per beam search batch')
+    parser.add_argument('-num_match_docs', type=int, default=200, help='Number of documents for get_match_result')
+    parser.add_argument('-num_predictions', type=int, default=100, help='Number of predictions per document for get_match_result')
+    parser.add_argument('-repeat', type=int, default=3, help='Number of timed runs of the preprocessing/loading/evaluation benchmarks')
+    parser.add_argument('-train_repeat', type=int, default=5, help='Number of timed runs of train_step and beam_search')
+    parser.add_argument('-threads', type=int, default=0, help='torch.set_num_threads(), 0 keeps the default')
+    parser.add_argument('-seed', type=int, default=1)
+    parser.add_argument('-output', default='bench_results.json', help='Path of the json results')
+    parser.add_argument('-baseline', default=DEFAULT_BASELINE, help='json results of a previous run to compare with, skipped if the default one does not exist')
+    parser.add_argument('-save_baseline', default=None, help='Also save the results as a new baseline to this path')
+    parser.add_argument('-tolerance', type=float, default=0.1, help='Relative change of time regarded as noise')
+    parser.add_argument('-fail_on_regression', action='store_true', help='Exit with 1 if any benchmark is a regression')
+    args, model_args = parser.parse_known_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    opt = build_opt(model_args)
+
+    results, stats = run_benchmarks(args, opt)
+    output = {
+        'created': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'torch': torch.__version__, 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count(), 'torch_threads': torch.get_num_threads(), 'cuda': torch.cuda.is_available()},
+        'args': vars(args),
+        'model_args': model_args,
+        'corpus': stats,
+        'results': results,
+    }
+
+    num_regressions = 0
+    if args.baseline and not os.path.exists(args.baseline):
+        if args.baseline != DEFAULT_BASELINE:
+            raise ValueError('Baseline %s does not exist' % args.baseline)
+        print('No baseline at %s, skip the comparison' % args.baseline)
+    elif args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        mismatched = mismatched_settings(args, model_args, baseline)
+        if len(mismatched) > 0:
+            print('WARNING: the baseline is run with different settings, all the benchmarks are incomparable: %s'
+                  % ', '.join(['%s=%s (baseline %s)' % (name, getattr(args, name, model_args), baseline.get('args', {}).get(name, baseline.get('model_args')))
+                               for name in mismatched]))
+        output['baseline'] = args.baseline
+        output['comparison'] = compare_with_baseline(results, baseline, args.tolerance, incomparable=len(mismatched) > 0)
+
+        print('Comparison with %s (created %s)' % (args.baseline, baseline.get('created')))
+        for name in BENCHMARK_NAMES:
+            if name not in output['comparison']:
+                continue
+            comparison = output['comparison'][name]
+            if comparison['status'] == 'new':
+                print('%-40s %s' % (name, 'new'))
+            elif comparison['status'] == 'incomparable':
+                print('%-40s %10.3f ms -> %10.3f ms    %s' % (name, comparison['baseline_mean_ms'], comparison['mean_ms'], comparison['status']))
+            else:
+                print('%-40s %10.3f ms -> %10.3f ms    x%.2f  %s' % (name, comparison['baseline_mean_ms'], comparison['mean_ms'], comparison['speedup'], comparison['status']))
+        num_regressions = len([1 for c in output['comparison'].values() if c['status'] == 'regression'])
+
+    with open(args.output, 'w') as output_file:
+        json.dump(output, output_file, indent=2)
+    print('Results are written to %s' % args.output)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(output, baseline_file, indent=2)
+        print('Baseline is saved to %s' % args.save_baseline)
+
+    if args.fail_on_regression and num_regressions > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
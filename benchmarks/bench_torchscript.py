@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Per-step decoding latency of the eager Seq2SeqLSTMAttention.generate() against the TorchScript modules (pykp/scripted.py),
+    for batch_size * beam_size hypotheses as in SequenceGenerator.beam_search. Options not listed below are passed to the model, e.g.
+    python -m benchmarks.bench_torchscript -copy_attention -bidirectional -input_feeding
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import build_opt, timeit, report
+from pykp.eric_layers import GetMask
+from pykp.model import Seq2SeqLSTMAttention
+from pykp.scripted import script_model
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bench_torchscript.py')
+    parser.add_argument('-num_docs', type=int, default=8)
+    parser.add_argument('-src_len', type=int, default=200)
+    parser.add_argument('-num_oov', type=int, default=5)
+    parser.add_argument('-repeat', type=int, default=50)
+    parser.add_argument('-threads', type=int, default=1)
+    args, model_args = parser.parse_known_args()
+
+    torch.set_num_threads(args.threads)
+    opt = build_opt(model_args)
+    model = Seq2SeqLSTMAttention(opt)
+    model.eval()
+    scripted_model = script_model(model)
+
+    rows = args.num_docs * opt.beam_size
+    src = torch.randint(5, opt.vocab_size, (rows, args.src_len), dtype=torch.long)
+    src_oov = src.clone()
+    src_oov[:, :args.num_oov] = torch.arange(opt.vocab_size, opt.vocab_size + args.num_oov)
+    oov_list = [['oov%d' % i for i in range(args.num_oov)]] * rows
+    ctx_mask = GetMask()(src)
+    trg_input = torch.randint(5, opt.vocab_size, (rows, 1), dtype=torch.long)
+
+    print('One decoding step: %d hypotheses (%d docs * beam %d), src_len=%d, vocab=%d, threads=%d'
+          % (rows, args.num_docs, opt.beam_size, args.src_len, opt.vocab_size, args.threads))
+
+    baseline = None
+    with torch.no_grad():
+        outputs = []
+        for name, m in [('eager', model), ('torchscript', scripted_model)]:
+            context, (h, c) = m.encode(src, [args.src_len] * rows)
+            dec_hidden = m.init_decoder_state(h, c)
+
+            def step():
+                return m.generate(trg_input=trg_input, dec_hidden=dec_hidden, enc_context=context, ctx_mask=ctx_mask,
+                                  src_map=src_oov, oov_list=oov_list, max_len=1, return_attention=True)
+
+            outputs.append(step()[0].clone())
+            result = timeit(step, repeat=args.repeat)
+            report(name, result, baseline)
+            baseline = baseline or result
+
+        finite = torch.isfinite(outputs[0])
+        print('max abs difference of log_probs: %.3e' % (outputs[0][finite] - outputs[1][finite]).abs().max().item())
+
+
+if __name__ == '__main__':
+    main()
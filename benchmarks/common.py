@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers of the benchmark scripts
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+import config
+import pykp.io
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+def build_opt(args=None):
+    '''
+    Build an opt with all the default options of training/predicting and a dummy vocab (only the special tokens),
+        which is enough to construct the models with random weights
+    :param args: list of extra command line arguments, e.g. ['-copy_attention', '-vocab_size', '50000']
+    '''
+    parser = argparse.ArgumentParser()
+    config.preprocess_opts(parser)
+    config.model_opts(parser)
+    config.train_opts(parser)
+    config.predict_opts(parser)
+    opt = parser.parse_args(['-data', 'benchmark', '-vocab', 'benchmark'] + (args if args else []))
+
+    opt.word2id = {pykp.io.PAD_WORD: 0, pykp.io.BOS_WORD: 1, pykp.io.EOS_WORD: 2, pykp.io.UNK_WORD: 3, pykp.io.SEP_WORD: 4}
+    opt.id2word = dict([(i, w) for w, i in opt.word2id.items()])
+
+    return opt
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def timeit(func, repeat=20, warmup=3):
+    '''
+    Run func() repeatedly and return the (mean, std) of elapsed milliseconds
+    '''
+    for _ in range(warmup):
+        func()
+    synchronize()
+
+    elapsed = []
+    for _ in range(repeat):
+        start_time = time.time()
+        func()
+        synchronize()
+        elapsed.append((time.time() - start_time) * 1000)
+
+    return np.mean(elapsed), np.std(elapsed)
+
+
+def report(name, result, baseline=None):
+    mean, std = result
+    line = '%-40s %10.3f ms (+- %.3f)' % (name, mean, std)
+    if baseline is not None:
+        line += '    x%.2f' % (baseline[0] / mean)
+    print(line)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic corpus in the json format of kp20k ({"title", "abstract", "keyword": "kp1;kp2;..."}, one paper per line),
+    which follows the length and keyphrase-count distributions of kp20k and needs no downloads:
+    - title ~9 words, abstract ~175 words in sentences with commas and some numbers (log-normal lengths)
+    - 1 + Poisson(4.3) keyphrases per paper (5.3 on average), of 1-5 words (2 on average), ~58% of them present in the abstract
+    - words are pronounceable pseudo-words drawn from a Zipf (Zipf-Mandelbrot) distribution over -vocab_size types
+    python -m benchmarks.synthetic_corpus -num_docs 10000 -output synthetic_kp20k.json
+"""
+import argparse
+import json
+
+import numpy as np
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+CONSONANTS = ['b', 'c', 'd', 'f', 'g', 'h', 'k', 'l', 'm', 'n', 'p', 'r', 's', 't', 'v', 'w', 'z', 'ch', 'st', 'tr']
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'ai', 'ou', 'ia']
+KEYPHRASE_LENGTH_PROBS = [0.20, 0.50, 0.22, 0.06, 0.02]
+
+
+def build_vocabulary(vocab_size, rng):
+    '''
+    :return: vocab_size unique pseudo-words, frequent words (small ranks) are shorter
+    '''
+    words = []
+    seen = set()
+    while len(words) < vocab_size:
+        num_syllables = 1 + min(int(np.log10(len(words) + 10)) - 1 + rng.randint(0, 2), 4)
+        word = ''.join([CONSONANTS[rng.randint(len(CONSONANTS))] + VOWELS[rng.randint(len(VOWELS))] for _ in range(num_syllables)])
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class SyntheticCorpus(object):
+    def __init__(self, vocab_size=50000, zipf_exponent=1.05, seed=1):
+        self.rng = np.random.RandomState(seed)
+        self.words = build_vocabulary(vocab_size, self.rng)
+        # Zipf-Mandelbrot, p(rank) ~ 1 / (rank + 2.7) ^ s
+        probs = 1.0 / np.power(np.arange(vocab_size) + 2.7, zipf_exponent)
+        self.cum_probs = np.cumsum(probs / probs.sum())
+
+    def sample_words(self, num_words):
+        word_ids = np.minimum(np.searchsorted(self.cum_probs, self.rng.random_sample(num_words)), len(self.words) - 1)
+        return [self.words[i] for i in word_ids]
+
+    def sample_length(self, median, sigma, min_len, max_len):
+        return int(np.clip(np.round(self.rng.lognormal(np.log(median), sigma)), min_len, max_len))
+
+    def make_text(self, words):
+        '''
+        Split words into sentences of ~20 words, with some commas and numbers
+        '''
+        tokens = []
+        sentence_len = 0
+        for word in words:
+            if self.rng.random_sample() < 0.01:
+                tokens.append(str(self.rng.randint(1, 2000)))
+            tokens.append(word)
+            sentence_len += 1
+            if sentence_len >= 8 and self.rng.random_sample() < 0.08:
+                tokens[-1] += '.'
+                sentence_len = 0
+            elif self.rng.random_sample() < 0.05:
+                tokens[-1] += ','
+        text = ' '.join(tokens)
+        return text[0].upper() + text[1:] + ('' if text.endswith('.') else '.')
+
+    def make_document(self):
+        title_words = self.sample_words(self.sample_length(9, 0.3, 2, 30))
+        abstract_words = self.sample_words(self.sample_length(160, 0.45, 25, 600))
+
+        keyphrases = []
+        num_keyphrases = min(1 + self.rng.poisson(4.3), 30)
+        while len(keyphrases) < num_keyphrases:
+            kp_len = 1 + self.rng.choice(len(KEYPHRASE_LENGTH_PROBS), p=KEYPHRASE_LENGTH_PROBS)
+            if self.rng.random_sample() < 0.58:
+                # present keyphrase, a span of the abstract
+                start = self.rng.randint(0, len(abstract_words) - kp_len + 1)
+                keyphrase = ' '.join(abstract_words[start: start + kp_len])
+            else:
+                keyphrase = ' '.join(self.sample_words(kp_len))
+            if keyphrase not in keyphrases:
+                keyphrases.append(keyphrase)
+
+        title = ' '.join(title_words)
+        return {'title': title[0].upper() + title[1:], 'abstract': self.make_text(abstract_words), 'keyword': ';'.join(keyphrases)}
+
+    def make_documents(self, num_docs):
+        return [self.make_document() for _ in range(num_docs)]
+
+
+def generate_corpus(num_docs, vocab_size=50000, seed=1):
+    '''
+    :return: a list of num_docs dicts of kp20k format, the same for the same arguments
+    '''
+    return SyntheticCorpus(vocab_size=vocab_size, seed=seed).make_documents(num_docs)
+
+
+def corpus_stats(docs):
+    keyphrases = [kp.split() for d in docs for kp in d['keyword'].split(';')]
+    return {'num_docs': len(docs),
+            'avg_title_len': float(np.mean([len(d['title'].split()) for d in docs])),
+            'avg_abstract_len': float(np.mean([len(d['abstract'].split()) for d in docs])),
+            'avg_num_keyphrases': float(len(keyphrases)) / len(docs),
+            'avg_keyphrase_len': float(np.mean([len(kp) for kp in keyphrases])),
+            'present_keyphrase_ratio': float(np.mean([' %s ' % ' '.join(kp) in ' %s ' % d['abstract'].replace('.', ' ').replace(',', ' ')
+                                                      for d in docs for kp in [k.split() for k in d['keyword'].split(';')]]))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='synthetic_corpus.py')
+    parser.add_argument('-num_docs', type=int, default=10000)
+    parser.add_argument('-vocab_size', type=int, default=50000, help='Number of word types')
+    parser.add_argument('-seed', type=int, default=1)
+    parser.add_argument('-output', required=True, help='Path of the json lines')
+    args = parser.parse_args()
+
+    docs = generate_corpus(args.num_docs, vocab_size=args.vocab_size, seed=args.seed)
+    with open(args.output, 'w') as output_file:
+        for doc in docs:
+            output_file.write(json.dumps(doc) + '\n')
+    print(json.dumps(corpus_stats(docs), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Offline keyphrase extraction over a large JSONL corpus (e.g. a whole MAG domain dump), resumable after crashes.
+The input is split into shards of -shard_size lines (by byte offsets, the file is not copied), and the shards are decoded by a pool of
+    -num_workers processes with -threads_per_worker torch threads each. Every shard is written to <output_dir>/shard-XXXXX.jsonl,
+    and recorded in <output_dir>/manifest.json once it is done. Rerunning the same command skips the finished shards,
+    unless the input, model, vocab, config or any output option has changed since, then all shards are decoded again.
+    python bulk_predict.py -input mag_cs.jsonl -output_dir output/mag_cs -model exp/.../xxx.model -vocab data/kp20k/kp20k.vocab.pt -num_workers 8 -threads_per_worker 2
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import config
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+MANIFEST_NAME = 'manifest.json'
+
+# the extractor of each worker process, see init_worker()
+worker_extractor = None
+worker_opt = None
+
+
+def compute_shard_offsets(input_path, shard_size):
+    '''
+    One pass over the input to find the byte offset of the first line of each shard
+    :return: a list of (offset, number of lines)
+    '''
+    shards = []
+    offset = 0
+    num_lines = 0
+    with open(input_path, 'rb') as input_file:
+        for line in input_file:
+            if num_lines == 0:
+                shards.append([offset, 0])
+            offset += len(line)
+            num_lines += 1
+            if num_lines == shard_size:
+                shards[-1][1] = num_lines
+                num_lines = 0
+    if num_lines > 0:
+        shards[-1][1] = num_lines
+    return [tuple(s) for s in shards]
+
+
+def shard_path(output_dir, shard_id):
+    return os.path.join(output_dir, 'shard-%05d.jsonl' % shard_id)
+
+
+# the options that change the content of the shards, a manifest is reused only if all of them are the same
+OUTPUT_OPTIONS = ['shard_size', 'text_fields', 'id_field', 'top_k', 'beam_size', 'max_sent_length', 'max_src_length', 'include_absent']
+
+
+def file_signature(path):
+    '''
+    :return: absolute path, size and modification time of a file, thus a retrained checkpoint or a rebuilt vocab is noticed
+    '''
+    file_stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+
+
+def manifest_settings(opt):
+    '''
+    Everything that determines the outputs: the input, model, vocab and config files and the output options
+    '''
+    from pykp.extractor import find_config_path
+
+    settings = {
+        'input': file_signature(opt.input),
+        'model': file_signature(opt.model),
+        'vocab': file_signature(opt.vocab),
+        'config': file_signature(opt.config if opt.config else find_config_path(opt.model)),
+    }
+    for option in OUTPUT_OPTIONS:
+        settings[option] = getattr(opt, option)
+    return settings
+
+
+def load_manifest(opt):
+    '''
+    Reuse the manifest of a previous run if all of its settings are the same as the current ones,
+        otherwise start over and remove the shards of the previous run
+    '''
+    logger = logging.getLogger('bulk_predict')
+    settings = manifest_settings(opt)
+    manifest_path = os.path.join(opt.output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        # compare after a json round trip, as the manifest was loaded from json
+        changed = sorted([k for k in set(settings.keys()) | set(manifest.get('settings', {}).keys())
+                          if json.loads(json.dumps(settings.get(k))) != manifest.get('settings', {}).get(k)])
+        if len(changed) == 0:
+            return manifest
+        logger.warning('Settings changed since the previous run (%s), starting over' % ', '.join(changed))
+        for shard_id in range(len(manifest['shards'])):
+            if os.path.exists(shard_path(opt.output_dir, shard_id)):
+                os.remove(shard_path(opt.output_dir, shard_id))
+
+    return {
+        'settings': settings,
+        'shards': compute_shard_offsets(opt.input, opt.shard_size),
+        'completed': {},
+        'runs': [],
+    }
+
+
+def save_manifest(opt, manifest):
+    '''
+    Write to a temporary file then rename, thus a crash never leaves a broken manifest
+    '''
+    manifest_path = os.path.join(opt.output_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+        manifest_file.flush()
+        os.fsync(manifest_file.fileno())
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def init_worker(opt):
+    global worker_extractor, worker_opt
+    import torch
+    from pykp.extractor import KeyphraseExtractor
+
+    torch.set_num_threads(opt.threads_per_worker)
+    worker_opt = opt
+    worker_extractor = KeyphraseExtractor(opt.model, opt.vocab, config_path=opt.config,
+                                          beam_size=opt.beam_size, max_sent_length=opt.max_sent_length,
+                                          batch_size=opt.batch_size, max_src_length=opt.max_src_length,
+                                          must_appear_in_src=not opt.include_absent)
+
+
+def process_shard(shard):
+    '''
+    Decode the lines of one shard and write to shard-XXXXX.jsonl (through a temporary file)
+    A line that is not a valid document gets an error record, see KeyphraseExtractor.extract_json_lines()
+    :return: shard_id, number of documents, number of invalid documents, elapsed seconds
+    '''
+    shard_id, offset, num_lines = shard
+    opt = worker_opt
+    start_time = time.time()
+
+    documents = []
+    with open(opt.input, 'rb') as input_file:
+        input_file.seek(offset)
+        for _ in range(num_lines):
+            line = input_file.readline().decode('utf-8').strip()
+            if len(line) > 0:
+                documents.append(line)
+
+    num_errors = 0
+    output_path = shard_path(opt.output_dir, shard_id)
+    with open(output_path + '.tmp', 'w') as output_file:
+        for batch_start in range(0, len(documents), opt.batch_size):
+            batch = documents[batch_start: batch_start + opt.batch_size]
+            for output in worker_extractor.extract_json_lines(batch, opt.text_fields, opt.id_field, top_k=opt.top_k):
+                num_errors += 'error' in output
+                output_file.write(json.dumps(output) + '\n')
+    os.replace(output_path + '.tmp', output_path)
+
+    return shard_id, len(documents), num_errors, time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='bulk_predict.py', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-input', required=True, help='JSONL file of documents, one JSON object (or string) per line')
+    parser.add_argument('-output_dir', required=True, help='Folder of the per-shard outputs and the manifest')
+    parser.add_argument('-model', required=True, help='Path to the model checkpoint (*.model or *.int8.model)')
+    parser.add_argument('-vocab', required=True, help='Path to the vocab.pt generated by preprocess.py')
+    parser.add_argument('-config', default=None, help='Path to the *.initial.config of the experiment, found in the folder of -model by default')
+    parser.add_argument('-shard_size', type=int, default=10000, help='Number of lines per shard')
+    parser.add_argument('-num_workers', type=int, default=4, help='Number of worker processes')
+    parser.add_argument('-threads_per_worker', type=int, default=1, help='torch.set_num_threads() of each worker')
+    parser.add_argument('-batch_size', type=int, default=16, help='Number of documents per beam search')
+    parser.add_argument('-text_fields', type=str, nargs='+', default=['title', 'abstract'],
+                        help='Fields of a JSON object to concatenate as the source text')
+    parser.add_argument('-id_field', type=str, default='id', help='Field of a JSON object copied to the output')
+    parser.add_argument('-top_k', type=int, default=10, help='Maximum number of keyphrases per document, 0 returns all')
+    parser.add_argument('-beam_size', type=int, default=None, help='Overrides the beam size of the config')
+    parser.add_argument('-max_sent_length', type=int, default=None, help='Overrides the maximum keyphrase length of the config')
+    parser.add_argument('-max_src_length', type=int, default=None, help='Truncate the source text to the first N tokens')
+    parser.add_argument('-include_absent', action='store_true', help='Also return the keyphrases that do not appear in the source text')
+    opt = parser.parse_args()
+
+    if not os.path.exists(opt.output_dir):
+        os.makedirs(opt.output_dir)
+    logger = config.init_logging('bulk_predict', os.path.join(opt.output_dir, 'bulk_predict.log'), redirect_to_stdout=True)
+
+    manifest = load_manifest(opt)
+    # a shard is finished only if it is in the manifest and its output exists
+    todo_shards = [(shard_id, offset, num_lines) for shard_id, (offset, num_lines) in enumerate(manifest['shards'])
+                   if str(shard_id) not in manifest['completed'] or not os.path.exists(shard_path(opt.output_dir, shard_id))]
+    logger.info('#(shards)=%d, #(finished)=%d, #(todo)=%d, num_workers=%d, threads_per_worker=%d'
+                % (len(manifest['shards']), len(manifest['shards']) - len(todo_shards), len(todo_shards), opt.num_workers, opt.threads_per_worker))
+    save_manifest(opt, manifest)
+
+    start_time = time.time()
+    num_docs = 0
+    # the elapsed time excludes loading the models in workers
+    decoding_seconds = 0.0
+    # spawn rather than fork, the workers should not inherit the torch thread pools of the parent
+    pool = multiprocessing.get_context('spawn').Pool(opt.num_workers, initializer=init_worker, initargs=(opt,))
+    try:
+        for shard_id, shard_num_docs, shard_num_errors, shard_elapsed in pool.imap_unordered(process_shard, todo_shards):
+            num_docs += shard_num_docs
+            decoding_seconds += shard_elapsed
+            manifest['completed'][str(shard_id)] = {'num_docs': shard_num_docs, 'num_errors': shard_num_errors, 'seconds': shard_elapsed}
+            save_manifest(opt, manifest)
+            elapsed = time.time() - start_time
+            logger.info('shard %d done: %d docs (%d invalid) in %.1fs, progress %d/%d shards, %.2f docs/sec overall'
+                        % (shard_id, shard_num_docs, shard_num_errors, shard_elapsed, len(manifest['completed']), len(manifest['shards']), num_docs / elapsed))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    elapsed = time.time() - start_time
+    if num_docs > 0:
+        manifest['runs'].append({'num_workers': opt.num_workers, 'threads_per_worker': opt.threads_per_worker,
+                                 'num_docs': num_docs, 'seconds': elapsed, 'docs_per_sec': num_docs / elapsed,
+                                 'docs_per_sec_per_worker': num_docs / decoding_seconds if decoding_seconds > 0 else 0.0})
+        save_manifest(opt, manifest)
+    logger.info('Finished %d docs in %.1fs (%.2f docs/sec) with %d workers * %d threads'
+                % (num_docs, elapsed, num_docs / elapsed if elapsed > 0 else 0.0, opt.num_workers, opt.threads_per_worker))
+    for run in manifest['runs']:
+        logger.info('\tnum_workers=%d, threads_per_worker=%d: %.2f docs/sec, %.2f docs/sec per worker (excluding startup)'
+                    % (run['num_workers'], run['threads_per_worker'], run['docs_per_sec'], run.get('docs_per_sec_per_worker', 0.0)))
+
+
+if __name__ == '__main__':
+    main()
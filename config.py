@@ -76,6 +76,12 @@ def init_opt(description):
         prev_opt.run_valid_every = opt.run_valid_every
         prev_opt.report_every = opt.report_every
         prev_opt.test_dataset_names = opt.test_dataset_names
+        prev_opt.vocab_shortlist_size = opt.vocab_shortlist_size
+        prev_opt.compare_vocab_shortlist = opt.compare_vocab_shortlist
+        prev_opt.quantize = opt.quantize
+        prev_opt.torchscript = opt.torchscript
+        prev_opt.profile_memory = opt.profile_memory
+        prev_opt.profile_memory_every = opt.profile_memory_every
 
         prev_opt.exp = opt.exp
         prev_opt.vocab = opt.vocab
@@ -236,7 +242,16 @@ def preprocess_opts(parser):
     parser.add_argument('-max_unk_words', type=int, default=1000,
                         help="Maximum number of unknown words the model supports (mainly for masking in loss).")
 
-    parser.add_argument('-words_min_frequency', type=int, default=0)
+    parser.add_argument('-words_min_frequency', type=int, default=0,
+                        help="Discard the words that appear less than N times in the vocab file, 0 keeps all")
+    parser.add_argument('-vocab_workers', type=int, default=0,
+                        help="Build the vocab by streaming the training json in chunks with this number of processes (pykp.io.build_vocab_parallel), "
+                             "the workers also return the tokenized training pairs, thus the training file is tokenized only once (without the _tokenized.tmp cache). "
+                             "0 builds it from the tokenized pairs in one process, both give the same vocab")
+    parser.add_argument('-vocab_chunk_size', type=int, default=10000,
+                        help="Number of json lines per chunk for -vocab_workers")
+    parser.add_argument('-vocab_max_size', type=int, default=0,
+                        help="Keep only the top N frequent words in the vocab file, 0 keeps all (the model uses the top -vocab_size)")
 
     # Length filter options
     parser.add_argument('-max_src_seq_length', type=int, default=300,
@@ -347,6 +362,15 @@ def train_opts(parser):
                         help="""0: ori, 1: running average as baseline""")
     parser.add_argument('-rl_start_epoch', default=2, type=int,
                         help="""from which epoch rl training starts""")
+    parser.add_argument('-sampled_softmax', action="store_true", default=False,
+                        help='Train ML with a sampled softmax (Jean et al. 2015): the output layer only scores a candidate set '
+                             'shared by the batch (target words, source words for copying and sampled negatives), '
+                             'the logits of the negatives are corrected by the log probability of being sampled. '
+                             'Validation/testing always use the full softmax')
+    parser.add_argument('-num_negative_samples', type=int, default=4096,
+                        help='Number of negative words drawn from a log-uniform (Zipfian) distribution over the vocab for each batch of sampled softmax')
+    parser.add_argument('-max_train_examples', type=int, default=-1,
+                        help='Only use the first N training examples (e.g. 20000 to compare the speed/convergence of training modes), -1 to use all')
     # GPU
 
     # Teacher Forcing and Scheduled Sampling
@@ -388,6 +412,19 @@ def train_opts(parser):
                         help="Run validation test at this interval (every run_valid_every batches)")
     parser.add_argument('-early_stop_tolerance', type=int, default=10,
                         help="Stop training if it doesn't improve any more for serveral rounds of validation")
+    parser.add_argument('-async_valid', action="store_true",
+                        help="Run the beam search validation/testing in a background process on a snapshot of the weights, "
+                             "training continues meanwhile and the scores are fed back to early-stopping once they are ready")
+    parser.add_argument('-async_valid_threads', type=int, default=1,
+                        help="Number of torch threads used by the background validation process")
+    parser.add_argument('-async_valid_queue_size', type=int, default=2,
+                        help="Maximum number of weight snapshots waiting or under validation, "
+                             "new snapshots are skipped when the queue is full")
+    parser.add_argument('-profile_memory', action="store_true",
+                        help="Account the memory of the training examples per field, the peak RSS of each DataLoader worker and "
+                             "the activation memory of training steps, the records are written to <log_path>/memory.jsonl (see pykp/memory_profiler.py)")
+    parser.add_argument('-profile_memory_every', type=int, default=100,
+                        help="Profile the activation memory of one training step every this many steps")
 
     timemark = time.strftime('%Y%m%d-%H%M%S', time.localtime(time.time()))
 
@@ -434,6 +471,19 @@ def predict_opts(parser):
                         default=['inspec', 'nus', 'semeval', 'krapivin', 'duc', 'kp20k', 'stackexchange'],
                         help='Name of each test dataset, also the name of folder from which we load processed test dataset.')
 
+    parser.add_argument('-vocab_shortlist_size', type=int, default=0,
+                        help='If > 0, beam search only scores a per-batch shortlist: the source words, this many most frequent keyphrase words '
+                             'in training data (cached next to -data) and the special tokens, instead of the full vocab. Much faster on CPU')
+    parser.add_argument('-compare_vocab_shortlist', action="store_true",
+                        help='Also run the full-vocab beam search and report the F@5/F@10 differences of the shortlist')
+    parser.add_argument('-quantize', action="store_true",
+                        help='CPU inference with dynamic int8 quantization of the LSTM and Linear layers. '
+                             'The fp32 checkpoint given by -train_from is quantized and saved next to it as *.int8.model, '
+                             'a *.int8.model checkpoint is loaded as quantized directly')
+    parser.add_argument('-torchscript', action="store_true",
+                        help='Run beam search with the TorchScript-compiled encoder and single-step decoder (pykp/scripted.py), '
+                             'the compiled modules are also saved next to -train_from as *.encoder.ts and *.decode_step.ts')
+
     # parser.add_argument('-num_oneword_seq', type=int, default=10000,
     #                     help='Source sequence to decode (one line per sequence)')
     # parser.add_argument('-report_score_names', type=str, nargs='+', default=['f_score@5#oneword=-1', 'f_score@10#oneword=-1', 'f_score@5#oneword=1', 'f_score@10#oneword=1'], help="""Default measure to report""")
@@ -3,10 +3,7 @@ import math
 import logging
 import string
 
-import nltk
-import scipy
 import torch
-from nltk.stem.porter import *
 import numpy as np
 from collections import Counter
 
@@ -17,9 +14,17 @@ from torch.autograd import Variable
 import config
 import pykp
 from utils import Progbar
-from pykp.metric.bleu import bleu
 
-stemmer = PorterStemmer()
+# nltk takes more than a second to import (it pulls scipy.stats), thus the stemmer and bleu are loaded on the first use
+stemmer = None
+
+
+def get_stemmer():
+    global stemmer
+    if stemmer is None:
+        from nltk.stem.porter import PorterStemmer
+        stemmer = PorterStemmer()
+    return stemmer
 
 def process_predseqs(pred_seqs, oov, id2word, opt):
     '''
@@ -103,6 +108,7 @@ def if_present_phrase(src_str_tokens, phrase_str_tokens):
     :param phrase_str_tokens: a list of strings (words) of a phrase
     :return:
     """
+    match_flag = False
     match_pos_idx = -1
     for src_start_idx in range(len(src_str_tokens) - len(phrase_str_tokens) + 1):
         match_flag = True
@@ -157,6 +163,9 @@ def if_present_duplicate_phrases(src_str, trgs_str, do_stemming=True, check_dupl
 
 
 def evaluate_beam_search(generator, data_loader, opt, title='', epoch=1, predict_save_path=None):
+    # scipy.sparse is slow to import, thus loaded on the first evaluation like the stemmer and bleu
+    from pykp.metric import diversity
+
     logger = config.init_logging(title, predict_save_path + '/%s.log' % title, redirect_to_stdout=False)
     progbar = Progbar(logger=logger, title=title, target=len(data_loader.dataset.examples), batch_size=data_loader.batch_size,
                       total_examples=len(data_loader.dataset.examples))
@@ -182,7 +191,9 @@ def evaluate_beam_search(generator, data_loader, opt, title='', epoch=1, predict
         print("src size - %s" % str(src_list.size()))
         print("target size - %s" % len(trg_copy_target_list))
 
-        pred_seq_list = generator.beam_search(src_list, src_len, src_oov_map_list, oov_list, opt.word2id)
+        # no gradient is needed in evaluation, which also lets the model reuse its decoding buffers
+        with torch.no_grad():
+            pred_seq_list = generator.beam_search(src_list, src_len, src_oov_map_list, oov_list, opt.word2id)
 
         '''
         process each example in current batch
@@ -297,6 +308,17 @@ def evaluate_beam_search(generator, data_loader, opt, title='', epoch=1, predict
                             str(np.average(score_dict['recall@%d_soft' % (topk)])) + " , " +\
                             str(np.average(score_dict['f_score@%d_soft' % (topk)]))
 
+            # redundancy among the top predictions, both metrics share one bag-of-words matrix
+            # an example without predictions gets None rather than being skipped, thus the lists align with precision/recall
+            for topk in topk_range:
+                diversity_results = diversity.diversity_scores(filtered_pred_str_seqs[:topk])
+                for k, v in diversity_results.items():
+                    if '%s@%d' % (k, topk) not in score_dict:
+                        score_dict['%s@%d' % (k, topk)] = []
+                    score_dict['%s@%d' % (k, topk)].append(v)
+                print_out += "\n ------------------------------------------------- DIVERSITY, k=%d" % (topk)
+                print_out += "\n --- batch self-redundancy f1, jaccard: " + str(diversity_results['self_redundancy_f1']) + " , " + str(diversity_results['self_redundancy_jaccard'])
+
             print_out += "\n ======================================================="
             logger.info(print_out)
 
@@ -415,6 +437,7 @@ def evaluate_greedy(model, data_loader, test_examples, opt):
 
 
 def stem_word_list(word_list):
+    stemmer = get_stemmer()
     return [stemmer.stem(w.strip().lower()) for w in word_list]
 
 
@@ -451,6 +474,11 @@ def get_match_result(true_seqs, pred_seqs, do_stem=True, type='exact'):
         true_seqs = [stem_word_list(seq) for seq in true_seqs]
         pred_seqs = [stem_word_list(seq) for seq in pred_seqs]
 
+    if type == 'bleu':
+        from pykp.metric.bleu import BleuScorer
+        # the n-gram tables of true_seqs are built once and shared by all the predictions
+        bleu_scorer = BleuScorer(true_seqs, [0.1, 0.3, 0.6])
+
     for pred_id, pred_seq in enumerate(pred_seqs):
         if type == 'exact':
             match_score[pred_id] = 0
@@ -480,7 +508,7 @@ def get_match_result(true_seqs, pred_seqs, do_stem=True, type='exact'):
 
         elif type == 'bleu':
             # account for the match of subsequences, like n-gram-based (BLEU) or LCS-based
-            match_score[pred_id] = bleu(pred_seq, true_seqs, [0.1, 0.3, 0.6])
+            match_score[pred_id] = bleu_scorer.score(pred_seq)
 
     return match_score
 
@@ -517,20 +545,6 @@ def f1_score(prediction, ground_truth):
 
 def self_redundancy(_input):
     # _input shoule be list of list of words
-    if len(_input) == 0:
-        return None
-    _len = len(_input)
-    scores = np.ones((_len, _len), dtype="float32") * -1.0
-    for i in range(_len):
-        for j in range(_len):
-            if scores[i][j] != -1:
-                continue
-            elif i == j:
-                scores[i][j] = 0.0
-            else:
-                f1 = f1_score(_input[i], _input[j])
-                scores[i][j] = f1
-                scores[j][i] = f1
-    res = np.max(scores, 1)
-    res = np.mean(res)
-    return res
+    # the pairwise f1_score of all the sequences is computed with one sparse matrix product, see pykp.metric.diversity
+    from pykp.metric import diversity
+    return diversity.self_redundancy(_input, metric='f1')
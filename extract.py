@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming keyphrase extraction: read JSONL documents from stdin and write one JSONL result per document to stdout, e.g.
+    cat docs.jsonl | python extract.py -model exp/kp20k.ml.copy/model/kp20k.ml.copy.epoch=1.batch=1000.total_batch=1000.model -vocab data/kp20k/kp20k.vocab.pt > keyphrases.jsonl
+Each input line is {"id": ..., "title": ..., "abstract": ...} (see -text_fields) or a JSON string of raw text,
+    each output line is {"id": ..., "keyphrases": [{"phrase": ..., "score": ..., "present": ...}, ...]},
+    or {"id": ..., "error": ...} if the input line is not a valid document
+"""
+import argparse
+import json
+import logging
+import sys
+
+from pykp.cache import PredictionCache
+from pykp.extractor import KeyphraseExtractor
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+def read_batches(input_file, batch_size):
+    batch = []
+    for line in input_file:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='extract.py', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-model', required=True, help='Path to the model checkpoint (*.model or *.int8.model)')
+    parser.add_argument('-vocab', required=True, help='Path to the vocab.pt generated by preprocess.py')
+    parser.add_argument('-config', default=None, help='Path to the *.initial.config of the experiment, found in the folder of -model by default')
+    parser.add_argument('-text_fields', type=str, nargs='+', default=['title', 'abstract'],
+                        help='Fields of a JSON object to concatenate as the source text')
+    parser.add_argument('-id_field', type=str, default='id', help='Field of a JSON object copied to the output')
+    parser.add_argument('-top_k', type=int, default=10, help='Maximum number of keyphrases per document, 0 returns all')
+    parser.add_argument('-batch_size', type=int, default=8, help='Number of documents per beam search')
+    parser.add_argument('-beam_size', type=int, default=None, help='Overrides the beam size of the config')
+    parser.add_argument('-max_sent_length', type=int, default=None, help='Overrides the maximum keyphrase length of the config')
+    parser.add_argument('-max_src_length', type=int, default=None, help='Truncate the source text to the first N tokens')
+    parser.add_argument('-include_absent', action='store_true', help='Also return the keyphrases that do not appear in the source text')
+    parser.add_argument('-torchscript', action='store_true', help='Decode with the TorchScript modules')
+    parser.add_argument('-cache_size', type=int, default=0, help='Number of predictions cached in memory, 0 disables the memory cache')
+    parser.add_argument('-cache_path', type=str, default=None, help='Path of the sqlite file to persist the cached predictions')
+    parser.add_argument('-cache_disk_size', type=int, default=1000000, help='Maximum number of predictions cached on disk')
+    opt = parser.parse_args()
+
+    # stdout is reserved for the results
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s [%(levelname)s] %(module)s: %(message)s')
+
+    cache = None
+    if opt.cache_size > 0 or opt.cache_path:
+        cache = PredictionCache(memory_size=opt.cache_size, disk_path=opt.cache_path, disk_size=opt.cache_disk_size)
+    extractor = KeyphraseExtractor(opt.model, opt.vocab, config_path=opt.config,
+                                   beam_size=opt.beam_size, max_sent_length=opt.max_sent_length,
+                                   batch_size=opt.batch_size, max_src_length=opt.max_src_length,
+                                   must_appear_in_src=not opt.include_absent, torchscript=opt.torchscript, cache=cache)
+
+    for batch in read_batches(sys.stdin, opt.batch_size):
+        for output in extractor.extract_json_lines(batch, opt.text_fields, opt.id_field, top_k=opt.top_k):
+            if 'error' in output:
+                logging.warning('Skip a line: %s' % output['error'])
+            sys.stdout.write(json.dumps(output) + '\n')
+        sys.stdout.flush()
+
+    if cache is not None:
+        logging.info('Prediction cache: %s' % json.dumps(cache.stats()))
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,9 @@ from train import load_data_vocab, init_model, init_optimizer_criterion
 from utils import Progbar, plot_learning_curve_and_write_csv
 
 import pykp
-from pykp.io import KeyphraseDatasetTorchText, KeyphraseDataset
+from pykp.io import KeyphraseDataset
+from pykp.vocab import load_vocab
+from pykp.scripted import script_model, save_scripted_model
 
 __author__ = "Rui Meng"
 __email__ = "rui.meng@pitt.edu"
@@ -28,11 +30,13 @@ logger = logging.getLogger()
 
 def load_vocab_and_testsets(opt):
     logger.info("Loading vocab from disk: %s" % (opt.vocab))
-    word2id, id2word, vocab = torch.load(opt.vocab, 'rb')
+    word2id, id2word, vocab = load_vocab(opt.vocab)
     opt.word2id = word2id
     opt.id2word = id2word
-    opt.vocab = vocab
-    logger.info('#(vocab)=%d' % len(vocab))
+    # the binary vocab has no word frequencies, keep opt.vocab as its path then
+    if vocab is not None:
+        opt.vocab = vocab
+    logger.info('#(vocab)=%d' % len(id2word))
     logger.info('#(vocab used)=%d' % opt.vocab_size)
 
     pin_memory = torch.cuda.is_available()
@@ -58,6 +62,24 @@ def load_vocab_and_testsets(opt):
     return test_one2many_loaders, word2id, id2word, vocab
 
 
+def load_keyphrase_shortlist(opt, word2id):
+    '''
+    Load the top-N frequent keyphrase words of training data for the shortlisted beam search, compute and cache it if not exists
+    '''
+    shortlist_path = opt.data + '.kp_shortlist.%d.pt' % opt.vocab_shortlist_size
+    if os.path.exists(shortlist_path):
+        logger.info("Loading keyphrase shortlist from disk: %s" % shortlist_path)
+        return torch.load(shortlist_path)
+
+    logger.info("Building keyphrase shortlist from '%s'" % (opt.data + '.train.one2many.pt'))
+    train_one2many = pykp.io.load_examples(opt.data, 'train', mode='one2many')
+    shortlist_ids = pykp.io.build_keyphrase_shortlist(train_one2many, word2id, opt.vocab_size, opt.vocab_shortlist_size)
+    torch.save(shortlist_ids, open(shortlist_path, 'wb'))
+    logger.info('#(shortlist)=%d, saved to %s' % (len(shortlist_ids), shortlist_path))
+
+    return shortlist_ids
+
+
 def main():
     opt = config.init_opt(description='predict.py')
     logger = config.init_logging('predict', opt.exp_path + '/output.log', redirect_to_stdout=False)
@@ -78,17 +100,45 @@ def main():
     try:
         test_data_loaders, word2id, id2word, vocab = load_vocab_and_testsets(opt)
         model = init_model(opt)
+        if opt.torchscript and opt.vocab_shortlist_size > 0:
+            # the scripted decode step always scores the full vocab, see ScriptedSeq2Seq.generate()
+            logger.warning('-torchscript does not support -vocab_shortlist_size, decoding with the eager model instead')
+        elif opt.torchscript:
+            model = script_model(model)
+            scripted_path_prefix = opt.train_from[: opt.train_from.rfind('.model')] if opt.train_from.endswith('.model') else opt.train_from
+            logger.info('Saving TorchScript modules to %s.encoder.ts/.decode_step.ts' % scripted_path_prefix)
+            save_scripted_model(model, scripted_path_prefix)
+        shortlist_ids = load_keyphrase_shortlist(opt, word2id) if opt.vocab_shortlist_size > 0 else None
         generator = SequenceGenerator(model,
                                       eos_id=opt.word2id[pykp.io.EOS_WORD],
                                       beam_size=opt.beam_size,
-                                      max_sequence_length=opt.max_sent_length
+                                      max_sequence_length=opt.max_sent_length,
+                                      shortlist_ids=shortlist_ids
                                       )
 
+        full_vocab_generator = None
+        if shortlist_ids is not None and opt.compare_vocab_shortlist:
+            full_vocab_generator = SequenceGenerator(model,
+                                                     eos_id=opt.word2id[pykp.io.EOS_WORD],
+                                                     beam_size=opt.beam_size,
+                                                     max_sequence_length=opt.max_sent_length
+                                                     )
+
         for testset_name, test_data_loader in zip(opt.test_dataset_names, test_data_loaders):
             logger.info('Evaluating %s' % testset_name)
-            evaluate_beam_search(generator, test_data_loader, opt,
-                                 title='test_%s' % testset_name,
-                                 predict_save_path=opt.pred_path + '/%s_test_result/' % (testset_name))
+            score_dict = evaluate_beam_search(generator, test_data_loader, opt,
+                                              title='test_%s' % testset_name,
+                                              predict_save_path=opt.pred_path + '/%s_test_result/' % (testset_name))
+
+            if full_vocab_generator:
+                full_vocab_score_dict = evaluate_beam_search(full_vocab_generator, test_data_loader, opt,
+                                                             title='test_%s_full_vocab' % testset_name,
+                                                             predict_save_path=opt.pred_path + '/%s_test_result_full_vocab/' % (testset_name))
+                logger.info('Shortlist (size=%d) vs. full vocab on %s' % (opt.vocab_shortlist_size, testset_name))
+                for score_name in ['f_score@5_exact', 'f_score@10_exact', 'f_score@5_soft', 'f_score@10_soft']:
+                    shortlist_score = np.average(score_dict[score_name])
+                    full_vocab_score = np.average(full_vocab_score_dict[score_name])
+                    logger.info('\t%s: shortlist=%.4f, full vocab=%.4f, diff=%.4f' % (score_name, shortlist_score, full_vocab_score, shortlist_score - full_vocab_score))
 
     except Exception as e:
         logger.error(e, exc_info=True)
@@ -8,6 +8,7 @@ import torch
 
 import config
 import pykp.io
+import pykp.vocab
 
 parser = argparse.ArgumentParser(
     description='preprocess.py',
@@ -51,12 +52,26 @@ def main():
         raise Exception('Unsupported dataset name=%s' % opt.dataset_name)
 
     print("Loading training/validation/test data...")
-    tokenized_train_pairs = pykp.io.load_src_trgs_pairs(source_json_path=opt.source_train_file,
-                                                        dataset_name=opt.dataset_name,
-                                                        src_fields=src_fields,
-                                                        trg_fields=trg_fields,
-                                                        opt=opt,
-                                                        valid_check=True)
+    if opt.vocab_workers > 0:
+        # the workers return the tokenized pairs along with the counts, thus the training file is tokenized only once
+        print("Building Vocab with %d workers..." % opt.vocab_workers)
+        word2id, id2word, vocab, tokenized_train_pairs = pykp.io.build_vocab_parallel(opt.source_train_file,
+                                                                                      src_fields=src_fields,
+                                                                                      trg_fields=trg_fields,
+                                                                                      opt=opt,
+                                                                                      valid_check=True,
+                                                                                      num_workers=opt.vocab_workers,
+                                                                                      chunk_size=opt.vocab_chunk_size,
+                                                                                      min_freq=opt.words_min_frequency,
+                                                                                      max_size=opt.vocab_max_size,
+                                                                                      return_pairs=True)
+    else:
+        tokenized_train_pairs = pykp.io.load_src_trgs_pairs(source_json_path=opt.source_train_file,
+                                                            dataset_name=opt.dataset_name,
+                                                            src_fields=src_fields,
+                                                            trg_fields=trg_fields,
+                                                            opt=opt,
+                                                            valid_check=True)
 
     tokenized_valid_pairs = pykp.io.load_src_trgs_pairs(source_json_path=opt.source_valid_file,
                                                         dataset_name=opt.dataset_name,
@@ -72,15 +87,19 @@ def main():
                                                        opt=opt,
                                                        valid_check=False)
 
-    print("Building Vocab...")
-    word2id, id2word, vocab = pykp.io.build_vocab(tokenized_train_pairs, opt)
+    if opt.vocab_workers == 0:
+        print("Building Vocab...")
+        word2id, id2word, vocab = pykp.io.build_vocab(tokenized_train_pairs, opt)
     print('Vocab size = %d' % len(vocab))
 
     print("Dumping dict to disk")
     opt.vocab_path = os.path.join(opt.subset_output_path, opt.dataset_name + '.vocab.pt')
     torch.save([word2id, id2word, vocab], open(opt.vocab_path, 'wb'))
+    # the compact vocab for fast startup of inference, see pykp/vocab.py
+    pykp.vocab.save_binary_vocab(id2word, opt.vocab_path[: -len('.pt')] + '.bin')
     opt.vocab_path = os.path.join(opt.output_path, opt.dataset_name + '.vocab.pt')
     torch.save([word2id, id2word, vocab], open(opt.vocab_path, 'wb'))
+    pykp.vocab.save_binary_vocab(id2word, opt.vocab_path[: -len('.pt')] + '.bin')
 
 
     print("Exporting a small dataset to %s (for debugging), "
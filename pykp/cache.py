@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of the predicted keyphrases of documents, the same abstracts recur frequently (re-crawls, duplicate papers across dumps).
+Two tiers: an in-memory LRU and an optional sqlite file on disk, both bounded by the number of entries.
+The key is a hash of the tokenized source text, the checkpoint and the decoding parameters, see PredictionCache.make_key().
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+logger = logging.getLogger()
+
+
+def checkpoint_id(model_path):
+    '''
+    Identify a checkpoint by its path, size and modification time, cheaper than hashing the whole file
+    '''
+    stat = os.stat(model_path)
+    return hashlib.sha1(('%s|%d|%d' % (os.path.abspath(model_path), stat.st_size, int(stat.st_mtime))).encode('utf-8')).hexdigest()
+
+
+class PredictionCache(object):
+    def __init__(self, memory_size=10000, disk_path=None, disk_size=1000000):
+        '''
+        :param memory_size: maximum number of entries in memory, 0 disables the memory tier
+        :param disk_path:   path of the sqlite file, no disk tier if None
+        :param disk_size:   maximum number of entries on disk, the least recently used ones are deleted if exceeded
+        '''
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = collections.OrderedDict()
+        # the cache is shared by the event loop and the decoding thread in serve.py
+        self.lock = threading.Lock()
+
+        self.num_memory_hits = 0
+        self.num_disk_hits = 0
+        self.num_misses = 0
+
+        self.disk = None
+        if disk_path:
+            self.disk = sqlite3.connect(disk_path, check_same_thread=False)
+            self.disk.execute('CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value TEXT, access_time REAL)')
+            self.disk.execute('CREATE INDEX IF NOT EXISTS predictions_access_time ON predictions (access_time)')
+            self.disk.commit()
+            self.disk_count = self.disk.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+            logger.info('Loaded prediction cache from %s, #(entries)=%d' % (disk_path, self.disk_count))
+
+    @staticmethod
+    def make_key(src_tokens, model_id, **decoding_params):
+        '''
+        :param src_tokens:     the tokenized (and truncated) source text
+        :param model_id:       e.g. checkpoint_id(model_path)
+        :param decoding_params: everything else that changes the predictions, e.g. beam_size and max_sent_length
+        '''
+        params = '|'.join(['%s=%s' % (k, str(v)) for k, v in sorted(decoding_params.items())])
+        return hashlib.sha1(('%s|%s|%s' % (model_id, params, ' '.join(src_tokens))).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''
+        :return: the cached value, or None if not found
+        '''
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.num_memory_hits += 1
+                return self.memory[key]
+
+            if self.disk is not None:
+                row = self.disk.execute('SELECT value FROM predictions WHERE key=?', (key,)).fetchone()
+                if row is not None:
+                    self.disk.execute('UPDATE predictions SET access_time=? WHERE key=?', (time.time(), key))
+                    self.disk.commit()
+                    value = json.loads(row[0])
+                    self._put_memory(key, value)
+                    self.num_disk_hits += 1
+                    return value
+
+            self.num_misses += 1
+            return None
+
+    def put(self, key, value):
+        '''
+        :param value: any json serializable object
+        '''
+        with self.lock:
+            self._put_memory(key, value)
+            if self.disk is not None:
+                if self.disk.execute('SELECT 1 FROM predictions WHERE key=?', (key,)).fetchone() is None:
+                    self.disk_count += 1
+                self.disk.execute('INSERT OR REPLACE INTO predictions (key, value, access_time) VALUES (?, ?, ?)', (key, json.dumps(value), time.time()))
+                if self.disk_count > self.disk_size:
+                    self.disk.execute('DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY access_time LIMIT ?)',
+                                      (self.disk_count - self.disk_size,))
+                    self.disk_count = self.disk_size
+                self.disk.commit()
+
+    def _put_memory(self, key, value):
+        if self.memory_size <= 0:
+            return
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        num_lookups = self.num_memory_hits + self.num_disk_hits + self.num_misses
+        return {
+            'num_lookups': num_lookups,
+            'num_memory_hits': self.num_memory_hits,
+            'num_disk_hits': self.num_disk_hits,
+            'num_misses': self.num_misses,
+            'hit_rate': float(self.num_memory_hits + self.num_disk_hits) / num_lookups if num_lookups > 0 else 0.0,
+            'memory_entries': len(self.memory),
+            'disk_entries': self.disk_count if self.disk is not None else 0,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Remove the near-duplicates of the test datasets (Inspec, SemEval, NUS, Krapivin etc., exported by test_dataset_producer.py)
+    from a training corpus (e.g. kp20k_training.json, the input of load_json_data()).
+Every document is represented by the MinHash signature of its word shingles of title+abstract. The test documents are indexed in
+    LSH bands (num_bands * rows_per_band = num_perm), each training document is only compared with the test documents sharing
+    at least one band with it, and is regarded as a duplicate if the Jaccard similarity of their shingles >= -threshold.
+    The training corpus is streamed through a pool of processes, the filtered corpus keeps the original lines in order.
+    python -m pykp.data.dedup -train_json source_data/kp20k/kp20k_training.json \
+        -test_json source_data/inspec/inspec_testing.json source_data/semeval/semeval_testing.json source_data/nus/nus_testing.json source_data/krapivin/krapivin_testing.json \
+        -output_json source_data/kp20k/kp20k_training.dedup.json -report source_data/kp20k/kp20k_training.dedup_report.tsv -num_workers 8
+"""
+import argparse
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+
+import numpy as np
+
+from pykp.io import copyseq_tokenize
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+logger = logging.getLogger()
+
+# a Mersenne prime, (a * x + b) never overflows uint64 for a, b, x < 2^31
+MERSENNE_PRIME = (1 << 31) - 1
+
+# the index of the test datasets and options in each worker process, see init_worker()
+worker_index = None
+worker_opt = None
+worker_hasher = None
+
+
+def document_shingles(doc, src_fields, shingle_size=3):
+    '''
+    :return: the set of hashed word shingles of the concatenated src_fields, as a sorted np.uint64 array
+    '''
+    tokens = copyseq_tokenize(' . '.join([doc.get(f, '') for f in src_fields]).lower())
+    if len(tokens) < shingle_size:
+        shingles = [' '.join(tokens)] if len(tokens) > 0 else []
+    else:
+        shingles = [' '.join(tokens[i: i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)]
+    return np.unique(np.asarray([zlib.crc32(s.encode('utf-8')) % MERSENNE_PRIME for s in shingles], dtype=np.uint64))
+
+
+def jaccard(shingles1, shingles2):
+    num_common = len(np.intersect1d(shingles1, shingles2, assume_unique=True))
+    return float(num_common) / (len(shingles1) + len(shingles2) - num_common)
+
+
+class MinHasher(object):
+    def __init__(self, num_perm=128, seed=1):
+        '''
+        :param num_perm: number of hash functions (a * x + b) mod p, the length of signatures
+        '''
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+    def signature(self, shingles):
+        '''
+        :param shingles: np.uint64 array of hashed shingles (< MERSENNE_PRIME)
+        :return: np.uint64 array of num_perm, the minimum of each hash function over the shingles
+        '''
+        if len(shingles) == 0:
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint64)
+        return ((np.outer(shingles, self.a) + self.b) % MERSENNE_PRIME).min(axis=0)
+
+
+class LSHIndex(object):
+    def __init__(self, num_perm=128, num_bands=16):
+        '''
+        Two signatures become candidates if they are identical in any band of num_perm / num_bands rows,
+            the similarity threshold is about (1 / num_bands) ^ (num_bands / num_perm)
+        '''
+        assert num_perm % num_bands == 0, 'num_perm should be divisible by num_bands'
+        self.num_bands = num_bands
+        self.rows_per_band = num_perm // num_bands
+        self.buckets = [collections.defaultdict(list) for _ in range(num_bands)]
+        self.items = []
+
+    def band_keys(self, signature):
+        return [signature[i * self.rows_per_band: (i + 1) * self.rows_per_band].tobytes() for i in range(self.num_bands)]
+
+    def add(self, signature, item):
+        '''
+        :param item: anything returned by query(), e.g. (dataset name, doc id, shingles)
+        '''
+        item_id = len(self.items)
+        self.items.append((signature, item))
+        for band, key in enumerate(self.band_keys(signature)):
+            self.buckets[band][key].append(item_id)
+
+    def query(self, signature):
+        '''
+        :return: a list of (estimated similarity, item) of the candidates
+        '''
+        candidate_ids = set()
+        for band, key in enumerate(self.band_keys(signature)):
+            candidate_ids.update(self.buckets[band].get(key, []))
+        return [(float(np.mean(self.items[i][0] == signature)), self.items[i][1]) for i in sorted(candidate_ids)]
+
+    def __len__(self):
+        return len(self.items)
+
+
+def build_test_index(test_json_paths, opt):
+    '''
+    :return: LSHIndex of the documents in test_json_paths, items are (test dataset name, doc id, title, shingles)
+    '''
+    hasher = MinHasher(opt.num_perm, seed=opt.seed)
+    index = LSHIndex(opt.num_perm, opt.num_bands)
+    for test_json_path in test_json_paths:
+        test_name = os.path.basename(test_json_path)[: -len('.json')] if test_json_path.endswith('.json') else os.path.basename(test_json_path)
+        with open(test_json_path, 'r') as test_json:
+            for line_id, line in enumerate(test_json):
+                if len(line.strip()) == 0:
+                    continue
+                doc = json.loads(line)
+                shingles = document_shingles(doc, opt.src_fields, opt.shingle_size)
+                if len(shingles) == 0:
+                    continue
+                index.add(hasher.signature(shingles), (test_name, doc.get('name', str(line_id)), doc.get('title', ''), shingles))
+        logger.info('Indexed %s, #(test docs in total)=%d' % (test_json_path, len(index)))
+    return index
+
+
+def init_worker(index, opt):
+    global worker_index, worker_opt, worker_hasher
+    worker_index = index
+    worker_opt = opt
+    worker_hasher = MinHasher(opt.num_perm, seed=opt.seed)
+
+
+def match_lines(lines):
+    '''
+    :param lines: a chunk of json lines of the training corpus
+    :return: for each line, a list of (test name, test doc id, test title, estimated similarity, jaccard similarity) of the duplicates
+    '''
+    results = []
+    for line in lines:
+        matches = []
+        if len(line.strip()) > 0:
+            doc = json.loads(line)
+            shingles = document_shingles(doc, worker_opt.src_fields, worker_opt.shingle_size)
+            # an empty document is not a duplicate of anything
+            if len(shingles) == 0:
+                results.append(matches)
+                continue
+            for estimated, (test_name, test_id, test_title, test_shingles) in worker_index.query(worker_hasher.signature(shingles)):
+                similarity = jaccard(shingles, test_shingles)
+                if similarity >= worker_opt.threshold:
+                    matches.append((test_name, test_id, test_title, estimated, similarity))
+        results.append(matches)
+    return results
+
+
+def read_chunks(json_path, chunk_size):
+    chunk = []
+    with open(json_path, 'r') as json_file:
+        for line in json_file:
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def dedup(opt):
+    start_time = time.time()
+    index = build_test_index(opt.test_json, opt)
+
+    if opt.num_workers > 0:
+        pool = multiprocessing.Pool(opt.num_workers, initializer=init_worker, initargs=(index, opt))
+        # imap keeps the order of chunks, thus the filtered corpus is in the original order
+        chunk_results = pool.imap(match_lines, read_chunks(opt.train_json, opt.chunk_size))
+    else:
+        pool = None
+        init_worker(index, opt)
+        chunk_results = map(match_lines, read_chunks(opt.train_json, opt.chunk_size))
+
+    num_lines = 0
+    num_duplicates = 0
+    test_match_counts = collections.Counter()
+    matched_test_docs = set()
+    chunks = read_chunks(opt.train_json, opt.chunk_size)
+    with open(opt.output_json, 'w') as output_json, open(opt.report, 'w') as report:
+        report.write('train_line\ttrain_title\ttest_dataset\ttest_doc\ttest_title\tminhash_similarity\tjaccard_similarity\n')
+        for lines, results in zip(chunks, chunk_results):
+            for line, matches in zip(lines, results):
+                if len(matches) == 0:
+                    output_json.write(line)
+                else:
+                    num_duplicates += 1
+                    train_title = json.loads(line).get('title', '').replace('\t', ' ').replace('\n', ' ')
+                    for test_name, test_id, test_title, estimated, similarity in matches:
+                        test_match_counts[test_name] += 1
+                        matched_test_docs.add((test_name, test_id))
+                        report.write('%d\t%s\t%s\t%s\t%s\t%.4f\t%.4f\n' % (num_lines, train_title, test_name, test_id,
+                                                                         test_title.replace('\t', ' ').replace('\n', ' '), estimated, similarity))
+                num_lines += 1
+            logger.info('Processed %d training docs, found %d duplicates, %.1f docs/sec' % (num_lines, num_duplicates, num_lines / (time.time() - start_time)))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    logger.info('Done in %.1fs: removed %d/%d training docs, kept %d in %s, report in %s'
+                % (time.time() - start_time, num_duplicates, num_lines, num_lines - num_duplicates, opt.output_json, opt.report))
+    for test_name, count in sorted(test_match_counts.items()):
+        logger.info('\t%s: %d matched pairs, %d test docs have duplicates in training data'
+                    % (test_name, count, len([1 for name, _ in matched_test_docs if name == test_name])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='dedup.py', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-train_json', required=True, help='The training corpus, one json document per line')
+    parser.add_argument('-test_json', required=True, nargs='+', help='The test datasets, e.g. inspec_testing.json by test_dataset_producer.py')
+    parser.add_argument('-output_json', required=True, help='The training corpus without the duplicates')
+    parser.add_argument('-report', required=True, help='TSV of the removed training docs, their matched test docs and similarities')
+    parser.add_argument('-src_fields', type=str, nargs='+', default=['title', 'abstract'], help='Fields to compare')
+    parser.add_argument('-shingle_size', type=int, default=3, help='Number of words per shingle')
+    parser.add_argument('-num_perm', type=int, default=128, help='Length of the MinHash signatures')
+    parser.add_argument('-num_bands', type=int, default=16, help='Number of LSH bands, more bands find more candidates of lower similarity')
+    parser.add_argument('-threshold', type=float, default=0.7, help='Minimum Jaccard similarity of shingles to be regarded as duplicates')
+    parser.add_argument('-num_workers', type=int, default=4, help='Number of processes, 0 runs in the main process')
+    parser.add_argument('-chunk_size', type=int, default=1000, help='Number of training lines per task of the workers')
+    parser.add_argument('-seed', type=int, default=1)
+    opt = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(module)s: %(message)s')
+    dedup(opt)
+
+
+if __name__ == '__main__':
+    main()
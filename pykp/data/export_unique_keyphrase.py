@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 """
-Python File Template 
+Go over the source json files and export the unique keyphrases, their frequencies and the keyphrases grouped by number of tokens
+    to <source_dir>/<dataset>/keyword_stats/.
+The files are streamed in chunks of lines counted by a pool of processes, so the memory is bounded by the number of unique keyphrases
+    rather than the number of papers, and each unique keyphrase is tokenized only once.
+    python -m pykp.data.export_unique_keyphrase -source_dir source_data -num_workers 8
 """
+import argparse
+import collections
 import json
+import multiprocessing
 import os
 
 from pykp.io import copyseq_tokenize
@@ -10,26 +17,103 @@ from pykp.io import copyseq_tokenize
 __author__ = "Rui Meng"
 __email__ = "rui.meng@pitt.edu"
 
-if __name__ == '__main__':
+
+def count_keywords_in_lines(args):
+    '''
+    :param args: (a chunk of json lines, name of the keyword field)
+    :return: Counter of the keywords, in the order of first occurrence
+    '''
+    lines, kw_key_name = args
+    keyword_counter = collections.Counter()
+    for line in lines:
+        keyword_counter.update(json.loads(line)[kw_key_name].split(';'))
+    return keyword_counter
+
+
+def read_line_chunks(file_path, kw_key_name, chunk_size):
+    chunk = []
+    with open(file_path, 'r') as paper_file:
+        for line in paper_file:
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk, kw_key_name
+                chunk = []
+    if len(chunk) > 0:
+        yield chunk, kw_key_name
+
+
+def count_keywords(file_path, kw_key_name, pool=None, chunk_size=10000):
+    '''
+    Stream the file and count the keywords (delimited by ';')
+    :return: Counter of the keywords, in the order of first occurrence as if counted sequentially
+    '''
+    chunks = read_line_chunks(file_path, kw_key_name, chunk_size)
+    # imap keeps the order of chunks
+    chunk_counters = pool.imap(count_keywords_in_lines, chunks) if pool is not None else map(count_keywords_in_lines, chunks)
+
+    keyword_counter = collections.Counter()
+    for chunk_counter in chunk_counters:
+        keyword_counter.update(chunk_counter)
+    return keyword_counter
+
+
+def export_keyword_stats(keyword_counter, keyword_lengths, output_dir, data_type):
+    '''
+    :param keyword_counter: Counter of keywords
+    :param keyword_lengths: number of tokens of each keyword
+    '''
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    print("export the keyword list")
+    with open(os.path.join(output_dir, '%s_unique_keyword.txt' % data_type), 'w') as output_file:
+        for kw in sorted(keyword_counter.keys()):
+            output_file.write(kw + '\n')
+
+    print("export the keyword list with frequency")
+    keyword_count_items = sorted(keyword_counter.items(), key=lambda k: k[1], reverse=True)
+    with open(os.path.join(output_dir, '%s_unique_keyword_freq.txt' % data_type), 'w') as output_file:
+        for kw, kw_freq in keyword_count_items:
+            output_file.write('%s\t%d\n' % (kw, kw_freq))
+
+    print("export the keyword list separated by length")
+    length_dir = os.path.join(output_dir, '%s_unique_keyword_by_length' % data_type)
+    if not os.path.exists(length_dir):
+        os.makedirs(length_dir)
+    length_keyword_dict = collections.defaultdict(list)
+    # keyword_count_items is sorted by frequency, so is each bucket
+    for kw, kw_freq in keyword_count_items:
+        length_keyword_dict[keyword_lengths[kw]].append((kw, kw_freq))
+    for kw_len, kw_count_list_at_leng_k in sorted(length_keyword_dict.items(), key=lambda k: k[0]):
+        with open(os.path.join(length_dir, 'len_%d.txt' % kw_len), 'w') as output_file:
+            for kw, kw_freq in kw_count_list_at_leng_k:
+                output_file.write('%s\t%d\n' % (kw, kw_freq))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export_unique_keyphrase.py')
+    parser.add_argument('-source_dir', default='../../source_data', help='Folder of <dataset>/<dataset>_<data_type>.json')
+    parser.add_argument('-datasets', nargs='+', default=['inspec', 'nus', 'semeval', 'krapivin', 'duc', 'kp20k', 'stackexchange'])
+    parser.add_argument('-num_workers', type=int, default=4, help='Number of processes counting the chunks, 0 counts in the main process')
+    parser.add_argument('-chunk_size', type=int, default=10000, help='Number of lines per chunk')
+    opt = parser.parse_args()
+
     '''
     Go over the whole kp20k dataset and count the number of phrases
     Note that the targets processed here contain many noises, which may have been removed during preprocessing
     '''
-    dataset_names = ['inspec', 'nus', 'semeval', 'krapivin', 'duc', 'kp20k', 'stackexchange']
-    # dataset_names = ['stackexchange']
-    for dataset_name in dataset_names:
+    pool = multiprocessing.Pool(opt.num_workers) if opt.num_workers > 0 else None
+    # number of tokens of each unique keyword, shared by all the files
+    keyword_lengths = {}
+    for dataset_name in opt.datasets:
         kw_key_name = 'keyword'
         if dataset_name == 'stackexchange':
             kw_key_name = 'tags'
 
-        source_dir = '../../source_data/%s/' % dataset_name
+        source_dir = os.path.join(opt.source_dir, dataset_name)
         data_types = ['training', 'validation', 'testing']
 
         for data_type in data_types:
-            papers = []
-            keyword_count_dict = dict()
-            length_keyword_dict = dict()
-
             source_files_name = '%s_%s.json' % (dataset_name, data_type)
             source_file_path = os.path.join(source_dir, source_files_name)
             print(source_files_name)
@@ -40,45 +124,18 @@ if __name__ == '__main__':
             else:
                 continue
 
-            with open(source_file_path, 'r') as paper_file:
-                for line in paper_file:
-                    papers.append(json.loads(line))
-
-            for paper in papers:
-                # print(paper['keyword'])
-                for kw in paper[kw_key_name].split(';'):
-                    trg_tokens = copyseq_tokenize(kw)
-                    kw_freq = keyword_count_dict.get(kw, 0)
-                    keyword_count_dict[kw] = kw_freq + 1
-
-                    length_keyword_set = length_keyword_dict.get(len(trg_tokens), set())
-                    length_keyword_set.add(kw)
-                    length_keyword_dict[len(trg_tokens)] = length_keyword_set
-
-
-            print("export the keyword list")
-            keyword_list = sorted(keyword_count_dict.keys())
-            if not os.path.exists(os.path.join(source_dir, 'keyword_stats')):
-                os.makedirs(os.path.join(source_dir, 'keyword_stats'))
-            output_file_path = os.path.join(source_dir, 'keyword_stats', '%s_unique_keyword.txt' % data_type)
-            with open(output_file_path, 'w') as output_file:
-                for kw in keyword_list:
-                    output_file.write(kw + '\n')
-
-            print("export the keyword list with frequency")
-            keyword_count_items = sorted(keyword_count_dict.items(), key=lambda k:k[1], reverse=True)
-            output_file_path = os.path.join(source_dir, 'keyword_stats', '%s_unique_keyword_freq.txt' % data_type)
-            with open(output_file_path, 'w') as output_file:
-                for kw, kw_freq in keyword_count_items:
-                    output_file.write('%s\t%d\n' % (kw, kw_freq))
-
-            print("export the keyword list separated by length")
-            for kw_len, kw_list in sorted(length_keyword_dict.items(), key=lambda k:k[0]):
-                if not os.path.exists(os.path.join(source_dir, 'keyword_stats', '%s_unique_keyword_by_length' % data_type)):
-                    os.makedirs(os.path.join(source_dir, 'keyword_stats', '%s_unique_keyword_by_length' % data_type))
-                output_file_path = os.path.join(source_dir, 'keyword_stats', '%s_unique_keyword_by_length' % data_type, 'len_%d.txt' % kw_len)
-                kw_count_list_at_leng_k = [(k, keyword_count_dict[k]) for k in kw_list]
-                kw_count_list_at_leng_k = sorted(kw_count_list_at_leng_k, key=lambda k: k[1], reverse=True)
-                with open(output_file_path, 'w') as output_file:
-                    for kw, kw_freq in kw_count_list_at_leng_k:
-                        output_file.write('%s\t%d\n' % (kw, kw_freq))
+            keyword_counter = count_keywords(source_file_path, kw_key_name, pool=pool, chunk_size=opt.chunk_size)
+            for kw in keyword_counter:
+                if kw not in keyword_lengths:
+                    keyword_lengths[kw] = len(copyseq_tokenize(kw))
+            print('#(unique keyword)=%d, #(keyword)=%d' % (len(keyword_counter), sum(keyword_counter.values())))
+
+            export_keyword_stats(keyword_counter, keyword_lengths, os.path.join(source_dir, 'keyword_stats'), data_type)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+if __name__ == '__main__':
+    main()
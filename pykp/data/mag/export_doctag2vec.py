@@ -1,22 +1,78 @@
 # -*- coding: utf-8 -*-
 """
-Python File Template 
+Convert the MAG json (one paper per line) to the input of doc2vec, two lines per paper with keywords and abstract:
+    <line number> <keyword_1> <keyword_2> ...
+    <lowercased title and abstract>
+and export the keyword frequencies to <input>_keyword.txt.
+The input is split into chunks of lines, which are parsed and formatted by a pool of processes, and written in order by the main process,
+    thus the outputs are the same as processing line by line.
+    python -m pykp.data.mag.export_doctag2vec -input_file_path mag_cs.txt -output_file_path mag_cs.doc2vec.txt -num_workers 8
 """
-import operator
-import os
 import argparse
+import collections
+import multiprocessing
 import json
-import sys
 
 __author__ = "Rui Meng"
 __email__ = "rui.meng@pitt.edu"
 
+WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+def convert_chunk(args):
+    '''
+    :param args: (line number of the first line, a chunk of json lines)
+    :return: #(lines), the formatted text of the chunk, Counter of keywords (in the order of first occurrence), #(valid docs), #(no keywords), #(no abstract)
+    '''
+    start_count, lines = args
+    outputs = []
+    keyword_counter = collections.Counter()
+    output_count = 0
+    no_key_count = 0
+    no_abs_count = 0
+
+    for count, line in enumerate(lines, start_count):
+        j = json.loads(line)
+        if 'keywords' not in j or len(j['keywords']) == 0 or 'abstract' not in j or j['abstract'].strip() == '':
+            if 'keywords' not in j or len(j['keywords']) == 0:
+                no_key_count += 1
+            if 'abstract' not in j or j['abstract'].strip() == '':
+                no_abs_count += 1
+        else:
+            keywords = [k.lower().replace(' ', '_') for k in j['keywords']]
+            keyword_counter.update(keywords)
+
+            words = j['title'].lower().split() + j['abstract'].lower().split()
+            outputs.append('%d %s\n%s\n' % (count, ' '.join(keywords), ' '.join(words)))
+            output_count += 1
+
+    return len(lines), ''.join(outputs), keyword_counter, output_count, no_key_count, no_abs_count
+
+
+def read_chunks(input_file_path, chunk_size):
+    '''
+    :return: a generator of (line number of the first line, lines), line numbers start from 1
+    '''
+    chunk = []
+    count = 0
+    with open(input_file_path, 'r') as input_file:
+        for line in input_file:
+            count += 1
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield count - len(chunk) + 1, chunk
+                chunk = []
+    if len(chunk) > 0:
+        yield count - len(chunk) + 1, chunk
+
 
 def main():
     ''' Main function '''
     parser = argparse.ArgumentParser()
     parser.add_argument('-input_file_path', required=True)
-    parser.add_argument('-output_file_path', required=False)
+    parser.add_argument('-output_file_path', required=False, default='', help='Only count the keywords if not given')
+    parser.add_argument('-num_workers', type=int, default=multiprocessing.cpu_count(), help='Number of processes, 0 converts in the main process')
+    parser.add_argument('-chunk_size', type=int, default=10000, help='Number of lines per chunk')
 
     opt = parser.parse_args()
 
@@ -25,33 +81,35 @@ def main():
     no_abs_count = 0
     output_count = 0
 
-    keyword_dict = {}
+    keyword_dict = collections.Counter()
 
-    if opt.output_file_path != '':
-        output_file     = open(opt.output_file_path, 'w')
+    output_file = None
+    if opt.output_file_path:
+        output_file = open(opt.output_file_path, 'w', buffering=WRITE_BUFFER_SIZE)
 
-    with open(opt.input_file_path, 'r') as input_file:
-        for line in input_file:
-            count += 1
-            if count % 10000 == 0:
-                print('Processing %s - %d' % (opt.input_file_path, count))
-
-            j = json.loads(line)
-            if 'keywords' not in j or len(j['keywords']) == 0 or 'abstract' not in j or j['abstract'].strip() == '':
-                if 'keywords' not in j or len(j['keywords']) == 0:
-                    no_key_count += 1
-                if 'abstract' not in j or j['abstract'].strip() == '':
-                    no_abs_count += 1
-            else:
-                keywords = [k.lower().replace(' ', '_') for k in j['keywords']]
-                [operator.setitem(keyword_dict, k, keyword_dict.get(k, 0) + 1) for k in keywords]
-
-                words    = j['title'].lower().split() + j['abstract'].lower().split()
-                if opt.output_file_path != '':
-                    output_file.write('%d %s\n%s\n' % (count, ' '.join(keywords), ' '.join(words)))
-                output_count += 1
-
-    if opt.output_file_path != '':
+    chunks = read_chunks(opt.input_file_path, opt.chunk_size)
+    if opt.num_workers > 0:
+        pool = multiprocessing.Pool(opt.num_workers)
+        # imap returns the chunks in order, thus the output and the order of keywords are the same as sequential processing
+        results = pool.imap(convert_chunk, chunks)
+    else:
+        pool = None
+        results = map(convert_chunk, chunks)
+
+    for chunk_count, chunk_output, chunk_keyword_counter, chunk_output_count, chunk_no_key_count, chunk_no_abs_count in results:
+        if output_file is not None:
+            output_file.write(chunk_output)
+        keyword_dict.update(chunk_keyword_counter)
+        output_count += chunk_output_count
+        no_key_count += chunk_no_key_count
+        no_abs_count += chunk_no_abs_count
+        count += chunk_count
+        print('Processing %s - %d' % (opt.input_file_path, count))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if output_file is not None:
         output_file.close()
 
     keyword_count = sorted(keyword_dict.items(), key=lambda k:k[1], reverse=True)
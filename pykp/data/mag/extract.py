@@ -1,62 +1,162 @@
-''' Handling the data io '''
+''' Handling the data io
+Extract the papers of one domain and language from the MAG dump, e.g.
+    python -m pykp.data.mag.extract -path data/mag -domain "computer science" -lang en -save_file_path mag_cs.txt -num_workers 8
+The dump can be either unzipped (mag_papers_*/*.txt) or the original zips (mag_papers_*.zip), zip members are read as streams.
+Each file is scanned by a worker process into its own part file, and the parts are concatenated in the order of files,
+    thus the output is the same regardless of the number of workers.
+A line is parsed only if it contains the raw strings of the language and the domain (case-insensitive),
+    which is a necessary condition of the checks on the parsed paper, so most papers of other domains are rejected without json.loads.
+'''
 import argparse
 import json
+import multiprocessing
 import os
+import shutil
+import time
 from zipfile import ZipFile
 
 import logging
 logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.INFO)
 
 
-def extract_papers(dirpath, domain_name, lang, save_file_path):
-    file_count = 0
-    paper_count = 0
-    domain_paper_count = 0
-
-    save_file = open(save_file_path, 'w')
-
-    for folder in os.listdir(dirpath):
-        if not folder.startswith('mag_papers_'):
+def list_input_files(dirpath):
+    '''
+    A zip unzipped in place (mag_papers_N.zip next to mag_papers_N/) is read from the folder only, otherwise its papers would be output twice
+    :return: a sorted list of (path, zip member), member is None for a plain file
+    '''
+    input_files = []
+    for name in sorted(os.listdir(dirpath)):
+        if not name.startswith('mag_papers_'):
             continue
+        path = os.path.join(dirpath, name)
+
+        if os.path.isdir(path):
+            for txt_name in sorted(os.listdir(path)):
+                input_files.append((os.path.join(path, txt_name), None))
+        elif name.endswith('.zip'):
+            if os.path.isdir(path[: -len('.zip')]):
+                logging.info('Skip %s, read the unzipped folder %s instead' % (path, path[: -len('.zip')]))
+                continue
+            with ZipFile(path) as zip_file:
+                for member in sorted(zip_file.namelist()):
+                    if not member.endswith('/'):
+                        input_files.append((path, member))
+
+    return input_files
+
+
+def extract_file(task):
+    '''
+    Scan one input file and write the papers of the domain to part_path
+    :param task: (file index, path, zip member, part_path, domain_name, lang)
+    :return: file index and the counters
+    '''
+    file_idx, path, member, part_path, domain_name, lang = task
+    start_time = time.time()
+    # a paper of lang in the domain must contain "lang" and the domain (in any case) in its raw line, checked before json.loads
+    lang_bytes = json.dumps(lang).encode('utf-8')
+    # bytes.lower() only lowers ascii letters, skip the check of non-ascii domain names
+    domain_bytes = domain_name.encode('utf-8') if all(ord(c) < 128 for c in domain_name) else None
+
+    if member is None:
+        input_file = open(path, 'rb')
+        num_bytes = os.path.getsize(path)
+    else:
+        zip_file = ZipFile(path)
+        input_file = zip_file.open(member)
+        num_bytes = zip_file.getinfo(member).file_size
+
+    # local counters, this loop runs once per paper of the dump
+    num_papers = 0
+    num_parsed = 0
+    num_matched = 0
+    with open(part_path, 'wb') as part_file:
+        for line in input_file:
+            num_papers += 1
+            if lang_bytes not in line or (domain_bytes is not None and domain_bytes not in line.lower()):
+                continue
+
+            num_parsed += 1
+            paper = json.loads(line.decode('utf-8'))
+            if paper.get('lang') != lang:
+                continue
+
+            if 'fos' in paper:
+                fos = set([f.lower() for f in paper['fos']])
+                if domain_name in fos:
+                    part_file.write(line if line.endswith(b'\n') else line + b'\n')
+                    num_matched += 1
+
+    input_file.close()
+    if member is not None:
+        zip_file.close()
+
+    counters = {'file': path if member is None else '%s:%s' % (path, member),
+                'num_papers': num_papers, 'num_parsed': num_parsed, 'num_matched': num_matched, 'num_bytes': num_bytes}
+    counters['seconds'] = time.time() - start_time
+    return file_idx, counters
+
+
+def extract_papers(dirpath, domain_name, lang, save_file_path, num_workers=1):
+    start_time = time.time()
+    domain_name = domain_name.lower()
+    input_files = list_input_files(dirpath)
+    logging.info('Found {:} MAG files in {:}, scanning with {:} workers'.format(len(input_files), dirpath, num_workers))
+
+    parts_dir = save_file_path + '.parts'
+    if not os.path.exists(parts_dir):
+        os.makedirs(parts_dir)
+    tasks = [(file_idx, path, member, os.path.join(parts_dir, 'part-%05d.txt' % file_idx), domain_name, lang)
+             for file_idx, (path, member) in enumerate(input_files)]
+
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
+        # imap returns in the order of tasks, thus the parts are merged deterministically
+        results = pool.imap(extract_file, tasks)
+    else:
+        pool = None
+        results = map(extract_file, tasks)
 
-        folderpath = os.path.join(dirpath, folder)
-
-        for txt_name in os.listdir(folderpath):
-            file_path = os.path.join(folderpath, txt_name)
-            print(file_path)
-            file_count += 1
-
-            with open(file_path) as txt_file:
-                for line in txt_file:
-                    paper_count+=1
-
-                    if paper_count % 10000==0:
-                        logging.info('The {:} th File:{:}, total progress: {:}/{:} papers in {:}'.format(file_count, file_path, domain_paper_count, paper_count, domain_name.upper()))
-
-                    paper = json.loads(line)
-                    if paper.get('lang') != lang:
-                        continue
-
-                    if 'fos' in paper:
-                        fos = set([f.lower() for f in paper['fos']])
-                        if domain_name in fos:
-                            save_file.write(line)
-                            domain_paper_count += 1
+    paper_count = 0
+    domain_paper_count = 0
+    byte_count = 0
+    with open(save_file_path, 'wb') as save_file:
+        for file_idx, counters in results:
+            part_path = tasks[file_idx][3]
+            with open(part_path, 'rb') as part_file:
+                shutil.copyfileobj(part_file, save_file)
+            os.remove(part_path)
+
+            paper_count += counters['num_papers']
+            domain_paper_count += counters['num_matched']
+            byte_count += counters['num_bytes']
+            elapsed = time.time() - start_time
+            logging.info('[{:}/{:}] {:}: {:}/{:} parsed, {:} matched in {:.1f}s. Total: {:}/{:} {:} papers, {:.0f} papers/sec, {:.1f} MB/sec'.format(
+                file_idx + 1, len(tasks), counters['file'], counters['num_parsed'], counters['num_papers'], counters['num_matched'],
+                counters['seconds'], domain_paper_count, paper_count, domain_name.upper(),
+                paper_count / elapsed, byte_count / 1024.0 / 1024.0 / elapsed))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    os.rmdir(parts_dir)
+
+    logging.info('Process finished, find {:}/{:} {:} papers in {:} MAG files in {:.1f}s'.format(
+        domain_paper_count, paper_count, domain_name.upper(), len(tasks), time.time() - start_time))
 
-    logging.info('Process finished, find {:}/{:} {:} papers in {:} MAG files'.format(domain_paper_count,
-                                                                            paper_count, domain_name.upper(), file_count))
 
 def main():
     ''' Main function '''
     parser = argparse.ArgumentParser()
-    parser.add_argument('-path', required=True)
+    parser.add_argument('-path', required=True, help='Folder of mag_papers_* (unzipped folders or zips)')
     parser.add_argument('-domain', required=True)
     parser.add_argument('-lang', required=True)
     parser.add_argument('-save_file_path', required=True)
+    parser.add_argument('-num_workers', type=int, default=multiprocessing.cpu_count(), help='Number of processes scanning files')
 
     opt = parser.parse_args()
 
-    extract_papers(opt.path, opt.domain, opt.lang, os.path.join(opt.path, opt.save_file_path))
+    extract_papers(opt.path, opt.domain, opt.lang, os.path.join(opt.path, opt.save_file_path), num_workers=opt.num_workers)
 
     print('[Info] Dumping the processed data to new text file', os.path.join(opt.path, opt.save_file_path))
     print('[Info] Finish.')
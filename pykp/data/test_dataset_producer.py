@@ -3,14 +3,17 @@
 Python File Template 
 """
 import codecs
+import collections
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-from nltk.tag import StanfordPOSTagger
+from nltk.tag import StanfordPOSTagger, PerceptronTagger, RegexpTagger
 from nltk.internals import find_jars_within_path
 import re
 import six
 
+import pykp.io
 from pykp.io import copyseq_tokenize
 
 __author__ = "Rui Meng"
@@ -42,6 +45,12 @@ class Document(object):
 
 class Dataset(object):
     def __init__(self, **kwargs):
+        '''
+        :param num_threads: number of threads reading the text/keyphrase files
+        :param use_cache:   reuse the parsed documents in <datadir>/<name>.parsed.jsonl if the data folders are not modified since
+        '''
+        self.num_threads = 16
+        self.use_cache = True
         self.__dict__.update(kwargs)
         self.name    = self.__class__.__name__.lower()
         self.datadir = os.path.join(basedir, self.name.lower())
@@ -54,8 +63,51 @@ class Dataset(object):
 
 
     def load_dataset(self):
+        if self.use_cache and self.load_cache():
+            return
         self.load_text(self.textdir)
         self.load_keyphrase(self.keyphrasedir)
+        if self.use_cache:
+            self.dump_cache()
+
+
+    def cache_path(self):
+        return os.path.join(self.datadir, self.name + '.parsed.jsonl')
+
+
+    def cache_key(self):
+        '''
+        Adding, removing or renaming files updates the mtime of the folder, in-place edits of a file do not (remove the cache then)
+        '''
+        return {'textdir_mtime': os.path.getmtime(self.textdir),
+                'keyphrasedir_mtime': os.path.getmtime(self.keyphrasedir) if os.path.exists(self.keyphrasedir) else None,
+                'title_abstract_body_separated': self.title_abstract_body_separated}
+
+
+    def load_cache(self):
+        '''
+        :return: True if the documents are loaded from a valid cache
+        '''
+        if not os.path.exists(self.cache_path()):
+            return False
+        with codecs.open(self.cache_path(), 'r', 'utf-8') as cache_file:
+            if json.loads(cache_file.readline()) != self.cache_key():
+                return False
+            self.doc_list = []
+            for line in cache_file:
+                doc = Document()
+                doc.__dict__.update(json.loads(line))
+                self.doc_list.append(doc)
+        print('Loaded %d documents of %s from %s' % (len(self.doc_list), self.name, self.cache_path()))
+        return True
+
+
+    def dump_cache(self):
+        with codecs.open(self.cache_path() + '.tmp', 'w', 'utf-8') as cache_file:
+            cache_file.write(json.dumps(self.cache_key()) + '\n')
+            for doc in self.doc_list:
+                cache_file.write(json.dumps(doc.__dict__) + '\n')
+        os.replace(self.cache_path() + '.tmp', self.cache_path())
 
 
     def load_dataset_as_dicts(self):
@@ -116,98 +168,102 @@ class Dataset(object):
 
 
     def load_text(self, textdir):
-        # ensure files are loaded in an alphabetical order
-        file_names = os.listdir(textdir)
-        file_names = sorted(file_names)
-
-        for fid, filename in enumerate(file_names):
-            # with codecs.open(textdir+filename, "r", encoding='utf-8', errors='ignore') as textfile:
-            with open(textdir+filename) as textfile:
-                try:
-                    lines = textfile.readlines()
-                    lines = [line.strip() for line in lines]
-
-                    if self.title_abstract_body_separated:
-                        '''
-                        title/abstract/fulltext are separated by --T/--A/--B
-                        '''
-                        T_index = None
-                        for line_id, line in enumerate(lines):
-                            if line.strip() == '--T':
-                                T_index = line_id
-                                break
-
-                        A_index = None
-                        for line_id, line in enumerate(lines):
-                            if line.strip() == '--A':
-                                A_index = line_id
-                                break
-
-                        B_index = None
-                        for line_id, line in enumerate(lines):
-                            if line.strip() == '--B':
-                                B_index = line_id
-                                break
-
-                        # lines between T and A are title
-                        title = ' '.join(lines[T_index + 1: A_index])
-                        # lines between A and B are abstract
-                        abstract = ' '.join(lines[A_index + 1: B_index])
-                        # lines after B are fulltext
-                        fulltext = '\n'.join(lines[B_index + 1:])
-
-                        if T_index is None or A_index is None or B_index is None:
-                            print('Wrong format detected : %s' % (filename))
-                            print('Name: ' + textdir + filename)
-                            print('Title: ' + title.strip())
-                            if not T_index:
-                                print('line 0 should be --T: ' + ''.join(lines[0]).strip())
-                            if not A_index:
-                                print('line 2 should be --A: ' + ''.join(lines[2]).strip())
-                            if not B_index:
-                                print('line 4 should be --B: ' + ''.join(lines[4]).strip())
-                            print()
-                        else:
-                            pass
-                            # print('No Problem: %s' % filename)
-
-                    else:
-                        '''
-                        otherwise, 1st line is title, and rest lines are abstract
-                        '''
-
-                        # 1st line is title
-                        title = lines[0]
-                        # rest lines are abstract
-                        abstract = (' '.join([''.join(line).strip() for line in lines[1:]]))
-                        # no fulltext is given, ignore it
-                        fulltext = ''
-
-                    doc = Document()
-                    doc.name = filename[:filename.find('.txt')]
-                    doc.title = title
-                    doc.abstract = abstract
-                    doc.fulltext = fulltext
-                    self.doc_list.append(doc)
-
-                except UnicodeDecodeError as e:
-                    print('UnicodeDecodeError detected! %s' % (textdir+filename))
-                    print(e)
+        # ensure files are loaded in an alphabetical order, the files are read by a thread pool but the order is kept
+        file_names = sorted(os.listdir(textdir))
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            docs = executor.map(lambda filename: parse_text_file(textdir, filename, self.title_abstract_body_separated), file_names)
+            self.doc_list.extend([doc for doc in docs if doc is not None])
 
 
     def load_keyphrase(self, keyphrasedir):
-        for did,doc in enumerate(self.doc_list):
-            phrase_set = set()
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            keywords = executor.map(lambda doc: read_keyphrase_files(keyphrasedir, doc.name), self.doc_list)
+            for doc, keyword in zip(self.doc_list, keywords):
+                doc.keyword = keyword
 
-            if os.path.exists(self.keyphrasedir + doc.name + '.keyphrases'):
-                with open(keyphrasedir+doc.name+'.keyphrases') as keyphrasefile:
-                    phrase_set.update([phrase.strip() for phrase in keyphrasefile.readlines()])
 
-            if os.path.exists(self.keyphrasedir + doc.name + '.keywords'):
-                with open(keyphrasedir + doc.name + '.keywords') as keyphrasefile:
-                    phrase_set.update([phrase.strip() for phrase in keyphrasefile.readlines()])
+def find_sections(lines):
+    '''
+    title/abstract/fulltext are separated by --T/--A/--B, find the first line of each marker in one pass
+    :return: T_index, A_index, B_index, None if not found
+    '''
+    indices = {}
+    for line_id, line in enumerate(lines):
+        marker = line.strip()
+        if marker in ('--T', '--A', '--B') and marker not in indices:
+            indices[marker] = line_id
+            if len(indices) == 3:
+                break
+    return indices.get('--T'), indices.get('--A'), indices.get('--B')
 
-            doc.keyword = list(phrase_set)
+
+def parse_text_file(textdir, filename, title_abstract_body_separated):
+    '''
+    :return: a Document, None if the file is broken
+    '''
+    # with codecs.open(textdir+filename, "r", encoding='utf-8', errors='ignore') as textfile:
+    with open(textdir+filename) as textfile:
+        try:
+            lines = textfile.readlines()
+        except UnicodeDecodeError as e:
+            print('UnicodeDecodeError detected! %s' % (textdir+filename))
+            print(e)
+            return None
+    lines = [line.strip() for line in lines]
+
+    if title_abstract_body_separated:
+        '''
+        title/abstract/fulltext are separated by --T/--A/--B
+        '''
+        T_index, A_index, B_index = find_sections(lines)
+
+        if T_index is None or A_index is None or B_index is None:
+            print('Wrong format detected : %s' % (filename))
+            print('Name: ' + textdir + filename)
+            if T_index is None:
+                print('line 0 should be --T: ' + ''.join(lines[0: 1]).strip())
+            if A_index is None:
+                print('line 2 should be --A: ' + ''.join(lines[2: 3]).strip())
+            if B_index is None:
+                print('line 4 should be --B: ' + ''.join(lines[4: 5]).strip())
+            print()
+            return None
+
+        # lines between T and A are title
+        title = ' '.join(lines[T_index + 1: A_index])
+        # lines between A and B are abstract
+        abstract = ' '.join(lines[A_index + 1: B_index])
+        # lines after B are fulltext
+        fulltext = '\n'.join(lines[B_index + 1:])
+    else:
+        '''
+        otherwise, 1st line is title, and rest lines are abstract
+        '''
+        # 1st line is title
+        title = lines[0]
+        # rest lines are abstract
+        abstract = (' '.join([''.join(line).strip() for line in lines[1:]]))
+        # no fulltext is given, ignore it
+        fulltext = ''
+
+    doc = Document()
+    doc.name = filename[:filename.find('.txt')]
+    doc.title = title
+    doc.abstract = abstract
+    doc.fulltext = fulltext
+    return doc
+
+
+def read_keyphrase_files(keyphrasedir, doc_name):
+    '''
+    :return: the list of unique keyphrases in <doc_name>.keyphrases and <doc_name>.keywords
+    '''
+    phrase_set = set()
+    for suffix in ['.keyphrases', '.keywords']:
+        if os.path.exists(keyphrasedir + doc_name + suffix):
+            with open(keyphrasedir + doc_name + suffix) as keyphrasefile:
+                phrase_set.update([phrase.strip() for phrase in keyphrasefile.readlines()])
+    return list(phrase_set)
 
 
 class INSPEC(Dataset):
@@ -272,7 +328,19 @@ def initialize_test_data_loader(identifier, kwargs=None):
     return test_data
 
 
-def load_pos_tagger():
+def load_pos_tagger(backend='stanford'):
+    '''
+    :param backend: 'stanford' (StanfordPOSTagger in pykp/stanford-postagger), 'perceptron' (NLTK averaged perceptron, needs its nltk_data),
+                    or 'regexp' (a pure-Python stand-in with crude suffix rules, for tests without Java/nltk_data)
+    :return: a tagger with tag_sents(), see CachedPOSTagger
+    '''
+    if backend == 'perceptron':
+        return PerceptronTagger()
+    if backend == 'regexp':
+        return RegexpTagger(REGEXP_TAGGER_PATTERNS)
+    if backend != 'stanford':
+        raise Exception('Unsupported POS tagger backend=%s' % backend)
+
     path = os.path.dirname(__file__)
     path =  os.path.join(file_dir[: file_dir.rfind('pykp') + 4], 'stanford-postagger')
     print(path)
@@ -288,6 +356,80 @@ def load_pos_tagger():
     return pos_tagger
 
 
+REGEXP_TAGGER_PATTERNS = [
+    (r'^-?[0-9]+(\.[0-9]+)?$', 'CD'),
+    (r'^[^a-zA-Z0-9]+$', '.'),
+    (r'^(the|a|an)$', 'DT'),
+    (r'^(of|in|on|for|with|by|from|to|at)$', 'IN'),
+    (r'^(and|or)$', 'CC'),
+    (r'.*ing$', 'VBG'),
+    (r'.*ed$', 'VBD'),
+    (r'.*ly$', 'RB'),
+    (r'.*(al|ous|ive|ic|able)$', 'JJ'),
+    (r'.*s$', 'NNS'),
+    (r'.*', 'NN')
+]
+
+
+class CachedPOSTagger(object):
+    '''
+    Tag sentences (lists of tokens) with a backend tagger in large batches, as StanfordPOSTagger starts a JVM for every call of tag()/tag_sents().
+    The tags are cached in a JSONL file keyed by pykp.io.source_hash() of the tokens, thus only unseen sentences are sent to the backend.
+    '''
+    def __init__(self, tagger, cache_path=None, batch_size=0):
+        '''
+        :param tagger: the backend, anything with tag_sents(list of token lists) -> list of [(token, tag)], see load_pos_tagger()
+        :param cache_path: the JSONL cache of {"hash", "tags"}, shared by all the datasets, no cache if None
+        :param batch_size: max number of sentences per call of the backend, 0 sends all the unseen sentences in one call
+        '''
+        self.tagger = tagger
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.num_backend_calls = 0
+        self.cache = {}
+
+        if cache_path and os.path.exists(cache_path):
+            with codecs.open(cache_path, 'r', 'utf-8') as cache_file:
+                for line in cache_file:
+                    # the last line may be partially written if the previous run crashed
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.cache[entry['hash']] = [tuple(t) for t in entry['tags']]
+            print('Loaded %d tagged sentences from %s' % (len(self.cache), cache_path))
+
+    def tag_sents(self, sentences):
+        '''
+        :param sentences: a list of token lists
+        :return: a list of [(token, tag)], in the order of sentences
+        '''
+        hashes = [pykp.io.source_hash(sentence) for sentence in sentences]
+        # unique unseen sentences, empty ones are skipped as the backend may drop them and misalign the outputs
+        new_sentences = collections.OrderedDict()
+        for sent_hash, sentence in zip(hashes, sentences):
+            if len(sentence) > 0 and sent_hash not in self.cache:
+                new_sentences[sent_hash] = sentence
+        new_items = list(new_sentences.items())
+
+        batch_size = self.batch_size if self.batch_size > 0 else max(len(new_items), 1)
+        for batch_start in range(0, len(new_items), batch_size):
+            batch = new_items[batch_start: batch_start + batch_size]
+            print('Tagging %d-%d of %d new sentences' % (batch_start, batch_start + len(batch), len(new_items)))
+            tagged_batch = self.tagger.tag_sents([sentence for _, sentence in batch])
+            self.num_backend_calls += 1
+            assert len(tagged_batch) == len(batch), 'The POS tagger returns %d sentences for %d inputs' % (len(tagged_batch), len(batch))
+
+            for (sent_hash, _), tags in zip(batch, tagged_batch):
+                self.cache[sent_hash] = [tuple(t) for t in tags]
+            if self.cache_path:
+                with codecs.open(self.cache_path, 'a', 'utf-8') as cache_file:
+                    for (sent_hash, _), tags in zip(batch, tagged_batch):
+                        cache_file.write(json.dumps({'hash': sent_hash, 'tags': tags}) + '\n')
+
+        return [self.cache.get(sent_hash, []) for sent_hash in hashes]
+
+
 extra_dataset_names = ['inspec', 'nus', 'semeval', 'krapivin', 'duc']
 def export_extra_dataset_to_json():
     for dataset_name in extra_dataset_names:
@@ -313,10 +455,18 @@ def export_extra_dataset_to_json():
 
 
 test_dataset_names = ['inspec', 'nus', 'semeval', 'krapivin', 'duc', 'kp20k', 'stackexchange']
-def load_testset_from_json_and_add_pos_tag():
-    pos_tagger = load_pos_tagger()
-
+def load_testset_from_json_and_add_pos_tag(backend='stanford', batch_size=0, cache_path=None):
+    '''
+    Tag title/abstract of all the test datasets, the sentences of all datasets are sent to the tagger together,
+        thus StanfordPOSTagger starts the JVM once in total (or once per batch_size sentences)
+    :param cache_path: source_data/postag_cache.<backend>.jsonl by default
+    '''
+    if cache_path is None:
+        cache_path = os.path.join(basedir, 'postag_cache.%s.jsonl' % backend)
+    pos_tagger = CachedPOSTagger(load_pos_tagger(backend), cache_path=cache_path, batch_size=batch_size)
 
+    dataset_dict_lists = collections.OrderedDict()
+    sentences = []
     for dataset_name in test_dataset_names:
         abstract_key = 'abstract'
         if dataset_name =='stackexchange':
@@ -331,24 +481,29 @@ def load_testset_from_json_and_add_pos_tag():
         with open(json_path, 'r') as json_file:
             for line in json_file:
                 dataset_dict_list.append(json.loads(line))
-
-        # postag title/abstract and insert into data example
-        postag_dataset_dict_list = []
-        for e_id, example_dict in enumerate(dataset_dict_list):
-            if e_id % 10 == 0:
-                print('Processing %d/%d' % (e_id, len(dataset_dict_list)))
-            title_postag_tokens = pos_tagger.tag(copyseq_tokenize(example_dict['title']))
-            # print('#(title token)=%d : %s' % (len(title_postag_tokens), str(title_postag_tokens)))
-            abstract_postag_tokens = pos_tagger.tag(copyseq_tokenize(example_dict[abstract_key]))
-            # print('#(abstract token)=%d : %s' % (len(abstract_postag_tokens), str(abstract_postag_tokens)))
+        dataset_dict_lists[dataset_name] = (json_path, dataset_dict_list)
+
+        for example_dict in dataset_dict_list:
+            sentences.append(copyseq_tokenize(example_dict['title']))
+            sentences.append(copyseq_tokenize(example_dict[abstract_key]))
+
+    # postag title/abstract of all the datasets at once
+    tagged_sentences = pos_tagger.tag_sents(sentences)
+    print('Tagged %d sentences with %d calls of the %s tagger' % (len(sentences), pos_tagger.num_backend_calls, backend))
+
+    tagged_iter = iter(tagged_sentences)
+    for dataset_name, (json_path, dataset_dict_list) in dataset_dict_lists.items():
+        # insert into data example
+        for example_dict in dataset_dict_list:
+            title_postag_tokens = next(tagged_iter)
+            abstract_postag_tokens = next(tagged_iter)
             example_dict['title_postag'] = ' '.join([str(t[0])+'_'+str(t[1]) for t in title_postag_tokens])
             example_dict['abstract_postag'] = ' '.join([str(t[0])+'_'+str(t[1]) for t in abstract_postag_tokens])
-            postag_dataset_dict_list.append(example_dict)
 
         print('Dumping %s' % dataset_name)
         # dump back to json
         with open(json_path, 'w') as json_file:
-            for example_dict in postag_dataset_dict_list:
+            for example_dict in dataset_dict_list:
                 json_file.write(json.dumps(example_dict) + '\n')
 
 
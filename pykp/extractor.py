@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Extract keyphrases from raw texts in memory with a trained checkpoint, no preprocessed test sets are needed:
+    extractor = KeyphraseExtractor('exp/kp20k.ml.copy/model/kp20k.ml.copy.epoch=1.batch=1000.total_batch=1000.model', 'data/kp20k/kp20k.vocab.pt')
+    extractor.extract(['title and abstract of document 1', 'title and abstract of document 2'], top_k=10)
+The JSON documents of extract.py, bulk_predict.py and serve.py are turned into texts by document_text().
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+
+import config
+import pykp
+from pykp.io import copyseq_tokenize, extend_vocab_OOV
+from pykp.cache import PredictionCache, checkpoint_id
+from pykp.vocab import load_vocab
+from beam_search import SequenceGenerator
+from evaluate import process_predseqs, if_present_duplicate_phrases, stem_word_list
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+logger = logging.getLogger()
+
+
+def document_text(doc, text_fields):
+    '''
+    The source text of one JSON document: a JSON string is the text itself, a JSON object joins its text_fields by '.'
+        (the fields that are missing or not strings are skipped)
+    :raise ValueError: if doc is neither an object nor a string, or none of its text_fields is a string
+    '''
+    if isinstance(doc, str):
+        return doc
+    if not isinstance(doc, dict):
+        raise ValueError('expect a JSON object or string, got %s' % type(doc).__name__)
+    texts = [doc[f] for f in text_fields if isinstance(doc.get(f), str)]
+    if len(texts) == 0:
+        raise ValueError('none of the fields %s is a string' % ', '.join(text_fields))
+    return '.'.join(texts)
+
+
+def find_config_path(model_path):
+    '''
+    Training dumps the options as <exp>.initial.config in the same model/ folder with checkpoints (see config.init_opt())
+    '''
+    model_dir = os.path.dirname(os.path.abspath(model_path))
+    config_paths = glob.glob(os.path.join(model_dir, '*.initial.config'))
+    if len(config_paths) != 1:
+        raise ValueError('Expect exactly one *.initial.config under %s, found %d, please specify config_path' % (model_dir, len(config_paths)))
+    return config_paths[0]
+
+
+def load_opt(config_path, model_path):
+    '''
+    Load the training options and fill the options that are added later with the default values
+    '''
+    try:
+        opt = torch.load(open(config_path, 'rb'), weights_only=False)
+    except TypeError:
+        opt = torch.load(open(config_path, 'rb'))
+
+    parser = argparse.ArgumentParser()
+    config.preprocess_opts(parser)
+    config.model_opts(parser)
+    config.train_opts(parser)
+    config.predict_opts(parser)
+    default_opt = parser.parse_args(['-data', opt.data, '-vocab', model_path])
+    for k, v in vars(default_opt).items():
+        if not hasattr(opt, k):
+            setattr(opt, k, v)
+
+    opt.train_from = model_path
+    return opt
+
+
+class KeyphraseExtractor(object):
+    def __init__(self, model_path, vocab_path, config_path=None, beam_size=None, max_sent_length=None,
+                 batch_size=8, max_src_length=None, must_appear_in_src=True, torchscript=False, cache=None):
+        '''
+        :param model_path:       checkpoint saved by train.py (*.model), or a quantized one (*.int8.model)
+        :param vocab_path:       the vocab.pt or vocab.bin (faster to load, see pykp/vocab.py) generated by preprocess.py
+        :param config_path:      the *.initial.config of the experiment, found in the folder of model_path by default
+        :param beam_size:        overrides -beam_size of the config if given
+        :param max_sent_length:  overrides -max_sent_length of the config if given
+        :param batch_size:       number of documents in one beam search
+        :param max_src_length:   truncate the source texts to the first max_src_length tokens, no truncation if None
+        :param must_appear_in_src: only return the phrases that appear in the source text (after stemming), same as evaluation
+        :param torchscript:      decode with the TorchScript modules (see pykp/scripted.py)
+        :param cache:            a pykp.cache.PredictionCache, skip the beam search of the texts seen before
+        '''
+        # imported here as train.py imports everything from pykp
+        from train import init_model
+        from pykp.scripted import script_model
+
+        self.opt = load_opt(config_path if config_path else find_config_path(model_path), model_path)
+        if beam_size:
+            self.opt.beam_size = beam_size
+        if max_sent_length:
+            self.opt.max_sent_length = max_sent_length
+        self.batch_size = batch_size
+        self.max_src_length = max_src_length
+        self.must_appear_in_src = must_appear_in_src
+        self.cache = cache
+        self.model_id = checkpoint_id(model_path) if cache is not None else None
+
+        logger.info("Loading vocab from disk: %s" % (vocab_path))
+        self.word2id, self.id2word, self.vocab = load_vocab(vocab_path)
+        self.opt.word2id = self.word2id
+        self.opt.id2word = self.id2word
+
+        self.model = init_model(self.opt)
+        if torch.cuda.is_available() and not self.opt.quantize:
+            self.model = self.model.cuda()
+        if torchscript:
+            self.model = script_model(self.model)
+        self.model.eval()
+
+        self.generator = SequenceGenerator(self.model,
+                                           eos_id=self.word2id[pykp.io.EOS_WORD],
+                                           beam_size=self.opt.beam_size,
+                                           max_sequence_length=self.opt.max_sent_length
+                                           )
+
+    def cache_key(self, src_str):
+        return PredictionCache.make_key(src_str, self.model_id,
+                                        beam_size=self.opt.beam_size,
+                                        max_sent_length=self.opt.max_sent_length,
+                                        must_appear_in_src=self.must_appear_in_src)
+
+    def tokenize(self, text):
+        '''
+        Same as preprocessing: lowercase and copyseq_tokenize()
+        '''
+        text = text.lower() if self.opt.lower else text
+        tokens = copyseq_tokenize(text)
+        if self.max_src_length:
+            tokens = tokens[:self.max_src_length]
+        return tokens
+
+    def build_batch(self, src_strs):
+        '''
+        Numericalize and pad the tokenized texts, sorted by length in descending order as required by pack_padded_sequence()
+        :return: src, src_len, src_oov, oov_lists, order (the index of each row in src_strs)
+        '''
+        bos_id, eos_id, pad_id = self.word2id[pykp.io.BOS_WORD], self.word2id[pykp.io.EOS_WORD], self.word2id[pykp.io.PAD_WORD]
+        unk_id = self.word2id[pykp.io.UNK_WORD]
+
+        order = np.argsort([len(s) for s in src_strs], kind='stable')[::-1]
+        src, src_oov, oov_lists = [], [], []
+        for i in order:
+            src_unk = [w_id if 0 <= w_id < self.opt.vocab_size else unk_id for w_id in (self.word2id.get(w, -1) for w in src_strs[i])]
+            src_copy, _, oov_list = extend_vocab_OOV(src_strs[i], self.word2id, self.opt.vocab_size, self.opt.max_unk_words)
+            src.append([bos_id] + src_unk + [eos_id])
+            src_oov.append([bos_id] + src_copy + [eos_id])
+            oov_lists.append(oov_list)
+
+        src_len = [len(s) for s in src]
+        max_length = max(src_len)
+        src = torch.LongTensor([s + [pad_id] * (max_length - len(s)) for s in src])
+        src_oov = torch.LongTensor([s + [pad_id] * (max_length - len(s)) for s in src_oov])
+        if torch.cuda.is_available() and not self.opt.quantize:
+            src = src.cuda()
+            src_oov = src_oov.cuda()
+
+        return src, src_len, src_oov, oov_lists, order
+
+    def postprocess(self, src_str, pred_seqs, oov_list, top_k):
+        '''
+        The same filtering as evaluate_beam_search(): drop the invalid phrases (empty, <unk> or punctuations) and the duplicates after stemming,
+            and the absent ones if must_appear_in_src
+        :return: a list of dicts {'phrase', 'score', 'present'} ranked by score (log-probability)
+        '''
+        is_valid_flags, _, pred_str_seqs, pred_scores = process_predseqs(pred_seqs, oov_list, self.id2word, self.opt)
+        # check the duplicates separately, as if_present_duplicate_phrases() also flags them as absent
+        is_present_flags, _ = if_present_duplicate_phrases(src_str, pred_str_seqs, check_duplicate=False)
+
+        keyphrases = []
+        seen_phrases = set()
+        for str_seq, score, is_valid, is_present in zip(pred_str_seqs, pred_scores, is_valid_flags, is_present_flags):
+            stemmed_phrase = '_'.join(stem_word_list(str_seq))
+            if not is_valid or stemmed_phrase in seen_phrases:
+                continue
+            if self.must_appear_in_src and not is_present:
+                continue
+            seen_phrases.add(stemmed_phrase)
+            keyphrases.append({'phrase': ' '.join(str_seq), 'score': float(score), 'present': bool(is_present)})
+            if top_k and len(keyphrases) >= top_k:
+                break
+
+        return keyphrases
+
+    def extract(self, texts, top_k=10):
+        '''
+        :param texts: a list of raw texts (e.g. title and abstract joined by '.')
+        :param top_k: the maximum number of keyphrases returned per text, return all if top_k<=0
+        :return: a list (in the same order with texts) of lists of keyphrase dicts {'phrase', 'score', 'present'}
+        '''
+        src_strs = [self.tokenize(text) for text in texts]
+        results = [None] * len(texts)
+
+        # the cache keeps all the keyphrases of a text, thus it is valid for any top_k
+        if self.cache is not None:
+            cache_keys = [self.cache_key(src_str) for src_str in src_strs]
+            results = [self.cache.get(key) for key in cache_keys]
+        todo_indices = [i for i, result in enumerate(results) if result is None]
+
+        for batch_start in range(0, len(todo_indices), self.batch_size):
+            batch_indices = todo_indices[batch_start: batch_start + self.batch_size]
+            batch_src_strs = [src_strs[i] for i in batch_indices]
+            src, src_len, src_oov, oov_lists, order = self.build_batch(batch_src_strs)
+
+            with torch.no_grad():
+                pred_seq_list = self.generator.beam_search(src, src_len, src_oov, oov_lists, self.word2id)
+
+            for batch_i, pred_seqs, oov_list in zip(order, pred_seq_list, oov_lists):
+                text_i = batch_indices[batch_i]
+                results[text_i] = self.postprocess(batch_src_strs[batch_i], pred_seqs, oov_list, top_k if self.cache is None else 0)
+                if self.cache is not None:
+                    self.cache.put(cache_keys[text_i], results[text_i])
+
+        return [result[:top_k] if top_k > 0 else result for result in results]
+
+    def extract_json_lines(self, lines, text_fields, id_field, top_k=10):
+        '''
+        Extract from JSONL documents, a line that is not a valid document gets an error record rather than stopping the others
+        :param lines: JSON lines, each one is an object with text_fields or a string of raw text (see document_text())
+        :param id_field: the field of an object copied to its output
+        :return: a list (in the same order with lines) of {id_field: ..., 'keyphrases': [...]} or {id_field: ..., 'error': ...}
+        '''
+        outputs = []
+        valid_indices = []
+        texts = []
+        for i, line in enumerate(lines):
+            output = {}
+            try:
+                doc = json.loads(line)
+                if isinstance(doc, dict) and id_field in doc:
+                    output[id_field] = doc[id_field]
+                texts.append(document_text(doc, text_fields))
+                valid_indices.append(i)
+            except ValueError as e:
+                output['error'] = 'invalid document: %s' % str(e)
+            outputs.append(output)
+
+        for i, keyphrases in zip(valid_indices, self.extract(texts, top_k=top_k)):
+            outputs[i]['keyphrases'] = keyphrases
+        return outputs
@@ -3,6 +3,7 @@
 Python File Template 
 """
 import codecs
+import hashlib
 import inspect
 import itertools
 import json
@@ -10,17 +11,15 @@ import pickle
 import re
 import os
 import copy
+import collections
 from collections import Counter
 from collections import defaultdict
 import numpy as np
 from torch.autograd import Variable
 
-from evaluate import if_present_duplicate_phrases, if_present_phrase
-
 __author__ = "Rui Meng"
 __email__ = "rui.meng@pitt.edu"
 
-import torchtext
 import torch
 
 PAD_WORD = '<pad>'
@@ -30,18 +29,15 @@ EOS_WORD = '</s>'
 DIGIT = '<digit>'
 SEP_WORD = '<sep>'
 
-
-def __getstate__(self):
-    return dict(self.__dict__, stoi=dict(self.stoi))
-
-
-def __setstate__(self, state):
-    self.__dict__.update(state)
-    self.stoi = defaultdict(lambda: 0, self.stoi)
+# the torchtext-based datasets/vocabs are in pykp.io_torchtext, only imported on access as torchtext is slow to load
+TORCHTEXT_NAMES = ['KeyphraseDatasetTorchText', 'One2OneKPDatasetOpenNMT', 'merge_vocabs', 'save_vocab', 'build_vocab_OpenNMT', 'initialize_fields']
 
 
-torchtext.vocab.Vocab.__getstate__ = __getstate__
-torchtext.vocab.Vocab.__setstate__ = __setstate__
+def __getattr__(name):
+    if name in TORCHTEXT_NAMES:
+        import pykp.io_torchtext
+        return getattr(pykp.io_torchtext, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 class KeyphraseDataset(torch.utils.data.Dataset):
@@ -78,7 +74,7 @@ class KeyphraseDataset(torch.utils.data.Dataset):
         return len(self.examples)
 
     def _pad(self, x_raw):
-        x_raw = np.asarray(x_raw)
+        # x_raw is a list of lists of different lengths, np.asarray() of it fails on numpy>=1.24
         x_lens = [len(x_) for x_ in x_raw]
         max_length = max(x_lens)  # (deprecated) + 1 to ensure at least one padding appears in the end
         # x_lens = [x_len + 1 for x_len in x_lens]
@@ -192,30 +188,6 @@ class KeyphraseDataset(torch.utils.data.Dataset):
             return (src_o2m, src_o2m_len, trg_o2m, None, trg_copy_target_o2m, src_oov_o2m, oov_lists_o2m), (src_o2o, src_o2o_len, trg_o2o, trg_target_o2o, trg_copy_target_o2o, src_oov_o2o, oov_lists_o2o)
 
 
-class KeyphraseDatasetTorchText(torchtext.data.Dataset):
-    @staticmethod
-    def sort_key(ex):
-        return torchtext.data.interleave_keys(len(ex.src), len(ex.trg))
-
-    def __init__(self, raw_examples, fields, **kwargs):
-        """Create a KeyphraseDataset given paths and fields. Modified from the TranslationDataset
-
-        Arguments:
-            examples: The list of raw examples in the dataset, each example is a tuple of two lists (src_tokens, trg_tokens)
-            fields: A tuple containing the fields that will be used for source and target data.
-            Remaining keyword arguments: Passed to the constructor of data.Dataset.
-        """
-        if not isinstance(fields[0], (tuple, list)):
-            fields = [('src', fields[0]), ('trg', fields[1])]
-
-        examples = []
-        for (src_tokens, trg_tokens) in raw_examples:
-            examples.append(torchtext.data.Example.fromlist(
-                [src_tokens, trg_tokens], fields))
-
-        super(KeyphraseDatasetTorchText, self).__init__(examples, fields, **kwargs)
-
-
 def load_json_data(path, name='kp20k', src_fields=['title', 'abstract'], trg_fields=['keyword'], trg_delimiter=';'):
     '''
     To load keyphrase data from file, generate src by concatenating the contents in src_fields
@@ -235,16 +207,23 @@ def load_json_data(path, name='kp20k', src_fields=['title', 'abstract'], trg_fie
             # if(idx == 20000):
             #     break
             # print(line)
-            json_ = json.loads(line)
-
-            trg_strs = []
-            src_str = '.'.join([json_[f] for f in src_fields])
-            [trg_strs.extend(re.split(trg_delimiter, json_[f])) for f in trg_fields]
-            src_trgs_pairs.append((src_str, trg_strs))
+            src_trgs_pairs.append(parse_json_line(line, src_fields, trg_fields, trg_delimiter))
 
     return src_trgs_pairs
 
 
+def parse_json_line(line, src_fields, trg_fields, trg_delimiter=';'):
+    '''
+    :return: (src_str, [trg_str_1, trg_str_2 ... trg_str_m]) of one json line, see load_json_data()
+    '''
+    json_ = json.loads(line)
+
+    trg_strs = []
+    src_str = '.'.join([json_[f] for f in src_fields])
+    [trg_strs.extend(re.split(trg_delimiter, json_[f])) for f in trg_fields]
+    return (src_str, trg_strs)
+
+
 def copyseq_tokenize(text):
     '''
     The tokenizer used in Meng et al. ACL 2017
@@ -368,6 +347,98 @@ def tokenize_filter_data(
     return return_pairs
 
 
+def numericalize_pairs(src_trgs_pairs, word2id, vocab_size, max_oov_words, chunk_size=10000):
+    '''
+    Map the tokens of (source, targets) pairs to ids chunk by chunk, rather than looking up word2id several times per word.
+    The tokens of a chunk are mapped with one lookup over the chunk (by dict.get in C, or once per distinct token if word2id is a pykp.vocab.Vocab),
+        then the OOVs are interned and numbered per document by numpy.
+    The results are the same as looking up word by word and extend_vocab_OOV(), including that once a document has max_oov_words OOVs,
+        the rest OOV occurrences of its source are replaced with <unk>.
+    :param vocab_size:    ids >= vocab_size are regarded as OOV
+    :param max_oov_words: the maximum number of distinct OOV words per document
+    :param chunk_size:    number of pairs per chunk
+    :return: a generator of (src_unk, src_copy, oov_dict, oov_list, trgs, trg_copies) of each pair, ids are python lists
+    '''
+    unk_id = word2id[UNK_WORD]
+    for chunk_start in range(0, len(src_trgs_pairs), chunk_size):
+        chunk = src_trgs_pairs[chunk_start: chunk_start + chunk_size]
+
+        # concatenate the sources and targets of the chunk
+        tokens = []
+        lengths = []
+        doc_indices = []
+        is_source = []
+        for doc_idx, (source_str, target_strs) in enumerate(chunk):
+            for seq_idx, seq in enumerate([source_str] + list(target_strs)):
+                tokens.extend(seq)
+                lengths.append(len(seq))
+                doc_indices.append(doc_idx)
+                is_source.append(seq_idx == 0)
+
+        if isinstance(word2id, dict):
+            token2id = word2id
+        else:
+            distinct_tokens = list(dict.fromkeys(tokens))
+            token2id = dict(zip(distinct_tokens, [word2id.get(w, -1) for w in distinct_tokens]))
+        # -1 is never a valid id
+        ids = np.fromiter(map(token2id.get, tokens, itertools.repeat(-1)), dtype=np.int64, count=len(tokens))
+        oov_positions = np.flatnonzero((ids < 0) | (ids >= vocab_size))
+        ids[oov_positions] = unk_id
+        copy_ids = ids.copy()
+
+        # intern the OOV tokens, an OOV is distinguished by (document, code)
+        oov_tokens = [tokens[i] for i in oov_positions.tolist()]
+        code2token = list(dict.fromkeys(oov_tokens))
+        token2code = dict(zip(code2token, range(len(code2token))))
+        num_codes = max(len(code2token), 1)
+        oov_codes = np.fromiter(map(token2code.__getitem__, oov_tokens), dtype=np.int64, count=len(oov_tokens))
+        oov_token_keys = np.repeat(np.asarray(doc_indices, dtype=np.int64), lengths)[oov_positions] * num_codes + oov_codes
+        oov_is_source = np.repeat(np.asarray(is_source, dtype=bool), lengths)[oov_positions]
+
+        # number the distinct OOVs of each source by their first occurrence
+        src_oov_positions = oov_positions[oov_is_source]
+        oov_keys, first_occurrences, inverse = np.unique(oov_token_keys[oov_is_source], return_index=True, return_inverse=True)
+        order = np.argsort(first_occurrences, kind='stable')
+        oov_docs = oov_keys // num_codes
+        ranks = np.empty(len(oov_keys), dtype=np.int64)
+        ranks[order] = np.arange(len(oov_keys)) - np.searchsorted(oov_docs[order], oov_docs[order], side='left')
+        is_kept = ranks < max_oov_words
+
+        # after the max_oov_words-th distinct OOV of a document appears, the rest OOV occurrences of its source become <unk>
+        cutoffs = np.full(len(chunk), len(src_oov_positions), dtype=np.int64)
+        is_last_kept = ranks == max_oov_words - 1
+        cutoffs[oov_docs[is_last_kept]] = first_occurrences[is_last_kept]
+        is_copied = is_kept[inverse] & (np.arange(len(src_oov_positions)) <= cutoffs[oov_docs[inverse]])
+        copy_ids[src_oov_positions] = np.where(is_copied, ranks[inverse] + vocab_size, unk_id)
+
+        # OOVs of the targets are copied if they are in oov_dict of the source, otherwise <unk>
+        trg_oov_keys = oov_token_keys[~oov_is_source]
+        if len(oov_keys) > 0 and len(trg_oov_keys) > 0:
+            matches = np.minimum(np.searchsorted(oov_keys, trg_oov_keys), len(oov_keys) - 1)
+            is_found = (oov_keys[matches] == trg_oov_keys) & is_kept[matches]
+            copy_ids[oov_positions[~oov_is_source]] = np.where(is_found, ranks[matches] + vocab_size, unk_id)
+
+        # oov_list of each document, in the order of their numbers
+        oov_lists = [[] for _ in chunk]
+        kept_order = order[is_kept[order]]
+        for doc_idx, code in zip(oov_docs[kept_order].tolist(), (oov_keys[kept_order] % num_codes).tolist()):
+            oov_lists[doc_idx].append(code2token[code])
+
+        ids = ids.tolist()
+        copy_ids = copy_ids.tolist()
+        offset = 0
+        seq_idx = 0
+        for doc_idx, (_, target_strs) in enumerate(chunk):
+            seqs = []
+            for _ in range(len(target_strs) + 1):
+                seqs.append((ids[offset: offset + lengths[seq_idx]], copy_ids[offset: offset + lengths[seq_idx]]))
+                offset += lengths[seq_idx]
+                seq_idx += 1
+            oov_list = oov_lists[doc_idx]
+            oov_dict = dict([(w, vocab_size + i) for i, w in enumerate(oov_list)])
+            yield seqs[0][0], seqs[0][1], oov_dict, oov_list, [t for t, _ in seqs[1:]], [t for _, t in seqs[1:]]
+
+
 def process_data_examples(src_trgs_pairs, word2id, id2word, opt, mode='one2one', include_original=False):
     '''
     Standard process for copy model, parsing strings to tensors
@@ -375,27 +446,24 @@ def process_data_examples(src_trgs_pairs, word2id, id2word, opt, mode='one2one',
     :param include_original: keep the original texts of source and target
     :return:
     '''
+    # evaluate imports pykp, thus import it here rather than at the top
+    from evaluate import if_present_duplicate_phrases
+
     return_example_list = []
     count_oov_in_targets = 0
     max_oov_num_in_src = 0
     max_oov_src = ''
 
-    for idx, (source_str, target_strs) in enumerate(src_trgs_pairs):
-        # if w is not seen in training data vocab (word2id, size could be larger than opt.vocab_size), replace with <unk>
-        # src_all = [word2id[w] if w in word2id else word2id[UNK_WORD] for w in source]
-        # if w's id is larger than opt.vocab_size, replace with <unk>
-        src_unk = [word2id[w] if w in word2id and word2id[w] < opt.vocab_size else word2id[UNK_WORD] for w in source_str]
-
-        # create a local vocab for the current source text. If there're V words in the vocab of this string, len(itos)=V+2 (including <unk> and <pad>), len(stoi)=V+1 (including <pad>)
-        src_copy, oov_dict, oov_list = extend_vocab_OOV(source_str, word2id, opt.vocab_size, opt.max_unk_words)
-
+    numericalized_pairs = numericalize_pairs(src_trgs_pairs, word2id, opt.vocab_size, opt.max_unk_words)
+    for idx, ((source_str, target_strs), (src_unk, src_copy, oov_dict, oov_list, trgs, trg_copies)) \
+            in enumerate(zip(src_trgs_pairs, numericalized_pairs)):
         one2one_example_list = []
         find_oov_in_targets = False
 
         if len(target_strs) == 0 or sum([len(target_str) for target_str in target_strs]) == 0:
             continue
 
-        for target_str in target_strs:
+        for target_str, trg, trg_copy in zip(target_strs, trgs, trg_copies):
             '''
             Initialize an example and input the shared source information
             Note that do not use copy.deepcopy() as it forcibly creates new object and consumes too much disk
@@ -416,18 +484,7 @@ def process_data_examples(src_trgs_pairs, word2id, id2word, opt, mode='one2one',
             '''
             process targets and add into example
             '''
-            trg = [word2id[w] if (w in word2id and word2id[w] < opt.vocab_size) else word2id[UNK_WORD] for w in target_str]
             one2one_example['trg'] = trg
-
-            # oov words are replaced with indices in oov_dict
-            trg_copy = []
-            for w in target_str:
-                w_id = word2id[UNK_WORD]
-                if w in word2id and word2id[w] < opt.vocab_size:
-                    w_id = word2id[w]
-                elif w in oov_dict:
-                    w_id = oov_dict[w]
-                trg_copy.append(w_id)
             one2one_example['trg_copy'] = trg_copy
 
             if any([w >= opt.vocab_size for w in trg_copy]):
@@ -484,24 +541,15 @@ def process_data_examples(src_trgs_pairs, word2id, id2word, opt, mode='one2one',
 
             if len(target_strs) > 0:
                 max_target_len = max([len(t) for t in target_strs])
-                tmp_targets = []
-                tmp_trgs = []
-                for tmp_target, tmp_trg in zip(target_strs, one2many_example['trg']):
-                    if len(tmp_target) < max_target_len:
-                        tmp_targets.append(tmp_target + [''] * (max_target_len-len(tmp_target)))
-                        tmp_trgs.append(tmp_trg + [0] * (max_target_len-len(tmp_target)))
-                    else:
-                        tmp_targets.append(tmp_target)
-                        tmp_trgs.append(tmp_trg)
-
-                # print('=' * 50)
-                # print(source_str)
-                # print(target_strs)
-                # print(tmp_targets)
-                # print(tmp_trgs)
+                # pad with '' and 0, then sort by the tokens (the last position is the primary key of np.lexsort)
+                tmp_targets = np.asarray([t + [''] * (max_target_len - len(t)) for t in target_strs])
+                tmp_trgs = np.zeros((len(trgs), max_target_len), dtype=np.int64)
+                for i, t in enumerate(trgs):
+                    tmp_trgs[i, :len(t)] = t
+
                 # store the order sorted by strings and vocab indices alphabetically
-                one2many_example['trg_alpha_order_index'] = np.lexsort(np.transpose(np.asarray(tmp_targets)), axis=0)
-                one2many_example['trg_vocab_order_index'] = np.lexsort(np.transpose(np.asarray(tmp_trgs)), axis=0)
+                one2many_example['trg_alpha_order_index'] = np.lexsort(np.transpose(tmp_targets), axis=0)
+                one2many_example['trg_vocab_order_index'] = np.lexsort(np.transpose(tmp_trgs), axis=0)
             else:
                 one2many_example['trg_alpha_order_index'] = []
                 one2many_example['trg_vocab_order_index'] = []
@@ -549,8 +597,9 @@ def extend_vocab_OOV(source_words, word2id, vocab_size, max_oov_words):
     src_ext = []
     oov_dict = {}
     for w in source_words:
-        if w in word2id and word2id[w] < vocab_size:  # a OOV can be either outside the vocab or id>=vocab_size
-            src_ext.append(word2id[w])
+        w_id = word2id.get(w, -1)
+        if 0 <= w_id < vocab_size:  # a OOV can be either outside the vocab or id>=vocab_size
+            src_ext.append(w_id)
         else:
             if len(oov_dict) < max_oov_words:
                 # e.g. 50000 for the first article OOV, 50001 for the second...
@@ -581,7 +630,7 @@ def copy_martix(source, target):
 
 
 def build_vocab(tokenized_src_trgs_pairs, opt):
-    """Construct a vocabulary from tokenized lines."""
+    """Construct a vocabulary from tokenized lines, keeping the words allowed by -words_min_frequency and -vocab_max_size."""
     vocab = {}
     for src_tokens, trgs_tokens in tokenized_src_trgs_pairs:
         tokens = src_tokens + list(itertools.chain(*trgs_tokens))
@@ -591,6 +640,17 @@ def build_vocab(tokenized_src_trgs_pairs, opt):
             else:
                 vocab[token] += 1
 
+    return build_vocab_from_counts(vocab, min_freq=opt.words_min_frequency, max_size=opt.vocab_max_size)
+
+
+def build_vocab_from_counts(vocab, min_freq=0, max_size=0):
+    '''
+    Assign the ids to words in the order of frequency, the ties are in the order of first occurrence (the order of vocab)
+    :param vocab: dict of word counts, ordered by the first occurrence
+    :param min_freq: discard the words that appear less than min_freq times, 0 keeps all
+    :param max_size: keep only the top max_size frequent words (excluding the special tokens), 0 keeps all
+    :return: word2id, id2word, vocab (the counts of the kept words)
+    '''
     # Discard start, end, pad and unk tokens if already present
     if '<s>' in vocab:
         del vocab['<s>']
@@ -625,7 +685,11 @@ def build_vocab(tokenized_src_trgs_pairs, opt):
         reverse=True
     )
 
-    sorted_words = [x[0] for x in sorted_word2id]
+    sorted_words = [x[0] for x in sorted_word2id if x[1] >= min_freq]
+    if max_size > 0:
+        sorted_words = sorted_words[:max_size]
+    if len(sorted_words) < len(vocab):
+        vocab = dict([(w, vocab[w]) for w in sorted_words])
 
     for ind, word in enumerate(sorted_words):
         word2id[word] = ind + 5  # number of pre-defined tokens
@@ -636,143 +700,85 @@ def build_vocab(tokenized_src_trgs_pairs, opt):
     return word2id, id2word, vocab
 
 
-class One2OneKPDatasetOpenNMT(torchtext.data.Dataset):
-    def __init__(self, src_trgs_pairs, fields,
-                 src_seq_length=0, trg_seq_length=0,
-                 src_seq_length_trunc=0, trg_seq_length_trunc=0,
-                 dynamic_dict=True, **kwargs):
-
-        self.src_vocabs = []
-        # examples: one for each src line or (src, trg) line pair.
-        # Each element is a dictionary whose keys represent at minimum
-        # the src tokens and their indices and potentially also the
-        # src and trg features and alignment information.
-        examples = []
-        indices = 0
-
-        for src, trgs in src_trgs_pairs:
-            if src_seq_length_trunc > 0 and len(src) > src_seq_length_trunc:
-                src = src[:src_seq_length_trunc]
-            for trg in trgs:
-                trg = re.sub('\(.*?\)', '', trg).strip()
-                if trg_seq_length_trunc > 0 and len(trg) > trg_seq_length_trunc:
-                    trg = trg[:trg_seq_length_trunc]
-                examples.append({'indices': indices, 'src': src, 'trg': trg})
-                indices += 1
-
-        if dynamic_dict:
-            examples = self.dynamic_dict(examples)
-
-        keys = fields.keys()
-        fields = [(k, fields[k]) for k in keys]
-        example_values = ([ex[k] for k in keys] for ex in examples)
-
-        # internally call the field.preprocess() and process each scr and trg
-        #       including lower(), tokenize() and preprocess()
-        out_examples = (torchtext.data.Example.fromlist(ex_values, fields)
-                        for ex_values in example_values)
-
-        def filter_pred(example):
-            return 0 < len(example.src) <= src_seq_length \
-                and 0 < len(example.trg) <= trg_seq_length
-
-        super(One2OneKPDatasetOpenNMT, self).__init__(
-            out_examples,
-            fields,
-            filter_pred
-        )
-
-    def dynamic_dict(self, examples):
-        for example in examples:
-            src = example["src"]
-            src_vocab = torchtext.vocab.Vocab(Counter(src))
-            self.src_vocabs.append(src_vocab)
-            # mapping source tokens to indices in the dynamic dict
-            src_map = torch.LongTensor([src_vocab.stoi[w] for w in src])
-            example["src_map"] = src_map
-
-            if "trg" in example:
-                trg = example["trg"]
-                mask = torch.LongTensor(
-                    [0] + [src_vocab.stoi[w] for w in trg] + [0])
-                example["alignment"] = mask
-            yield example
-
-    @staticmethod
-    def sort_key(ex):
-        "Sort in reverse size order"
-        return -len(ex.src)
-
-    def __getstate__(self):
-        return self.__dict__
-
-    def __setstate__(self, d):
-        self.__dict__.update(d)
-
-    def __reduce_ex__(self, proto):
-        "This is a hack. Something is broken with torch pickle."
-        return super(One2OneKPDatasetOpenNMT, self).__reduce_ex__()
-
-
-def merge_vocabs(vocabs, vocab_size=None):
-    """
-    Merge individual vocabularies (assumed to be generated from disjoint
-    documents) into a larger vocabulary.
-
-    Args:
-        vocabs: `torchtext.vocab.Vocab` vocabularies to be merged
-        vocab_size: `int` the final vocabulary size. `None` for no limit.
-    Return:
-        `torchtext.vocab.Vocab`
-    """
-    merged = sum([vocab.freqs for vocab in vocabs], Counter())
-    return torchtext.vocab.Vocab(merged,
-                                 specials=[PAD_WORD, BOS_WORD, EOS_WORD],
-                                 max_size=vocab_size)
-
-
-def save_vocab(fields):
-    vocab = []
-    for k, f in fields.items():
-        if 'vocab' in f.__dict__:
-            f.vocab.stoi = dict(f.vocab.stoi)
-            vocab.append((k, f.vocab))
-    return vocab
+def count_vocab_chunk(json_lines, src_fields, trg_fields, trg_delimiter, opt, valid_check, return_pairs=False):
+    '''
+    The map step of build_vocab_parallel(): parse, tokenize and count the words of a chunk of json lines,
+        in the same way as load_src_trgs_pairs() and build_vocab()
+    :param return_pairs: also return the tokenized pairs of the chunk
+    :return: a Counter ordered by the first occurrence in the chunk, (Counter, tokenized pairs) if return_pairs
+    '''
+    src_trgs_pairs = [parse_json_line(line, src_fields, trg_fields, trg_delimiter) for line in json_lines]
+    tokenized_pairs = tokenize_filter_data(src_trgs_pairs, tokenize_fn=copyseq_tokenize, opt=opt, valid_check=valid_check)
+    counter = Counter()
+    for src_tokens, trgs_tokens in tokenized_pairs:
+        counter.update(src_tokens + list(itertools.chain(*trgs_tokens)))
+    if return_pairs:
+        return counter, tokenized_pairs
+    return counter
+
+
+def build_vocab_parallel(source_json_path, src_fields, trg_fields, opt, valid_check=True, trg_delimiter=';',
+                         num_workers=4, chunk_size=10000, min_freq=0, max_size=0, return_pairs=False):
+    '''
+    Build the vocab by streaming the json file in chunks, each chunk is tokenized and counted by a worker process and the counts are merged.
+    Only the chunks in flight (at most 2 * num_workers) and the counts are kept in memory, rather than the whole tokenized corpus.
+    The chunks are merged in the order of the file, thus the result is identical to build_vocab(load_src_trgs_pairs(...)) with the same min_freq and max_size
+    :param min_freq: discard the words that appear less than min_freq times, 0 keeps all
+    :param max_size: keep only the top max_size frequent words, 0 keeps all
+    :param return_pairs: also collect the tokenized pairs from the workers (the same as load_src_trgs_pairs()),
+        thus a caller that needs both does not tokenize the file twice, at the cost of keeping the whole tokenized corpus in memory
+    :return: word2id, id2word, vocab, plus the tokenized pairs if return_pairs
+    '''
+    import multiprocessing
+
+    vocab = Counter()
+    tokenized_pairs = []
+    pending_chunks = collections.deque()
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        with codecs.open(source_json_path, "r", "utf-8") as corpus_file:
+            while True:
+                json_lines = list(itertools.islice(corpus_file, chunk_size))
+                if len(json_lines) > 0:
+                    pending_chunks.append(pool.apply_async(count_vocab_chunk, (json_lines, src_fields, trg_fields, trg_delimiter, opt, valid_check, return_pairs)))
+                # merge in the order of chunks to keep the order of first occurrence
+                while len(pending_chunks) > 0 and (len(pending_chunks) >= 2 * num_workers or len(json_lines) == 0):
+                    if return_pairs:
+                        chunk_counter, chunk_pairs = pending_chunks.popleft().get()
+                        tokenized_pairs.extend(chunk_pairs)
+                    else:
+                        chunk_counter = pending_chunks.popleft().get()
+                    vocab.update(chunk_counter)
+                if len(json_lines) == 0:
+                    break
+    finally:
+        pool.terminate()
+        pool.join()
+
+    # a plain dict as build_vocab(), thus the dumped vocab.pt is identical
+    word2id, id2word, vocab = build_vocab_from_counts(dict(vocab), min_freq=min_freq, max_size=max_size)
+    if return_pairs:
+        return word2id, id2word, vocab, tokenized_pairs
+    return word2id, id2word, vocab
 
 
-def build_vocab_OpenNMT(train, opt):
-    """
-    train: a KPDataset
+def build_keyphrase_shortlist(one2many_examples, word2id, vocab_size, shortlist_size):
     """
-    fields = train.fields
-    fields["src"].build_vocab(train, max_size=opt.vocab_size,
-                              min_freq=opt.words_min_frequency)
-    fields["trg"].build_vocab(train, max_size=opt.vocab_size,
-                              min_freq=opt.words_min_frequency)
-    merged_vocab = merge_vocabs(
-        [fields["src"].vocab, fields["trg"].vocab],
-        vocab_size=opt.vocab_size)
-    fields["src"].vocab = merged_vocab
-    fields["trg"].vocab = merged_vocab
-
-
-def initialize_fields(opt):
+    Collect the most frequent keyphrase words of the training data. Together with the source words they cover most of the decoder outputs,
+        thus beam search can score only these words instead of the full vocab (see SequenceGenerator(shortlist_ids))
+    :param one2many_examples: numericalized one2many examples, each example['trg'] is a list of keyphrases
+    :param shortlist_size: number of frequent keyphrase words to keep
+    :return: sorted list of word indexes, special tokens are always included
     """
-    returns: A dictionary whose keys are strings and whose values are the
-            corresponding Field objects.
-    """
-    fields = {}
-    fields["src"] = torchtext.data.Field(
-        init_token=BOS_WORD, eos_token=EOS_WORD,
-        pad_token=PAD_WORD, lower=opt.lower,
-        tokenize=copyseq_tokenize)
+    word_counter = Counter()
+    for example in one2many_examples:
+        for trg in example['trg']:
+            word_counter.update([w for w in trg if w < vocab_size])
 
-    fields["trg"] = torchtext.data.Field(
-        init_token=BOS_WORD, eos_token=EOS_WORD,
-        pad_token=PAD_WORD, lower=opt.lower,
-        tokenize=copyseq_tokenize)
+    shortlist = set([word2id[w] for w in [PAD_WORD, BOS_WORD, EOS_WORD, UNK_WORD, SEP_WORD]])
+    shortlist.update([w for w, _ in word_counter.most_common(shortlist_size)])
 
-    return fields
+    return sorted(shortlist)
 
 
 def load_src_trgs_pairs(source_json_path, dataset_name, src_fields, trg_fields, opt, valid_check=False):
@@ -817,6 +823,48 @@ def generate_one2one_one2many_examples(tokenized_pairs, word2id, id2word, opt, i
     return one2one_examples, one2many_examples
 
 
+def source_hash(src_tokens):
+    '''
+    Content hash of a document, computed on its tokenized source text thus robust to the differences of case and whitespaces
+    '''
+    return hashlib.sha1(' '.join(src_tokens).encode('utf-8')).hexdigest()
+
+
+def dataset_index_path(data_prefix, data_type):
+    return '%s.%s.index.json' % (data_prefix, data_type)
+
+
+def dataset_shard_path(data_prefix, data_type, shard_id, suffix):
+    '''
+    :param suffix: one2one.pt, one2many.pt or hashes
+    '''
+    return '%s.%s.shard-%05d.%s' % (data_prefix, data_type, shard_id, suffix)
+
+
+def load_dataset_index(data_prefix, data_type):
+    '''
+    The index of the shards appended to a dataset by append_dataset.py, empty if nothing is appended
+    '''
+    index_path = dataset_index_path(data_prefix, data_type)
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as index_file:
+            return json.load(index_file)
+    return {'shards': []}
+
+
+def load_examples(data_prefix, data_type, mode='one2many'):
+    '''
+    Load the examples exported by preprocess.py (data_prefix.data_type.mode.pt) and the shards appended by append_dataset.py
+    :param data_prefix: e.g. data/kp20k/kp20k
+    :param data_type:   one of train, valid, test
+    :param mode:        one2one or one2many
+    '''
+    examples = torch.load('%s.%s.%s.pt' % (data_prefix, data_type, mode), 'rb')
+    for shard in load_dataset_index(data_prefix, data_type)['shards']:
+        examples.extend(torch.load(dataset_shard_path(data_prefix, data_type, shard['shard_id'], mode + '.pt'), 'rb'))
+    return examples
+
+
 def process_and_export_dataset(tokenized_src_trg_pairs,
                                word2id, id2word,
                                opt, output_path,
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Memory accounting of the training data and steps, the results are appended to a json lines file (one record per line, see 'type'):
+    - dataset: the deep size in bytes of KeyphraseDataset.examples per field (src, trg, oov_dict ...), objects shared by examples
+        (e.g. small ints and interned strings) are counted once per field
+    - workers: the current and peak RSS of each DataLoader worker (or the main process if num_workers=0), reported by the collate_fn
+        of the worker after every batch, thus the copy-on-write growth of forked workers over the example lists is visible
+    - step: the bytes of the activations saved for backward in a training step (excluding the parameters), with the batch shapes,
+        and the peak allocated bytes on GPU
+    - summary: the peak RSS of all the processes, and a least-squares fit of the activation bytes per source/target token
+Usage in train.py (-profile_memory), the profiler is a no-op if enabled=False:
+    with MemoryProfiler(os.path.join(opt.log_path, 'memory.jsonl'), every=opt.profile_memory_every, enabled=opt.profile_memory) as memory_profiler:
+        memory_profiler.profile_dataset('train', train_data_loader.dataset.examples)
+        memory_profiler.track_workers(train_data_loader)
+        with memory_profiler.step(src, trg):
+            train_ml(...)
+As a command line tool on a processed dataset:
+    python -m pykp.memory_profiler -data data/kp20k/kp20k -vocab data/kp20k/kp20k.vocab.pt -data_type train -batch_workers 4 -num_batches 50
+    python -m pykp.memory_profiler -data data/kp20k/kp20k -vocab data/kp20k/kp20k.vocab.pt -profile_activations -copy_attention -batch_size 64
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import time
+
+import numpy as np
+import torch
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+def deep_sizeof(obj, seen=None):
+    '''
+    :param seen: ids of the objects (and tensor storages) counted already, shared by calls to count shared objects once
+    :return: bytes of obj and all the objects it references (list/tuple/set/dict/np.ndarray/torch.Tensor)
+    '''
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+
+        if isinstance(o, torch.Tensor):
+            size += sys.getsizeof(o)
+            storage = o.untyped_storage()
+            # views share the storage
+            if ('storage', storage.data_ptr()) not in seen:
+                seen.add(('storage', storage.data_ptr()))
+                size += storage.nbytes()
+        elif isinstance(o, np.ndarray):
+            # includes the data if the array owns it
+            size += sys.getsizeof(o)
+            if o.base is not None:
+                stack.append(o.base)
+        else:
+            size += sys.getsizeof(o)
+            if isinstance(o, dict):
+                stack.extend(o.keys())
+                stack.extend(o.values())
+            elif isinstance(o, (list, tuple, set, frozenset)):
+                stack.extend(o)
+    return size
+
+
+def dataset_memory(examples, sample_size=0):
+    '''
+    :param examples: list of example dicts, e.g. KeyphraseDataset.examples or the output of pykp.io.load_examples()
+    :param sample_size: account only every k-th example (about sample_size in total) and extrapolate, 0 for all
+    :return: {'num_examples', 'num_sampled', 'total_bytes', 'bytes_per_example', 'fields': {field: {'bytes', 'bytes_per_example'}}},
+        field '<containers>' is the list of examples and the dicts themselves
+    '''
+    step = max(len(examples) // sample_size, 1) if sample_size > 0 else 1
+    sampled = examples[::step]
+    scale = float(len(examples)) / max(len(sampled), 1)
+
+    field_bytes = {'<containers>': sys.getsizeof(examples) / scale + sum([sys.getsizeof(e) for e in sampled])}
+    field_seen = {}
+    for e in sampled:
+        for field, value in e.items():
+            if field not in field_seen:
+                field_seen[field] = set()
+                field_bytes[field] = 0
+            field_bytes[field] += deep_sizeof(value, field_seen[field])
+
+    fields = dict([(field, {'bytes': int(b * scale), 'bytes_per_example': b / max(len(sampled), 1)}) for field, b in field_bytes.items()])
+    total_bytes = sum([f['bytes'] for f in fields.values()])
+    return {'num_examples': len(examples), 'num_sampled': len(sampled), 'total_bytes': total_bytes,
+            'bytes_per_example': float(total_bytes) / max(len(examples), 1), 'fields': fields}
+
+
+def rss(pid='self'):
+    '''
+    :return: (current RSS, peak RSS) in bytes of the process, from /proc on linux and getrusage() elsewhere (current is None then)
+    '''
+    status_path = '/proc/%s/status' % pid
+    if os.path.exists(status_path):
+        current, peak = None, None
+        with open(status_path, 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) * 1024
+        return current, peak
+    # ru_maxrss is in bytes on mac and in kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None, peak if sys.platform == 'darwin' else peak * 1024
+
+
+class WorkerMemoryCollate(object):
+    '''
+    Wrap the collate_fn of a KeyphraseDataLoader, after every batch the process writes its RSS to <report_dir>/worker-<pid>.json.
+    It is copied to each worker process by fork, thus the counters are per worker.
+    '''
+    def __init__(self, collate_fn, report_dir):
+        self.collate_fn = collate_fn
+        self.report_dir = report_dir
+        self.first_rss = None
+        self.num_batches = 0
+
+    def __call__(self, batches):
+        output = self.collate_fn(batches)
+
+        current, peak = rss()
+        if self.first_rss is None:
+            self.first_rss = current
+        self.num_batches += 1
+        report = {'pid': os.getpid(), 'num_batches': self.num_batches, 'first_rss': self.first_rss, 'rss': current, 'peak_rss': peak}
+        report_path = os.path.join(self.report_dir, 'worker-%d.json' % os.getpid())
+        with open(report_path + '.tmp', 'w') as report_file:
+            json.dump(report, report_file)
+        os.replace(report_path + '.tmp', report_path)
+
+        return output
+
+
+class ActivationMemory(object):
+    '''
+    Context manager, counts the bytes of the tensors saved for backward by the forward passes inside,
+        i.e. the activation memory held until backward(). Parameters (leaf tensors requiring grad) are not counted,
+        tensors sharing a storage are counted once.
+    '''
+    def __init__(self):
+        self.saved_bytes = 0
+        self.num_saved_tensors = 0
+        self.cuda_peak_bytes = None
+        self._storages = set()
+        self._hooks = None
+
+    def pack(self, tensor):
+        if not (tensor.is_leaf and tensor.requires_grad):
+            storage = tensor.untyped_storage()
+            if storage.data_ptr() not in self._storages:
+                self._storages.add(storage.data_ptr())
+                self.saved_bytes += storage.nbytes()
+                self.num_saved_tensors += 1
+        return tensor
+
+    def unpack(self, tensor):
+        return tensor
+
+    def __enter__(self):
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+            self._cuda_start_bytes = torch.cuda.memory_allocated()
+        self._hooks = torch.autograd.graph.saved_tensors_hooks(self.pack, self.unpack)
+        self._hooks.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._hooks.__exit__(exc_type, exc_value, traceback)
+        if torch.cuda.is_available():
+            self.cuda_peak_bytes = torch.cuda.max_memory_allocated() - self._cuda_start_bytes
+        # free the references to the storages
+        self._storages = set()
+        return False
+
+
+class MemoryProfiler(object):
+    def __init__(self, output_path, every=1, enabled=True, sample_size=10000):
+        '''
+        :param output_path: the json lines of the records, the worker reports are kept in <output_path>.workers/ in the meantime
+        :param every: profile one training step every this many steps
+        :param enabled: if False, all the methods do nothing, thus train.py can always wrap the training with the profiler
+        :param sample_size: number of examples to account in profile_dataset(), see dataset_memory()
+        '''
+        self.output_path = output_path
+        self.every = every
+        self.enabled = enabled
+        self.sample_size = sample_size
+        self.num_steps = 0
+        self.step_records = []
+        self.worker_report_dirs = []
+
+    def __enter__(self):
+        if self.enabled:
+            if os.path.dirname(self.output_path) and not os.path.exists(os.path.dirname(self.output_path)):
+                os.makedirs(os.path.dirname(self.output_path))
+            current, peak = rss()
+            self.write({'type': 'start', 'rss': current, 'peak_rss': peak})
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            self.write(self.summary())
+            for report_dir in self.worker_report_dirs:
+                shutil.rmtree(report_dir, ignore_errors=True)
+        return False
+
+    def write(self, record):
+        record['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        with open(self.output_path, 'a') as output_file:
+            output_file.write(json.dumps(record) + '\n')
+
+    def profile_dataset(self, name, examples):
+        if not self.enabled:
+            return None
+        start_time = time.time()
+        record = dataset_memory(examples, sample_size=self.sample_size)
+        record.update({'type': 'dataset', 'name': name, 'seconds': time.time() - start_time})
+        self.write(record)
+
+        logging.info('Memory of dataset %s: %.1f MB for %d examples, %.1f KB/example' % (
+            name, record['total_bytes'] / 2.0 ** 20, record['num_examples'], record['bytes_per_example'] / 1024.0))
+        for field, field_record in sorted(record['fields'].items(), key=lambda f: -f[1]['bytes']):
+            logging.info('\t%-15s %10.1f MB  %8.1f bytes/example' % (field, field_record['bytes'] / 2.0 ** 20, field_record['bytes_per_example']))
+        return record
+
+    def track_workers(self, data_loader):
+        '''
+        Wrap the collate_fn of data_loader (KeyphraseDataLoader) before iterating it, see WorkerMemoryCollate
+        '''
+        if not self.enabled:
+            return
+        report_dir = '%s.workers.%d' % (self.output_path, len(self.worker_report_dirs))
+        if os.path.exists(report_dir):
+            shutil.rmtree(report_dir)
+        os.makedirs(report_dir)
+        self.worker_report_dirs.append(report_dir)
+        data_loader.collate_fn = WorkerMemoryCollate(data_loader.collate_fn, report_dir)
+
+    def worker_reports(self):
+        reports = []
+        for loader_id, report_dir in enumerate(self.worker_report_dirs):
+            for file_name in sorted(os.listdir(report_dir)):
+                if file_name.endswith('.json'):
+                    with open(os.path.join(report_dir, file_name), 'r') as report_file:
+                        report = json.load(report_file)
+                    report['loader'] = loader_id
+                    reports.append(report)
+        return reports
+
+    def step(self, src, trg):
+        '''
+        :param src, trg: the padded source and target batch (tensors) of the step, only their shapes are recorded
+        :return: a context manager wrapping the forward and backward of a training step
+        '''
+        self.num_steps += 1
+        if not self.enabled or (self.num_steps - 1) % self.every != 0:
+            return contextlib.nullcontext()
+        return self._profile_step(self.num_steps, list(src.size()), list(trg.size()))
+
+    @contextlib.contextmanager
+    def _profile_step(self, step, src_shape, trg_shape):
+        start_time = time.time()
+        with ActivationMemory() as activation_memory:
+            yield activation_memory
+        current, peak = rss()
+        record = {'type': 'step', 'step': step, 'src_shape': src_shape, 'trg_shape': trg_shape,
+                  'activation_bytes': activation_memory.saved_bytes, 'num_saved_tensors': activation_memory.num_saved_tensors,
+                  'cuda_peak_bytes': activation_memory.cuda_peak_bytes, 'rss': current, 'peak_rss': peak, 'seconds': time.time() - start_time}
+        self.step_records.append(record)
+        self.write(record)
+        logging.info('Memory of step %d: src=%s, trg=%s, activations=%.1f MB, RSS=%.1f MB' % (
+            step, str(src_shape), str(trg_shape), activation_memory.saved_bytes / 2.0 ** 20, (current or peak) / 2.0 ** 20))
+
+    def summary(self):
+        current, peak = rss()
+        worker_reports = self.worker_reports()
+        summary = {'type': 'summary', 'rss': current, 'peak_rss': peak, 'workers': worker_reports,
+                   'max_worker_peak_rss': max([r['peak_rss'] for r in worker_reports]) if worker_reports else None,
+                   'num_profiled_steps': len(self.step_records)}
+
+        # activation bytes ~ a * #(source tokens) + b * #(target tokens) + c over the profiled batch shapes
+        if len(self.step_records) > 0:
+            features = np.asarray([[r['src_shape'][0] * r['src_shape'][1], r['trg_shape'][0] * r['trg_shape'][1], 1.0] for r in self.step_records], dtype=np.float64)
+            activation_bytes = np.asarray([r['activation_bytes'] for r in self.step_records], dtype=np.float64)
+            summary['max_activation_bytes'] = int(activation_bytes.max())
+            # the fit is meaningless over a few similar shapes
+            if len(self.step_records) >= 10 and np.linalg.matrix_rank(features) == 3:
+                coefficients = np.linalg.lstsq(features, activation_bytes, rcond=None)[0]
+                summary['activation_fit'] = {'bytes_per_src_token': coefficients[0], 'bytes_per_trg_token': coefficients[1], 'intercept_bytes': coefficients[2]}
+
+        logging.info('Memory summary: peak RSS=%.1f MB, %d DataLoader processes reported, max peak RSS of them=%s' % (
+            peak / 2.0 ** 20, len(worker_reports), '%.1f MB' % (summary['max_worker_peak_rss'] / 2.0 ** 20) if worker_reports else 'n/a'))
+        for report in worker_reports:
+            logging.info('\tloader %d, pid %d: %d batches, RSS %.1f MB at the first batch, %.1f MB at the last, peak %.1f MB' % (
+                report['loader'], report['pid'], report['num_batches'], (report['first_rss'] or 0) / 2.0 ** 20,
+                (report['rss'] or 0) / 2.0 ** 20, report['peak_rss'] / 2.0 ** 20))
+        if 'activation_fit' in summary:
+            logging.info('\tactivations ~ %.1f bytes/source token + %.1f bytes/target token + %.1f MB' % (
+                summary['activation_fit']['bytes_per_src_token'], summary['activation_fit']['bytes_per_trg_token'],
+                summary['activation_fit']['intercept_bytes'] / 2.0 ** 20))
+        return summary
+
+
+def main():
+    import config
+
+    parser = argparse.ArgumentParser(description='memory_profiler.py', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    config.preprocess_opts(parser)
+    config.model_opts(parser)
+    config.train_opts(parser)
+    parser.add_argument('-data_type', default='train', choices=['train', 'valid', 'test'])
+    parser.add_argument('-sample_size', type=int, default=10000, help='Number of examples to account, 0 for all')
+    parser.add_argument('-num_batches', type=int, default=50, help='Number of batches to load (and train with -profile_activations)')
+    parser.add_argument('-profile_activations', action='store_true', help='Also run train_ml() on the batches with a model built from the options')
+    parser.add_argument('-output', default='memory.jsonl', help='Path of the json lines of records')
+    opt = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(module)s: %(message)s')
+
+    # train.py pulls the model and evaluation modules, import them only here
+    import pykp.io
+    from pykp.dataloader import KeyphraseDataLoader
+    from pykp.vocab import load_vocab
+
+    word2id, id2word, vocab = load_vocab(opt.vocab)
+    opt.word2id, opt.id2word = word2id, id2word
+    if vocab is not None:
+        opt.vocab = vocab
+
+    with MemoryProfiler(opt.output, enabled=True, sample_size=opt.sample_size) as memory_profiler:
+        examples = pykp.io.load_examples(opt.data, opt.data_type, mode='one2many')
+        dataset = pykp.io.KeyphraseDataset(examples, word2id=word2id, id2word=id2word, type='one2many', include_original=opt.data_type != 'train')
+        del examples
+        memory_profiler.profile_dataset(opt.data_type, dataset.examples)
+
+        data_loader = KeyphraseDataLoader(dataset=dataset, collate_fn=dataset.collate_fn_one2many, num_workers=opt.batch_workers,
+                                          max_batch_example=1024, max_batch_pair=opt.batch_size, shuffle=True)
+        memory_profiler.track_workers(data_loader)
+
+        model = None
+        if opt.profile_activations:
+            from train import init_optimizer_criterion, train_ml
+            from pykp.model import Seq2SeqLSTMAttention, Seq2SeqLSTMAttentionCascading
+            opt.train_ml = True
+            # random weights suffice for memory, train.init_model() would dump initial.model as well
+            model = Seq2SeqLSTMAttentionCascading(opt) if opt.cascading_model else Seq2SeqLSTMAttention(opt)
+            if torch.cuda.is_available():
+                model.cuda()
+            optimizer_ml, _, criterion = init_optimizer_criterion(model, opt)
+
+        for batch_i, (one2many_batch, one2one_batch) in enumerate(data_loader):
+            if batch_i >= opt.num_batches:
+                break
+            if model is not None:
+                src, _, trg = one2one_batch[:3]
+                with memory_profiler.step(src, trg):
+                    train_ml(one2one_batch, model, optimizer_ml, criterion, opt)
+        # let the workers write their last reports and exit
+        del data_loader
+
+
+if __name__ == '__main__':
+    main()
@@ -198,6 +198,80 @@ def _modified_precision(candidate, references, n):
     return sum(clipped_counts.values()) / sum(counts.values())
 
 
+class BleuScorer(object):
+    """Score many candidates against the same references, the same as bleu()
+    but the n-gram max counts of references are computed once in the constructor.
+
+    :param references: reference sentences
+    :type references: list(list(str))
+    :param weights: weights for unigrams, bigrams, trigrams and so on
+    :type weights: list(float)
+
+    >>> weights = [0.25, 0.25, 0.25, 0.25]
+    >>> scorer = BleuScorer(['the cat is on the mat'.split(), 'there is a cat on the mat'.split()], weights)
+    >>> scorer.score_batch(['the cat is on the mat'.split(), 'the the the the the the the'.split()])
+    [1.0, 0]
+    """
+
+    def __init__(self, references, weights):
+        self.weights = weights
+        self.ref_lens = [len(reference) for reference in references]
+        # max_counts[n - 1][ngram] is the max count of ngram in any reference
+        self.max_counts = []
+        for n in range(1, len(weights) + 1):
+            max_counts = {}
+            for reference in references:
+                for ngram, count in Counter(_ngrams(reference, n)).items():
+                    if count > max_counts.get(ngram, 0):
+                        max_counts[ngram] = count
+            self.max_counts.append(max_counts)
+
+    def modified_precision(self, candidate, n):
+        """The same as _modified_precision(candidate, references, n)"""
+        counts = Counter(_ngrams(candidate, n))
+
+        if not counts:
+            return 0
+
+        max_counts = self.max_counts[n - 1]
+        clipped_count = sum(min(count, max_counts.get(ngram, 0)) for ngram, count in counts.items())
+
+        return clipped_count / sum(counts.values())
+
+    def score(self, candidate):
+        """The same as bleu(candidate, references, weights)"""
+        p_ns = [
+            self.modified_precision(candidate, i)
+            for i, _ in enumerate(self.weights, start=1)
+        ]
+
+        try:
+            s = math.fsum(w * math.log(p_n) for w, p_n in zip(self.weights, p_ns))
+        except ValueError:
+            # some p_ns is 0
+            return 0
+
+        return math.exp(s)
+
+    def score_batch(self, candidates):
+        return [self.score(candidate) for candidate in candidates]
+
+    def brevity_penalty(self, candidate):
+        """The same as _brevity_penalty(candidate, references), not applied in score() as in bleu()"""
+        c = len(candidate)
+        r = min(self.ref_lens, key=lambda ref_len: (abs(ref_len - c), ref_len))
+
+        if c > r:
+            return 1
+        else:
+            return math.exp(1 - r / c)
+
+
+def _ngrams(sequence, n):
+    """The same tuples as nltk.util.ngrams(sequence, n), without its padding logic"""
+    return zip(*[sequence[i:] for i in range(n)])
+
+
 def _brevity_penalty(candidate, references):
     """Calculate brevity penalty.
 
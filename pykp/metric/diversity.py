@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Diversity of a set of predicted phrases, i.e. how much the predictions repeat each other.
+The predictions are encoded once in a sparse binary matrix, thus all the pairwise overlaps come from one sparse matrix product
+    instead of comparing Counters pair by pair:
+    - token F1: the k-th occurrence of a word in a phrase is a separate column (word, k), thus the dot product of two rows is
+        sum_w min(count_i(w), count_j(w)), the same as the size of (Counter(phrase_i) & Counter(phrase_j))
+    - Jaccard: only the first occurrences (word, 1), i.e. the sets of words
+"""
+import numpy as np
+import scipy.sparse
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+class BagOfWords(object):
+    def __init__(self, seqs):
+        '''
+        :param seqs: list of list of words, e.g. the predicted phrases of one example
+        '''
+        self.num_seqs = len(seqs)
+        columns = {}
+        rows = []
+        cols = []
+        is_first = []
+        for seq_id, seq in enumerate(seqs):
+            word_counts = {}
+            for word in seq:
+                k = word_counts.get(word, 0) + 1
+                word_counts[word] = k
+                rows.append(seq_id)
+                cols.append(columns.setdefault((word, k), len(columns)))
+                is_first.append(k == 1)
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        is_first = np.asarray(is_first, dtype=bool)
+        shape = (self.num_seqs, max(len(columns), 1))
+        # occurrence matrix, row sums are the lengths of seqs
+        self.occurrences = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.float64), (rows, cols)), shape=shape)
+        # set-of-words matrix, row sums are the numbers of unique words
+        self.word_sets = scipy.sparse.csr_matrix((np.ones(int(is_first.sum()), dtype=np.float64), (rows[is_first], cols[is_first])), shape=shape)
+
+        self.lengths = np.asarray([len(seq) for seq in seqs], dtype=np.float64)
+        self.set_sizes = np.asarray(self.word_sets.sum(axis=1)).reshape(-1)
+
+    def token_f1(self):
+        '''
+        :return: num_seqs x num_seqs matrix of token F1, the same as evaluate.f1_score() of each pair
+        '''
+        common = self.occurrences.dot(self.occurrences.T).toarray()
+        # 2PR/(P+R) = 2 * common / (len_i + len_j), 0 if nothing in common
+        total_lengths = self.lengths[:, None] + self.lengths[None, :]
+        return np.divide(2.0 * common, total_lengths, out=np.zeros_like(common), where=common > 0)
+
+    def jaccard(self):
+        '''
+        :return: num_seqs x num_seqs matrix of Jaccard coefficients of the word sets, 0 if both are empty
+        '''
+        intersections = self.word_sets.dot(self.word_sets.T).toarray()
+        unions = self.set_sizes[:, None] + self.set_sizes[None, :] - intersections
+        return np.divide(intersections, unions, out=np.zeros_like(intersections), where=unions > 0)
+
+
+def mean_max_similarity(pairwise_scores):
+    '''
+    :return: float32, the average over rows of the max similarity to any other row
+    '''
+    pairwise_scores = pairwise_scores.astype(np.float32)
+    np.fill_diagonal(pairwise_scores, 0.0)
+    return np.mean(np.max(pairwise_scores, 1))
+
+
+def self_redundancy(seqs, metric='f1'):
+    '''
+    :param seqs: list of list of words
+    :param metric: 'f1' (token F1) or 'jaccard'
+    :return: the average over seqs of the max similarity to any other seq, None if seqs is empty
+    '''
+    if len(seqs) == 0:
+        return None
+    if metric == 'f1':
+        return mean_max_similarity(BagOfWords(seqs).token_f1())
+    elif metric == 'jaccard':
+        return mean_max_similarity(BagOfWords(seqs).jaccard())
+    else:
+        raise Exception('Unsupported redundancy metric=%s' % metric)
+
+
+def diversity_scores(seqs):
+    '''
+    :return: {'self_redundancy_f1', 'self_redundancy_jaccard'} of seqs, both are computed from one BagOfWords
+    '''
+    if len(seqs) == 0:
+        return {'self_redundancy_f1': None, 'self_redundancy_jaccard': None}
+    bag_of_words = BagOfWords(seqs)
+    return {'self_redundancy_f1': mean_max_similarity(bag_of_words.token_f1()),
+            'self_redundancy_jaccard': mean_max_similarity(bag_of_words.jaccard())}
@@ -2,6 +2,7 @@
 """
 Python File Template 
 """
+import copy
 import logging
 import torch
 import torch.nn as nn
@@ -340,6 +341,9 @@ class Seq2SeqLSTMAttention(nn.Module):
         else:
             self.dec_input_bridge = nn.Linear(self.dec_input_dim, self.emb_dim)
 
+        # reused by merge_copy_probs() in inference, see get_merge_buffer()
+        self.merge_buffer = None
+
         self.init_weights()
 
     def init_weights(self):
@@ -381,7 +385,7 @@ class Seq2SeqLSTMAttention(nn.Module):
 
         return decoder_init_hidden, decoder_init_cell
 
-    def forward(self, input_src, input_src_len, input_trg, input_src_ext, oov_lists, trg_mask=None, ctx_mask=None):
+    def forward(self, input_src, input_src_len, input_trg, input_src_ext, oov_lists, trg_mask=None, ctx_mask=None, candidate_ids=None, candidate_log_q=None):
         '''
         The differences of copy model from normal seq2seq here are:
          1. The size of decoder_logits is (batch_size, trg_seq_len, vocab_size + max_oov_number).Usually vocab_size=50000 and max_oov_number=1000. And only very few of (it's very rare to have many unk words, in most cases it's because the text is not in English)
@@ -391,6 +395,8 @@ class Seq2SeqLSTMAttention(nn.Module):
             input_src : numericalized source text, oov words have been replaced with <unk>
             input_trg : numericalized target text, oov words have been replaced with temporary oov index
             input_src_ext : numericalized source text in extended vocab, oov words have been replaced with temporary oov index, for copy mechanism to map the probs of pointed words to vocab words
+            candidate_ids : (optional) sorted word indexes for sampled softmax training, then the output only covers these words (plus the oovs), see map_to_candidates()
+            candidate_log_q : (optional) log probabilities of the candidates being sampled, subtracted from their logits, see decode()
         :returns
             decoder_logits      : (batch_size, trg_seq_len, vocab_size)
             decoder_outputs     : (batch_size, trg_seq_len, hidden_size)
@@ -402,7 +408,8 @@ class Seq2SeqLSTMAttention(nn.Module):
         src_h, (src_h_t, src_c_t) = self.encode(input_src, input_src_len)
         decoder_probs, decoder_hiddens, attn_weights, copy_attn_weights = self.decode(trg_inputs=input_trg, src_map=input_src_ext,
                                                                                       oov_list=oov_lists, enc_context=src_h, enc_hidden=(src_h_t, src_c_t),
-                                                                                      trg_mask=trg_mask, ctx_mask=ctx_mask)
+                                                                                      trg_mask=trg_mask, ctx_mask=ctx_mask, candidate_ids=candidate_ids,
+                                                                                      candidate_log_q=candidate_log_q)
         return decoder_probs, decoder_hiddens, (attn_weights, copy_attn_weights)
 
     def encode(self, input_src, input_src_len):
@@ -464,15 +471,18 @@ class Seq2SeqLSTMAttention(nn.Module):
 
         return dec_input
 
-    def decode(self, trg_inputs, src_map, oov_list, enc_context, enc_hidden, trg_mask, ctx_mask):
+    def decode(self, trg_inputs, src_map, oov_list, enc_context, enc_hidden, trg_mask, ctx_mask, candidate_ids=None, candidate_log_q=None):
         '''
         :param
                 trg_input:         (batch_size, trg_len)
                 src_map  :         (batch_size, src_len), almost the same with src but oov words are replaced with temporary oov index, for copy mechanism to map the probs of pointed words to vocab words. The word index can be beyond vocab_size, e.g. 50000, 50001, 50002 etc, depends on how many oov words appear in the source text
                 context vector:    (batch_size, src_len, hidden_size * num_direction) the outputs (hidden vectors) of encoder
                 context mask:      (batch_size, src_len)
+                candidate_ids:     (num_candidates) sampled softmax only, the vocab words to score. Only supported with teacher forcing
+                candidate_log_q:   (num_candidates) sampled softmax only, log of the probability that each candidate is in the sampled set
+                                   (0 for the words always included). Subtracting it from the logits corrects the bias of the proposal (Bengio & Senecal 2008)
         :returns
-            decoder_probs       : (batch_size, trg_seq_len, vocab_size + max_oov_number)
+            decoder_probs       : (batch_size, trg_seq_len, vocab_size + max_oov_number), or (batch_size, trg_seq_len, num_candidates + max_oov_number) for sampled softmax
             decoder_outputs     : (batch_size, trg_seq_len, hidden_size)
             attn_weights        : (batch_size, trg_seq_len, src_seq_len)
             copy_attn_weights   : (batch_size, trg_seq_len, src_seq_len)
@@ -523,7 +533,15 @@ class Seq2SeqLSTMAttention(nn.Module):
 
             # compute the output decode_logit and read-out as probs: p_x = Softmax(W_s * h_tilde), (batch_size, trg_len, trg_hidden_size) -> (batch_size * trg_len, vocab_size)
             # h_tildes=(batch_size, trg_len, trg_hidden_size) -> decoder2vocab(h_tildes.view)=(batch_size * trg_len, vocab_size) -> decoder_logits=(batch_size, trg_len, vocab_size)
-            decoder_logits = self.decoder2vocab(h_tildes.view(-1, trg_hidden_dim)).view(batch_size, max_length, -1)
+            if candidate_ids is None:
+                decoder_logits = self.decoder2vocab(h_tildes.view(-1, trg_hidden_dim)).view(batch_size, max_length, -1)
+            else:
+                # sampled softmax, only project onto the rows of candidate words (batch_size, trg_len, num_candidates)
+                decoder_logits = self.candidate_decoder2vocab(candidate_ids)(h_tildes.contiguous().view(-1, trg_hidden_dim)).view(batch_size, max_length, -1)
+                if candidate_log_q is not None:
+                    decoder_logits = decoder_logits - candidate_log_q
+                # the pointed source words have to be mapped to their positions in the candidate set as well
+                src_map = self.map_to_candidates(src_map, candidate_ids)
 
             '''
             (3) Copy Attention
@@ -539,7 +557,7 @@ class Seq2SeqLSTMAttention(nn.Module):
                 decoder_log_probs = self.merge_copy_probs(decoder_logits, copy_logits, src_map, oov_list)  # (batch_size, trg_len, vocab_size + max_oov_number)
                 decoder_outputs = decoder_outputs.permute(1, 0, 2)  # (batch_size, trg_len, trg_hidden_dim)
             else:
-                decoder_log_probs = torch.nn.functional.log_softmax(decoder_logits, dim=-1).view(batch_size, -1, self.vocab_size)
+                decoder_log_probs = torch.nn.functional.log_softmax(decoder_logits, dim=-1).view(batch_size, -1, decoder_logits.size(-1))
                 copy_weights = []
 
         else:
@@ -547,6 +565,7 @@ class Seq2SeqLSTMAttention(nn.Module):
             Word Sampling
             (1) Feedforwarding RNN
             '''
+            assert candidate_ids is None, 'sampled softmax only supports teacher forcing'
             # take the first word (should be BOS <s>) of each target sequence (batch_size, 1)
             trg_input = trg_inputs[:, 0].unsqueeze(1)
             decoder_log_probs = []
@@ -655,7 +674,63 @@ class Seq2SeqLSTMAttention(nn.Module):
 
         return merged_log_prob
 
-    def merge_copy_probs(self, decoder_logits, copy_logits, src_map, oov_list):
+    def candidate_decoder2vocab(self, candidate_ids):
+        '''
+        Return a function which computes the output logits of the candidate words only, (N, trg_hidden_dim) -> (N, num_candidates)
+        '''
+        if isinstance(self.decoder2vocab, nn.Linear):
+            weight = self.decoder2vocab.weight.index_select(0, candidate_ids)
+            bias = self.decoder2vocab.bias.index_select(0, candidate_ids)
+            return lambda hiddens: func.linear(hiddens, weight, bias)
+
+        # a quantized Linear has no float weight to slice, compute the full logits and pick out the candidates
+        return lambda hiddens: self.decoder2vocab(hiddens).index_select(1, candidate_ids)
+
+    def map_to_candidates(self, word_ids, candidate_ids):
+        '''
+        Map word indexes to their positions in the output of sampled softmax, i.e. candidate_ids[i] -> i,
+            and the temporary oov indexes vocab_size + j -> num_candidates + j, so the copying part stays right after the candidates
+        Every in-vocab word in word_ids must be one of the candidates
+        :param word_ids: LongTensor of any shape, may contain temporary oov indexes
+        :param candidate_ids: (num_candidates) sorted unique vocab indexes
+        :return: LongTensor in the same shape of word_ids
+        '''
+        num_candidates = candidate_ids.size(0)
+        positions = word_ids.new_full((self.vocab_size,), -1)
+        positions[candidate_ids] = torch.arange(0, num_candidates, dtype=word_ids.dtype, device=word_ids.device)
+
+        is_oov = word_ids >= self.vocab_size
+        mapped_ids = positions[word_ids.clamp(max=self.vocab_size - 1)]
+        mapped_ids = torch.where(is_oov, word_ids - self.vocab_size + num_candidates, mapped_ids)
+
+        return mapped_ids
+
+    def map_from_candidates(self, positions, candidate_ids):
+        '''
+        Inverse of map_to_candidates(), convert the output positions of a candidate (shortlisted) softmax back to word indexes
+        :param positions: LongTensor of any shape, positions >= num_candidates are the temporary oov indexes
+        :param candidate_ids: (num_candidates) sorted unique vocab indexes
+        :return: LongTensor in the same shape of positions
+        '''
+        num_candidates = candidate_ids.size(0)
+        word_ids = candidate_ids[positions.clamp(max=num_candidates - 1)]
+        word_ids = torch.where(positions >= num_candidates, positions - num_candidates + self.vocab_size, word_ids)
+
+        return word_ids
+
+    def get_merge_buffer(self, size, like):
+        '''
+        Preallocated storage for merge_copy_probs() in inference, grows to the maximum size seen so far
+        :param size: number of elements needed
+        :param like: a tensor with the expected device and dtype
+        :return: 1-d tensor of size elements, contents are undefined
+        '''
+        if self.merge_buffer is None or self.merge_buffer.numel() < size \
+                or self.merge_buffer.device != like.device or self.merge_buffer.dtype != like.dtype:
+            self.merge_buffer = like.new_empty((size,))
+        return self.merge_buffer[:size]
+
+    def merge_copy_probs(self, decoder_logits, copy_logits, src_map, oov_list, reuse_buffer=False):
         '''
         The function takes logits as inputs here because Gu's model applies softmax in the end, to normalize generative/copying together
         The tricky part is, Gu's model merges the logits of generative and copying part instead of probabilities,
@@ -663,41 +738,47 @@ class Seq2SeqLSTMAttention(nn.Module):
         To the sentences that have oovs it's fine. But if some sentences in a batch don't have oovs but mixed with sentences have oovs, the extended oov part would be ranked highly after softmax (zero is larger than other negative values in logits).
         Thus we have to carefully initialize the oov-extended part of no-oov sentences to negative infinite floats.
         Note that it may cause exception on early versions like on '0.3.1.post2', but it works well on 0.4 ({RuntimeError}in-place operations can be only used on variables that don't share storage with any other variables, but detected that there are 2 objects sharing it)
-        :param decoder_logits: (batch_size, trg_seq_len, vocab_size)
+        :param decoder_logits: (batch_size, trg_seq_len, vocab_size), or (batch_size, trg_seq_len, num_candidates) for sampled softmax
         :param copy_logits:    (batch_size, trg_len, src_len) the pointing/copying logits of each target words
-        :param src_map:        (batch_size, src_len)
+        :param src_map:        (batch_size, src_len), indexes should be consistent with decoder_logits (see map_to_candidates())
+        :param reuse_buffer:   write the outputs into the preallocated buffer when grad is disabled, the returned log_probs are overwritten by the next call
         :return:
             decoder_copy_probs: return the log_probs (batch_size, trg_seq_len, vocab_size + max_oov_number)
         '''
-        batch_size, max_length, _ = decoder_logits.size()
+        batch_size, max_length, output_size = decoder_logits.size()
         src_len = src_map.size(1)
 
         # set max_oov_number to be the max number of oov
         max_oov_number = max([len(oovs) for oovs in oov_list])
+        extended_size = output_size + max_oov_number
+        use_buffer = reuse_buffer and not torch.is_grad_enabled()
+
+        # the oov-extended part is 0 for the real oovs of each example and -inf for the paddings, (batch_size, 1, max_oov_number), created on the same device
+        oov_numbers = torch.tensor([len(oovs) for oovs in oov_list], device=decoder_logits.device)
+        oov_padding_mask = torch.arange(0, max_oov_number, device=decoder_logits.device).unsqueeze(0) >= oov_numbers.unsqueeze(1)
+        oov_padding_mask = oov_padding_mask.unsqueeze(1)
+
+        if use_buffer:
+            # in inference write the logits into the preallocated storage directly instead of concatenating,
+            #   thus the returned log_probs is only valid until the next call
+            merged_logits = self.get_merge_buffer(batch_size * max_length * extended_size, decoder_logits).view(batch_size, max_length, extended_size)
+            merged_logits[:, :, :output_size] = decoder_logits
+            merged_logits[:, :, output_size:] = 0.0
+            merged_logits[:, :, output_size:].masked_fill_(oov_padding_mask, float('-inf'))
+        else:
+            # with autograd concatenating is faster than slice-assigning (its backward is a simple narrow), the extended part is only expanded
+            extended_logits = decoder_logits.new_zeros((batch_size, 1, max_oov_number)).masked_fill_(oov_padding_mask, float('-inf'))
+            merged_logits = torch.cat((decoder_logits, extended_logits.expand(batch_size, max_length, max_oov_number)), dim=2)
 
-        # flatten and extend size of decoder_probs from (vocab_size) to (vocab_size+max_oov_number)
-        flattened_decoder_logits = decoder_logits.view(batch_size * max_length, self.vocab_size)
-        if max_oov_number > 0:
-            '''
-            extended_zeros           = Variable(torch.zeros(batch_size * max_length, max_oov_number))
-            extended_zeros           = extended_zeros.cuda() if torch.cuda.is_available() else extended_zeros
-            flattened_decoder_logits = torch.cat((flattened_decoder_logits, extended_zeros), dim=1)
-            '''
-            extended_logits = Variable(torch.FloatTensor([[0.0] * len(oov) + [float('-inf')] * (max_oov_number - len(oov)) for oov in oov_list]))
-            extended_logits = extended_logits.unsqueeze(1).expand(batch_size, max_length, max_oov_number).contiguous().view(batch_size * max_length, -1)
-            extended_logits = extended_logits.cuda() if torch.cuda.is_available() else extended_logits
-            flattened_decoder_logits = torch.cat((flattened_decoder_logits, extended_logits), dim=1)
-
-        # add probs of copied words by scatter_add_(dim, index, src), index should be in the same shape with src. decoder_probs=(batch_size * trg_len, vocab_size+max_oov_number), copy_weights=(batch_size, trg_len, src_len)
-        expanded_src_map = src_map.unsqueeze(1).expand(batch_size, max_length, src_len).contiguous().view(batch_size * max_length, -1)  # (batch_size, src_len) -> (batch_size * trg_len, src_len)
-        # flattened_decoder_logits.scatter_add_(dim=1, index=expanded_src_map, src=copy_logits.view(batch_size * max_length, -1))
-        flattened_decoder_logits = flattened_decoder_logits.scatter_add_(1, expanded_src_map, copy_logits.view(batch_size * max_length, -1))
-
-        # apply log softmax to normalize, ensuring it meets the properties of probability, (batch_size * trg_len, src_len)
-        flattened_decoder_logits = torch.nn.functional.log_softmax(flattened_decoder_logits, dim=1)
+        # add logits of copied words by scatter_add_(dim, index, src), index should be in the same shape with src.
+        # merged_logits=(batch_size, trg_len, vocab_size+max_oov_number), src_map is expanded without copying to (batch_size, trg_len, src_len)
+        merged_logits.scatter_add_(2, src_map.unsqueeze(1).expand(batch_size, max_length, src_len), copy_logits)
 
-        # reshape to batch first before returning (batch_size, trg_len, src_len)
-        decoder_log_probs = flattened_decoder_logits.view(batch_size, max_length, self.vocab_size + max_oov_number)
+        # apply log softmax to normalize, ensuring it meets the properties of probability, (batch_size, trg_len, vocab_size+max_oov_number)
+        if use_buffer:
+            decoder_log_probs = merged_logits.sub_(torch.logsumexp(merged_logits, dim=2, keepdim=True))
+        else:
+            decoder_log_probs = torch.nn.functional.log_softmax(merged_logits, dim=2)
 
         return decoder_log_probs
 
@@ -726,7 +807,7 @@ class Seq2SeqLSTMAttention(nn.Module):
 
         return do_tf
 
-    def generate(self, trg_input, dec_hidden, enc_context, ctx_mask=None, src_map=None, oov_list=None, max_len=1, return_attention=False):
+    def generate(self, trg_input, dec_hidden, enc_context, ctx_mask=None, src_map=None, oov_list=None, max_len=1, return_attention=False, candidate_ids=None):
         '''
         Given the initial input, state and the source contexts, return the top K restuls for each time step
         :param trg_input: just word indexes of target texts (usually zeros indicating BOS <s>)
@@ -734,6 +815,8 @@ class Seq2SeqLSTMAttention(nn.Module):
         :param enc_context: context encoding vectors
         :param src_map: required if it's copy model
         :param oov_list: required if it's copy model
+        :param candidate_ids: (optional) shortlist of vocab indexes, only these words are scored and the returned log_probs are
+            over positions of (candidate_ids + oovs), use map_from_candidates() to get word indexes. Only works with max_len=1
         :param k (deprecated): Top K to return
         :param feed_all_timesteps: it's one-step predicting or feed all inputs to run through all the time steps
         :param get_attention: return attention vectors?
@@ -757,6 +840,12 @@ class Seq2SeqLSTMAttention(nn.Module):
         if self.attention_layer.method == 'dot':
             enc_context = nn.Tanh()(self.encoder2decoder_hidden(enc_context.contiguous().view(-1, context_dim))).view(batch_size, src_len, trg_hidden_dim)
 
+        if candidate_ids is not None:
+            assert max_len == 1, 'the predicted positions cannot be fed back to decoder when scoring a shortlist'
+            candidate_decoder2vocab = self.candidate_decoder2vocab(candidate_ids)
+            if self.copy_attention:
+                src_map = self.map_to_candidates(src_map, candidate_ids)
+
         for i in range(max_len):
             # print('TRG_INPUT: %s' % str(trg_input.size()))
             # print(trg_input.data.numpy())
@@ -775,12 +864,16 @@ class Seq2SeqLSTMAttention(nn.Module):
 
             # compute the output decode_logit and read-out as probs: p_x = Softmax(W_s * h_tilde)
             # (batch_size, trg_len, trg_hidden_size) -> (batch_size, 1, vocab_size)
-            decoder_logit = self.decoder2vocab(h_tilde.view(-1, trg_hidden_dim))
+            if candidate_ids is None:
+                decoder_logit = self.decoder2vocab(h_tilde.view(-1, trg_hidden_dim))
+            else:
+                decoder_logit = candidate_decoder2vocab(h_tilde.contiguous().view(-1, trg_hidden_dim))
+            output_size = decoder_logit.size(-1)
 
             if not self.copy_attention:
-                decoder_log_prob = torch.nn.functional.log_softmax(decoder_logit, dim=-1).view(batch_size, 1, self.vocab_size)
+                decoder_log_prob = torch.nn.functional.log_softmax(decoder_logit, dim=-1).view(batch_size, 1, output_size)
             else:
-                decoder_logit = decoder_logit.view(batch_size, 1, self.vocab_size)
+                decoder_logit = decoder_logit.view(batch_size, 1, output_size)
                 # copy_weights and copy_logits is (batch_size, trg_len, src_len)
                 if not self.reuse_copy_attn:
                     copy_h_tilde, copy_weight, copy_logit = self.copy_attention_layer(decoder_output.permute(1, 0, 2), enc_context, encoder_mask=ctx_mask)
@@ -788,7 +881,8 @@ class Seq2SeqLSTMAttention(nn.Module):
                     copy_h_tilde, copy_weight, copy_logit = h_tilde, attn_weight, attn_logit
                 copy_weights.append(copy_weight.permute(1, 0, 2))  # (1, batch_size, src_len)
                 # merge the generative and copying probs (batch_size, 1, vocab_size + max_unk_word)
-                decoder_log_prob = self.merge_copy_probs(decoder_logit, copy_logit, src_map, oov_list)
+                # the buffer can only be reused for one-step generation, otherwise the log_probs of previous steps would be overwritten
+                decoder_log_prob = self.merge_copy_probs(decoder_logit, copy_logit, src_map, oov_list, reuse_buffer=(max_len == 1))
 
             # Prepare for the next iteration, get the top word, top_idx and next_index are (batch_size, K)
             top_1_v, top_1_idx = decoder_log_prob.data.topk(1, dim=-1)  # (batch_size, 1)
@@ -800,7 +894,10 @@ class Seq2SeqLSTMAttention(nn.Module):
             attn_weights.append(attn_weight.permute(1, 0, 2))  # (1, batch_size, src_len)
 
         # permute to trg_len first, otherwise the cat operation would mess up things
-        log_probs = torch.cat(log_probs, 0).permute(1, 0, 2)  # (batch_size, max_len, K)
+        if len(log_probs) == 1:
+            log_probs = log_probs[0].permute(1, 0, 2)  # (batch_size, 1, K), avoid copying the one-step outputs
+        else:
+            log_probs = torch.cat(log_probs, 0).permute(1, 0, 2)  # (batch_size, max_len, K)
         attn_weights = torch.cat(attn_weights, 0).permute(1, 0, 2)  # (batch_size, max_len, src_seq_len)
 
         # Only return the hidden vectors of the last time step.
@@ -954,6 +1051,19 @@ class Seq2SeqLSTMAttention(nn.Module):
         return decoder_log_probs, decoder_outputs, attn_weights
 
 
+def quantize_model(model):
+    '''
+    Dynamic int8 quantization for CPU inference: weights of all the LSTM and Linear layers (encoder/decoder, attention,
+        encoder2decoder_*, decoder2vocab) are stored in int8 and activations are quantized on the fly. Embeddings stay in fp32.
+    The quantized model cannot be trained and only runs on CPU.
+    :return: a new quantized model, the input model is not changed
+    '''
+    # copy first, as cpu() and eval() change the model in place
+    model = copy.deepcopy(model).cpu()
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
 class Seq2SeqLSTMAttentionCascading(Seq2SeqLSTMAttention):
     def __init__(self, opt):
         super(Seq2SeqLSTMAttentionCascading, self).__init__(opt)
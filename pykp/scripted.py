@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+TorchScript export of Seq2SeqLSTMAttention for inference.
+The eager model pays Python overhead on every decoding step (Variable wrappers, cuda checks, permutes and branches on the
+    copy/input-feeding options). Here the encoder and a pure single-step decoder are rebuilt from the trained submodules
+    (weights are shared, not copied) with all the options resolved at construction, then compiled by torch.jit.script:
+    ScriptedEncoder:    (src, src_len) -> (context, h_t, c_t), and init_decoder_state(h_t, c_t)
+    ScriptedDecodeStep: (input, state, context, ...) -> (log_probs, new state, attentions)
+ScriptedSeq2Seq wraps both with the interface used by SequenceGenerator (encode/init_decoder_state/generate).
+Only 'general' and 'dot' attention are supported.
+"""
+import os
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+
+class ScriptableAttention(nn.Module):
+    '''
+    Same computation as pykp.model.Attention.forward() for 'general' and 'dot' attention, with the mask always given
+    '''
+    def __init__(self, attention):
+        super(ScriptableAttention, self).__init__()
+        if attention.method not in ['general', 'dot']:
+            raise ValueError('TorchScript export does not support %s attention' % attention.method)
+        self.is_general = attention.method == 'general'
+        self.attn = attention.attn if self.is_general else nn.Identity()
+        self.linear_out = attention.linear_out
+
+    def forward(self, hidden: torch.Tensor, encoder_outputs: torch.Tensor, encoder_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        '''
+        :param hidden: (batch_size, trg_len, trg_hidden_dim)
+        :param encoder_outputs: (batch_size, src_len, context_dim)
+        :param encoder_mask: (batch_size, src_len) float mask
+        :return: h_tilde (batch_size, trg_len, trg_hidden_dim), attn_weights and attn_energies (batch_size, trg_len, src_len)
+        '''
+        if self.is_general:
+            energies = self.attn(encoder_outputs)
+        else:
+            energies = encoder_outputs
+        energies = torch.bmm(hidden, energies.transpose(1, 2))
+
+        # masked_softmax() in pykp.eric_layers
+        mask = encoder_mask.unsqueeze(1)
+        energies = energies * mask
+        clamped_energies = torch.clamp(energies, min=-15.0, max=15.0) * mask
+        e_x = torch.exp(clamped_energies - torch.max(clamped_energies, dim=-1, keepdim=True)[0]) * mask
+        attn_weights = e_x / (torch.sum(e_x, dim=-1, keepdim=True) + 1e-6)
+
+        weighted_context = torch.bmm(attn_weights, encoder_outputs)
+        h_tilde = torch.tanh(self.linear_out(torch.cat((weighted_context, hidden), 2)))
+
+        return h_tilde, attn_weights, energies
+
+
+class ScriptedEncoder(nn.Module):
+    def __init__(self, model):
+        super(ScriptedEncoder, self).__init__()
+        self.embedding = model.embedding
+        self.encoder = model.encoder
+        self.encoder2decoder_hidden = model.encoder2decoder_hidden
+        self.encoder2decoder_cell = model.encoder2decoder_cell
+        self.bidirectional = model.bidirectional
+        self.num_states = model.encoder.num_layers * model.num_directions
+        self.src_hidden_dim = model.src_hidden_dim
+        self.trg_hidden_dim = model.trg_hidden_dim
+        # for dot attention the context is projected to trg_hidden_dim, which is done once here instead of every step
+        self.project_context = model.attention_layer.method == 'dot'
+
+    def forward(self, input_src: torch.Tensor, input_src_len: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        '''
+        :param input_src: (batch_size, src_len), sorted by length in descending order
+        :param input_src_len: (batch_size) int64 cpu tensor
+        :return: context (batch_size, src_len, context_dim), h_t and c_t (batch_size, src_hidden_dim * num_directions)
+        '''
+        batch_size = input_src.size(0)
+        h0 = torch.zeros(self.num_states, batch_size, self.src_hidden_dim, device=input_src.device)
+        c0 = torch.zeros(self.num_states, batch_size, self.src_hidden_dim, device=input_src.device)
+
+        src_emb = nn.utils.rnn.pack_padded_sequence(self.embedding(input_src), input_src_len, batch_first=True)
+        src_h, (src_h_t, src_c_t) = self.encoder(src_emb, (h0, c0))
+        src_h, _ = nn.utils.rnn.pad_packed_sequence(src_h, batch_first=True)
+
+        if self.bidirectional:
+            h_t = torch.cat((src_h_t[-1], src_h_t[-2]), 1)
+            c_t = torch.cat((src_c_t[-1], src_c_t[-2]), 1)
+        else:
+            h_t = src_h_t[-1]
+            c_t = src_c_t[-1]
+
+        if self.project_context:
+            src_h = torch.tanh(self.encoder2decoder_hidden(src_h))
+
+        return src_h, h_t, c_t
+
+    @torch.jit.export
+    def init_decoder_state(self, enc_h: torch.Tensor, enc_c: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        return torch.tanh(self.encoder2decoder_hidden(enc_h)).unsqueeze(0), torch.tanh(self.encoder2decoder_cell(enc_c)).unsqueeze(0)
+
+
+class ScriptedDecodeStep(nn.Module):
+    '''
+    One decoding step of Seq2SeqLSTMAttention.generate(). The state is (h, c, h_tilde, copy_h_tilde),
+        h_tilde/copy_h_tilde are only used by input feeding and are returned for the next step
+    '''
+    def __init__(self, model):
+        super(ScriptedDecodeStep, self).__init__()
+        self.embedding = model.embedding
+        self.decoder = model.decoder
+        self.attention_layer = ScriptableAttention(model.attention_layer)
+        self.decoder2vocab = model.decoder2vocab
+
+        self.copy_attention = bool(model.copy_attention)
+        self.reuse_copy_attn = bool(model.reuse_copy_attn) or not self.copy_attention
+        if self.reuse_copy_attn:
+            self.copy_attention_layer = self.attention_layer
+        else:
+            self.copy_attention_layer = ScriptableAttention(model.copy_attention_layer)
+
+        self.input_feeding = bool(model.input_feeding)
+        self.copy_input_feeding = bool(model.copy_input_feeding)
+        self.use_input_bridge = model.dec_input_bridge is not None
+        self.dec_input_bridge = model.dec_input_bridge if self.use_input_bridge else nn.Identity()
+
+    def forward(self, trg_input: torch.Tensor, h: torch.Tensor, c: torch.Tensor, h_tilde: torch.Tensor, copy_h_tilde: torch.Tensor,
+                enc_context: torch.Tensor, ctx_mask: torch.Tensor, src_map: torch.Tensor, oov_padding_mask: torch.Tensor
+                ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        '''
+        :param trg_input: (batch_size, 1) previous words, oovs have been replaced with <unk>
+        :param h, c: (1, batch_size, trg_hidden_dim) decoder state
+        :param h_tilde, copy_h_tilde: (batch_size, 1, trg_hidden_dim) attentional vectors of the previous step (zeros at the beginning)
+        :param enc_context: (batch_size, src_len, context_dim) from ScriptedEncoder
+        :param ctx_mask: (batch_size, src_len) float mask
+        :param src_map: (batch_size, src_len) source words in extended vocab, only used with copy attention
+        :param oov_padding_mask: (batch_size, max_oov_number) True for the padded oov positions, only used with copy attention
+        :return: log_probs (batch_size, vocab_size + max_oov_number), h, c, h_tilde, copy_h_tilde,
+            attn_weights and copy_weights (batch_size, src_len)
+        '''
+        trg_emb = self.embedding(trg_input).transpose(0, 1)  # (1, batch_size, emb_dim)
+        if self.use_input_bridge:
+            inputs = trg_emb
+            if self.input_feeding:
+                inputs = torch.cat((inputs, h_tilde.transpose(0, 1)), 2)
+            if self.copy_input_feeding:
+                inputs = torch.cat((inputs, copy_h_tilde.transpose(0, 1)), 2)
+            dec_input = torch.tanh(self.dec_input_bridge(inputs))
+        else:
+            dec_input = trg_emb
+
+        decoder_output, (h, c) = self.decoder(dec_input, (h, c))
+        decoder_output = decoder_output.transpose(0, 1)  # (batch_size, 1, trg_hidden_dim)
+
+        h_tilde, attn_weight, attn_logit = self.attention_layer(decoder_output, enc_context, ctx_mask)
+        decoder_logit = self.decoder2vocab(h_tilde.squeeze(1))  # (batch_size, vocab_size)
+
+        if not self.copy_attention:
+            return torch.log_softmax(decoder_logit, dim=1), h, c, h_tilde, copy_h_tilde, attn_weight.squeeze(1), attn_weight.squeeze(1)
+
+        if self.reuse_copy_attn:
+            copy_h_tilde, copy_weight, copy_logit = h_tilde, attn_weight, attn_logit
+        else:
+            copy_h_tilde, copy_weight, copy_logit = self.copy_attention_layer(decoder_output, enc_context, ctx_mask)
+
+        # merge the generative and copying logits, see Seq2SeqLSTMAttention.merge_copy_probs(), inference only thus all in-place
+        vocab_size = decoder_logit.size(1)
+        merged_logits = decoder_logit.new_empty((decoder_logit.size(0), vocab_size + oov_padding_mask.size(1)))
+        merged_logits[:, :vocab_size] = decoder_logit
+        merged_logits[:, vocab_size:] = 0.0
+        merged_logits[:, vocab_size:].masked_fill_(oov_padding_mask, float('-inf'))
+        merged_logits.scatter_add_(1, src_map, copy_logit.squeeze(1))
+        log_probs = merged_logits.sub_(torch.logsumexp(merged_logits, dim=1, keepdim=True))
+
+        return log_probs, h, c, h_tilde, copy_h_tilde, attn_weight.squeeze(1), copy_weight.squeeze(1)
+
+
+class ScriptedSeq2Seq(nn.Module):
+    '''
+    Drop-in replacement of Seq2SeqLSTMAttention for SequenceGenerator, backed by the TorchScript modules
+    '''
+    def __init__(self, scripted_encoder, scripted_decode_step, vocab_size, unk_word, trg_hidden_dim, copy_attention):
+        super(ScriptedSeq2Seq, self).__init__()
+        self.scripted_encoder = scripted_encoder
+        self.scripted_decode_step = scripted_decode_step
+        self.vocab_size = vocab_size
+        self.unk_word = unk_word
+        self.trg_hidden_dim = trg_hidden_dim
+        self.copy_attention = copy_attention
+
+    def encode(self, input_src, input_src_len):
+        src_h, h_t, c_t = self.scripted_encoder(input_src, torch.as_tensor(input_src_len, dtype=torch.long))
+        return src_h, (h_t, c_t)
+
+    def init_decoder_state(self, enc_h, enc_c):
+        return self.scripted_encoder.init_decoder_state(enc_h, enc_c)
+
+    def generate(self, trg_input, dec_hidden, enc_context, ctx_mask=None, src_map=None, oov_list=None, max_len=1, return_attention=False, candidate_ids=None):
+        '''
+        Same as Seq2SeqLSTMAttention.generate(), the attentional vectors of input feeding start from zeros at every call as the eager model does
+        '''
+        assert candidate_ids is None, 'vocab shortlist is not supported by the TorchScript model'
+        batch_size = trg_input.size(0)
+        h, c = dec_hidden
+        h_tilde = enc_context.new_zeros((batch_size, 1, self.trg_hidden_dim))
+        copy_h_tilde = h_tilde
+
+        if self.copy_attention:
+            max_oov_number = max([len(oovs) for oovs in oov_list])
+            oov_numbers = torch.tensor([len(oovs) for oovs in oov_list], device=enc_context.device)
+            oov_padding_mask = torch.arange(0, max_oov_number, device=enc_context.device).unsqueeze(0) >= oov_numbers.unsqueeze(1)
+        else:
+            src_map = trg_input
+            oov_padding_mask = torch.zeros(batch_size, 0, dtype=torch.bool, device=enc_context.device)
+
+        log_probs, attn_weights, copy_weights = [], [], []
+        for i in range(max_len):
+            log_prob, h, c, h_tilde, copy_h_tilde, attn_weight, copy_weight = self.scripted_decode_step(
+                trg_input, h, c, h_tilde, copy_h_tilde, enc_context, ctx_mask, src_map, oov_padding_mask)
+            trg_input = log_prob.topk(1, dim=-1)[1]
+            log_probs.append(log_prob.unsqueeze(1))
+            attn_weights.append(attn_weight.unsqueeze(1))
+            copy_weights.append(copy_weight.unsqueeze(1))
+
+        log_probs = torch.cat(log_probs, 1)  # (batch_size, max_len, vocab_size + max_oov_number)
+        if not return_attention:
+            return log_probs, (h, c)
+
+        attn_weights = torch.cat(attn_weights, 1)  # (batch_size, max_len, src_len)
+        if not self.copy_attention:
+            return log_probs, (h, c), attn_weights
+        return log_probs, (h, c), (attn_weights, torch.cat(copy_weights, 1))
+
+
+def script_model(model):
+    '''
+    Compile the encoder and the single-step decoder of a trained Seq2SeqLSTMAttention with TorchScript
+    :return: ScriptedSeq2Seq sharing the weights with model
+    '''
+    model.eval()
+    return ScriptedSeq2Seq(torch.jit.script(ScriptedEncoder(model)),
+                           torch.jit.script(ScriptedDecodeStep(model)),
+                           vocab_size=model.vocab_size,
+                           unk_word=model.unk_word,
+                           trg_hidden_dim=model.trg_hidden_dim,
+                           copy_attention=bool(model.copy_attention))
+
+
+def save_scripted_model(scripted_model, path_prefix):
+    '''
+    Save the two TorchScript modules to path_prefix + '.encoder.ts' and path_prefix + '.decode_step.ts',
+        they can be loaded without the source code of pykp
+    '''
+    torch.jit.save(scripted_model.scripted_encoder, path_prefix + '.encoder.ts')
+    torch.jit.save(scripted_model.scripted_decode_step, path_prefix + '.decode_step.ts')
+
+
+def load_scripted_model(path_prefix, vocab_size, unk_word, trg_hidden_dim, copy_attention, map_location=None):
+    if not os.path.exists(path_prefix + '.encoder.ts') or not os.path.exists(path_prefix + '.decode_step.ts'):
+        raise IOError('TorchScript modules not found: %s.encoder.ts/.decode_step.ts' % path_prefix)
+    return ScriptedSeq2Seq(torch.jit.load(path_prefix + '.encoder.ts', map_location=map_location),
+                           torch.jit.load(path_prefix + '.decode_step.ts', map_location=map_location),
+                           vocab_size=vocab_size,
+                           unk_word=unk_word,
+                           trg_hidden_dim=trg_hidden_dim,
+                           copy_attention=copy_attention)
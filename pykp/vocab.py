@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+A compact binary vocab. The vocab.pt of preprocess.py pickles (word2id, id2word, vocab) as python dicts including the word frequencies,
+    which is slow to load and copied into every process that holds it (DataLoader workers, pickled opt, etc.).
+Vocab is backed by one buffer and can be mmap-ed, thus the processes loading the same file share one copy in the page cache:
+    header:  magic (b'KPVOCAB') | version (uint8) | #words (uint32) | #buckets (uint32) | blob size (uint64)
+    offsets: uint32 * (#words + 1), the word of id i is blob[offsets[i]: offsets[i+1]]
+    buckets: int32 * #buckets, an open addressing hash table (crc32 of the utf-8 word, linear probing) of word ids, -1 for empty
+    blob:    words in utf-8, ordered by id
+All in little endian. A Vocab works like the word2id dict (vocab[w], w in vocab, vocab.get(w)) and vocab.id2word like the id2word dict.
+Version 1 (words joined by '\\n', no index) is still readable.
+Convert an existing vocab.pt by
+    python -m pykp.vocab data/kp20k/kp20k.vocab.pt data/kp20k/kp20k.vocab.bin
+"""
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+VOCAB_MAGIC = b'KPVOCAB'
+VOCAB_VERSION = 2
+HEADER_FORMAT_V1 = '<7sBI'
+HEADER_FORMAT = '<7sBIIQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+def word_hash(word_bytes):
+    # python's hash() of str is salted per process, crc32 is stable and implemented in C
+    return zlib.crc32(word_bytes)
+
+
+def as_array(buffer, typecode):
+    '''
+    View (or copy on big endian machines) the little endian buffer as an array of typecode
+    '''
+    if sys.byteorder == 'little':
+        return buffer.cast(typecode)
+    values = array(typecode, buffer.tobytes())
+    values.byteswap()
+    return values
+
+
+class Id2Word(object):
+    '''
+    The id2word view of a Vocab, vocab.id2word[i] works like the id2word dict
+    '''
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def __getitem__(self, word_id):
+        return self.vocab.itos(word_id)
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __contains__(self, word_id):
+        return 0 <= word_id < len(self.vocab)
+
+    def __iter__(self):
+        return iter(range(len(self.vocab)))
+
+    def get(self, word_id, default=None):
+        return self.vocab.itos(word_id) if word_id in self else default
+
+    def items(self):
+        return ((i, self.vocab.itos(i)) for i in range(len(self.vocab)))
+
+
+class Vocab(object):
+    def __init__(self, buffer, path=None):
+        '''
+        Use Vocab.load() or Vocab.from_id2word() rather than the constructor
+        :param buffer: the bytes (or mmap) in the format above
+        :param path:   the file of the buffer, a Vocab loaded from a file is pickled as its path
+        '''
+        self.buffer = buffer
+        self.path = path
+
+        magic, version, self.num_words, self.num_buckets, blob_size = struct.unpack(HEADER_FORMAT, buffer[:HEADER_SIZE])
+        if magic != VOCAB_MAGIC or version != VOCAB_VERSION:
+            raise ValueError('Not a binary vocab of version %d' % VOCAB_VERSION)
+
+        view = memoryview(buffer)
+        offsets_start = HEADER_SIZE
+        buckets_start = offsets_start + 4 * (self.num_words + 1)
+        blob_start = buckets_start + 4 * self.num_buckets
+        self.offsets = as_array(view[offsets_start: buckets_start], 'I')
+        self.buckets = as_array(view[buckets_start: blob_start], 'i')
+        self.blob = view[blob_start: blob_start + blob_size]
+        self.bucket_mask = self.num_buckets - 1
+        self.id2word = Id2Word(self)
+
+    @staticmethod
+    def serialize(words):
+        '''
+        :param words: list of words ordered by id
+        :return: bytes in the format above
+        '''
+        encoded_words = [w.encode('utf-8') for w in words]
+        offsets = array('I', [0] * (len(words) + 1))
+        for i, w in enumerate(encoded_words):
+            offsets[i + 1] = offsets[i] + len(w)
+
+        # a power of two with the load factor at most 0.5
+        num_buckets = 1
+        while num_buckets < 2 * max(len(words), 1):
+            num_buckets *= 2
+        buckets = array('i', [-1] * num_buckets)
+        for i, w in enumerate(encoded_words):
+            bucket = word_hash(w) & (num_buckets - 1)
+            while buckets[bucket] != -1:
+                if encoded_words[buckets[bucket]] == w:
+                    raise ValueError('Duplicate word in vocab: %s' % words[i])
+                bucket = (bucket + 1) & (num_buckets - 1)
+            buckets[bucket] = i
+
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            buckets.byteswap()
+
+        blob = b''.join(encoded_words)
+        return struct.pack(HEADER_FORMAT, VOCAB_MAGIC, VOCAB_VERSION, len(words), num_buckets, len(blob)) \
+               + offsets.tobytes() + buckets.tobytes() + blob
+
+    @classmethod
+    def from_id2word(cls, id2word):
+        '''
+        :param id2word: dict or list, the ids should be 0...N-1
+        '''
+        return cls(cls.serialize([id2word[i] for i in range(len(id2word))]))
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+        with open(path, 'rb') as vocab_file:
+            if use_mmap:
+                buffer = mmap.mmap(vocab_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = vocab_file.read()
+        return cls(buffer, path=path)
+
+    def save(self, path):
+        with open(path, 'wb') as vocab_file:
+            vocab_file.write(self.buffer[:])
+
+    def itos(self, word_id):
+        if not 0 <= word_id < self.num_words:
+            raise KeyError(word_id)
+        return self.blob[self.offsets[word_id]: self.offsets[word_id + 1]].tobytes().decode('utf-8')
+
+    def stoi(self, word, default=None):
+        word_bytes = word.encode('utf-8')
+        bucket = word_hash(word_bytes) & self.bucket_mask
+        while True:
+            word_id = self.buckets[bucket]
+            if word_id == -1:
+                return default
+            if self.blob[self.offsets[word_id]: self.offsets[word_id + 1]] == word_bytes:
+                return word_id
+            bucket = (bucket + 1) & self.bucket_mask
+
+    def __getitem__(self, word):
+        word_id = self.stoi(word)
+        if word_id is None:
+            raise KeyError(word)
+        return word_id
+
+    def __contains__(self, word):
+        return self.stoi(word) is not None
+
+    def get(self, word, default=None):
+        return self.stoi(word, default)
+
+    def __len__(self):
+        return self.num_words
+
+    def __iter__(self):
+        return (self.itos(i) for i in range(self.num_words))
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return iter(range(self.num_words))
+
+    def items(self):
+        return ((self.itos(i), i) for i in range(self.num_words))
+
+    def __reduce__(self):
+        # pickled as the path if loaded from a file, thus the DataLoader workers and pickled opts map the same file instead of copying
+        if self.path is not None:
+            return (Vocab.load, (self.path,))
+        return (Vocab, (bytes(self.buffer),))
+
+
+def is_binary_vocab(path):
+    with open(path, 'rb') as vocab_file:
+        return vocab_file.read(len(VOCAB_MAGIC)) == VOCAB_MAGIC
+
+
+def save_binary_vocab(id2word, path):
+    '''
+    :param id2word: dict or list, the ids should be 0...N-1
+    '''
+    with open(path, 'wb') as vocab_file:
+        vocab_file.write(Vocab.serialize([id2word[i] for i in range(len(id2word))]))
+
+
+def load_binary_vocab_v1(path):
+    '''
+    :return: word2id (dict), id2word (list)
+    '''
+    with open(path, 'rb') as vocab_file:
+        data = vocab_file.read()
+
+    _, _, num_words = struct.unpack(HEADER_FORMAT_V1, data[:struct.calcsize(HEADER_FORMAT_V1)])
+    id2word = data[struct.calcsize(HEADER_FORMAT_V1):].decode('utf-8').split('\n') if num_words > 0 else []
+    if len(id2word) != num_words:
+        raise ValueError('%s is broken, expect %d words but found %d' % (path, num_words, len(id2word)))
+    word2id = dict(zip(id2word, range(num_words)))
+
+    return word2id, id2word
+
+
+def load_vocab(path, use_mmap=True):
+    '''
+    Load either the binary vocab or the vocab.pt of preprocess.py
+    :return: word2id, id2word, vocab (the word frequencies, None for the binary vocab)
+        for the binary vocab word2id is a Vocab and id2word is its Id2Word view
+    '''
+    if is_binary_vocab(path):
+        with open(path, 'rb') as vocab_file:
+            version = struct.unpack('<B', vocab_file.read(len(VOCAB_MAGIC) + 1)[-1:])[0]
+        if version == 1:
+            word2id, id2word = load_binary_vocab_v1(path)
+            return word2id, id2word, None
+        vocab = Vocab.load(path, use_mmap=use_mmap)
+        return vocab, vocab.id2word, None
+
+    import torch
+    word2id, id2word, vocab = torch.load(path, 'rb')
+    return word2id, id2word, vocab
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python -m pykp.vocab <input vocab.pt> <output vocab.bin>')
+        sys.exit(1)
+
+    import torch
+    word2id, id2word, vocab = torch.load(sys.argv[1], 'rb')
+    save_binary_vocab(id2word, sys.argv[2])
+    print('Saved %d words to %s' % (len(id2word), sys.argv[2]))
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+A long-lived HTTP service for keyphrase extraction, the model and vocab are loaded only once.
+Concurrent single-document requests are collected into micro-batches (at most -max_batch_size documents, waiting at most -max_wait_ms
+    after the first one arrives) and decoded with one beam search.
+    python serve.py -model exp/kp20k.ml.copy/model/kp20k.ml.copy.epoch=1.batch=1000.total_batch=1000.model -vocab data/kp20k/kp20k.vocab.pt -port 8000
+    curl -X POST localhost:8000/extract -d '{"title": "...", "abstract": "...", "top_k": 10}'
+    curl localhost:8000/metrics
+Only the python standard library (asyncio) is used for serving. benchmarks/bench_serve.py is a load generator for it.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pykp.cache import PredictionCache
+from pykp.extractor import KeyphraseExtractor, document_text
+
+__author__ = "Rui Meng"
+__email__ = "rui.meng@pitt.edu"
+
+logger = logging.getLogger()
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class ServerMetrics(object):
+    '''
+    Throughput, latency percentiles and batch sizes over the most recent requests
+    '''
+    def __init__(self, window_size=1000, window_seconds=60.0):
+        self.start_time = time.time()
+        self.window_seconds = window_seconds
+        # (finish time, latency in ms) of the recent requests
+        self.recent_requests = collections.deque(maxlen=window_size)
+        self.recent_batch_sizes = collections.deque(maxlen=window_size)
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_errors = 0
+        self.num_rejected = 0
+
+    def record_batch(self, latencies):
+        now = time.time()
+        self.num_batches += 1
+        self.num_requests += len(latencies)
+        self.recent_batch_sizes.append(len(latencies))
+        self.recent_requests.extend([(now, latency) for latency in latencies])
+
+    def snapshot(self, queue_depth):
+        now = time.time()
+        uptime = now - self.start_time
+        latencies = [latency for _, latency in self.recent_requests]
+        num_recent = len([t for t, _ in self.recent_requests if now - t <= self.window_seconds])
+
+        return {
+            'uptime_seconds': uptime,
+            'queue_depth': queue_depth,
+            'num_requests': self.num_requests,
+            'num_batches': self.num_batches,
+            'num_errors': self.num_errors,
+            'num_rejected': self.num_rejected,
+            'throughput_total': self.num_requests / uptime if uptime > 0 else 0.0,
+            # docs/sec in the last window_seconds (only the requests kept in the window are counted)
+            'throughput_recent': num_recent / min(self.window_seconds, uptime) if uptime > 0 else 0.0,
+            'latency_ms_p50': float(np.percentile(latencies, 50)) if len(latencies) > 0 else 0.0,
+            'latency_ms_p99': float(np.percentile(latencies, 99)) if len(latencies) > 0 else 0.0,
+            'batch_size_avg': float(np.mean(self.recent_batch_sizes)) if len(self.recent_batch_sizes) > 0 else 0.0,
+        }
+
+
+class MicroBatcher(object):
+    def __init__(self, extractor, max_batch_size=16, max_wait_ms=10.0, max_queue_size=1024, loop=None):
+        '''
+        :param extractor:      a KeyphraseExtractor
+        :param max_batch_size: maximum number of documents decoded in one beam search
+        :param max_wait_ms:    maximum time to wait for more documents after the first one of a batch arrives
+        :param max_queue_size: requests are rejected if there are more pending ones
+        '''
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        # the model reuses its decoding buffers, thus only one batch is decoded at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.metrics = ServerMetrics()
+
+    async def submit(self, text, top_k):
+        '''
+        Enqueue one document and wait for its keyphrases, raise asyncio.QueueFull if too many requests are pending
+        '''
+        future = self.loop.create_future()
+        try:
+            self.queue.put_nowait((text, top_k, future, time.time()))
+        except asyncio.QueueFull:
+            self.metrics.num_rejected += 1
+            raise
+        return await future
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # take the pending ones without waiting
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            texts = [text for text, _, _, _ in batch]
+            try:
+                # top_k=0 returns all and each request is truncated to its own top_k
+                results = await self.loop.run_in_executor(self.executor, self.extractor.extract, texts, 0)
+            except Exception as e:
+                logger.error(e, exc_info=True)
+                self.metrics.num_errors += len(batch)
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            finish_time = time.time()
+            for (_, top_k, future, start_time), keyphrases in zip(batch, results):
+                if not future.done():
+                    future.set_result(keyphrases[:top_k] if top_k > 0 else keyphrases)
+            self.metrics.record_batch([(finish_time - start_time) * 1000 for _, _, _, start_time in batch])
+
+
+class KeyphraseServer(object):
+    def __init__(self, batcher, text_fields=('title', 'abstract'), default_top_k=10):
+        self.batcher = batcher
+        self.text_fields = text_fields
+        self.default_top_k = default_top_k
+
+    async def handle_extract(self, body):
+        request = json.loads(body.decode('utf-8'))
+        # {"text": ...} is a raw text, otherwise the same documents as extract.py
+        if isinstance(request, dict) and 'text' in request:
+            text = request['text']
+            if not isinstance(text, str):
+                raise ValueError('expect the text to be a string, got %s' % type(text).__name__)
+        else:
+            text = document_text(request, self.text_fields)
+        top_k = request.get('top_k', self.default_top_k) if isinstance(request, dict) else self.default_top_k
+
+        keyphrases = await self.batcher.submit(text, int(top_k))
+        return 200, {'keyphrases': keyphrases}
+
+    async def route(self, method, path, body):
+        if path == '/extract':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            try:
+                return await self.handle_extract(body)
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, {'error': 'invalid request: %s' % str(e)}
+            except asyncio.QueueFull:
+                return 503, {'error': 'too many pending requests'}
+        elif path == '/metrics':
+            metrics = self.batcher.metrics.snapshot(self.batcher.queue.qsize())
+            if self.batcher.extractor.cache is not None:
+                metrics['cache'] = self.batcher.extractor.cache.stats()
+            return 200, metrics
+        else:
+            return 404, {'error': 'unknown path %s' % path}
+
+    async def handle_connection(self, reader, writer):
+        '''
+        A minimal HTTP/1.1 handler, the connection is kept alive unless the client asks to close it
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, value = line.decode('latin-1').split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                try:
+                    status, response = await self.route(method, path.split('?')[0], body)
+                except Exception as e:
+                    logger.error(e, exc_info=True)
+                    status, response = 500, {'error': str(e)}
+
+                response = json.dumps(response).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                              % (status, HTTP_STATUS[status], len(response), 'keep-alive' if keep_alive else 'close')).encode('latin-1') + response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.warning('Dropped a connection: %s' % str(e))
+        finally:
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='serve.py', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-model', required=True, help='Path to the model checkpoint (*.model or *.int8.model)')
+    parser.add_argument('-vocab', required=True, help='Path to the vocab.pt generated by preprocess.py')
+    parser.add_argument('-config', default=None, help='Path to the *.initial.config of the experiment, found in the folder of -model by default')
+    parser.add_argument('-host', type=str, default='127.0.0.1')
+    parser.add_argument('-port', type=int, default=8000)
+    parser.add_argument('-max_batch_size', type=int, default=16, help='Maximum number of documents decoded in one beam search')
+    parser.add_argument('-max_wait_ms', type=float, default=10.0, help='Maximum time to wait for more documents after the first one of a batch arrives')
+    parser.add_argument('-max_queue_size', type=int, default=1024, help='Reject the requests (503) if there are more pending ones')
+    parser.add_argument('-text_fields', type=str, nargs='+', default=['title', 'abstract'],
+                        help='Fields of a JSON request to concatenate as the source text, if "text" is not given')
+    parser.add_argument('-top_k', type=int, default=10, help='Default maximum number of keyphrases per document, 0 returns all')
+    parser.add_argument('-beam_size', type=int, default=None, help='Overrides the beam size of the config')
+    parser.add_argument('-max_sent_length', type=int, default=None, help='Overrides the maximum keyphrase length of the config')
+    parser.add_argument('-max_src_length', type=int, default=None, help='Truncate the source text to the first N tokens')
+    parser.add_argument('-include_absent', action='store_true', help='Also return the keyphrases that do not appear in the source text')
+    parser.add_argument('-torchscript', action='store_true', help='Decode with the TorchScript modules')
+    parser.add_argument('-cache_size', type=int, default=10000, help='Number of predictions cached in memory, 0 disables the memory cache')
+    parser.add_argument('-cache_path', type=str, default=None, help='Path of the sqlite file to persist the cached predictions')
+    parser.add_argument('-cache_disk_size', type=int, default=1000000, help='Maximum number of predictions cached on disk')
+    opt = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(module)s: %(message)s')
+
+    cache = None
+    if opt.cache_size > 0 or opt.cache_path:
+        cache = PredictionCache(memory_size=opt.cache_size, disk_path=opt.cache_path, disk_size=opt.cache_disk_size)
+    extractor = KeyphraseExtractor(opt.model, opt.vocab, config_path=opt.config,
+                                   beam_size=opt.beam_size, max_sent_length=opt.max_sent_length,
+                                   batch_size=opt.max_batch_size, max_src_length=opt.max_src_length,
+                                   must_appear_in_src=not opt.include_absent, torchscript=opt.torchscript, cache=cache)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    batcher = MicroBatcher(extractor, max_batch_size=opt.max_batch_size, max_wait_ms=opt.max_wait_ms,
+                           max_queue_size=opt.max_queue_size, loop=loop)
+    server = KeyphraseServer(batcher, text_fields=opt.text_fields, default_top_k=opt.top_k)
+
+    loop.create_task(batcher.run())
+    http_server = loop.run_until_complete(asyncio.start_server(server.handle_connection, opt.host, opt.port))
+    logger.info('Serving on http://%s:%d (max_batch_size=%d, max_wait_ms=%.1f)' % (opt.host, opt.port, opt.max_batch_size, opt.max_wait_ms))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.close()
+        loop.run_until_complete(http_server.wait_closed())
+        batcher.executor.shutdown(wait=True)
+        if cache is not None:
+            cache.close()
+        loop.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,11 @@
 """
 Python File Template 
 """
+import collections
 import json
 import os
+import queue
+import traceback
 
 import logging
 import numpy as np
@@ -20,8 +23,10 @@ from utils import Progbar, plot_learning_curve_and_write_csv
 
 from config import init_logging, init_opt
 import pykp
-from pykp.io import KeyphraseDataset
-from pykp.model import Seq2SeqLSTMAttention, Seq2SeqLSTMAttentionCascading
+from pykp.io import KeyphraseDataset, load_examples
+from pykp.vocab import load_vocab
+from pykp.model import Seq2SeqLSTMAttention, Seq2SeqLSTMAttentionCascading, quantize_model
+from pykp.memory_profiler import MemoryProfiler
 
 import time
 
@@ -94,10 +99,48 @@ def _valid_error(data_loader, model, criterion, epoch, opt):
     return losses
 
 
+def sample_softmax_candidates(src, trg_target, opt):
+    '''
+    Build the candidate words of sampled softmax, shared by all the examples in a batch:
+        special tokens + target words + source words (so that copying still works) + negative samples.
+    Negatives are drawn from the log-uniform distribution P(k) = log((k+2)/(k+1)) / log(V+1), as the vocab is sorted by frequency.
+    The logit of a sampled negative has to be corrected by log Q(w), Q(w) = 1 - (1 - P(w))^num_negative_samples is the probability
+        that w is drawn at least once, otherwise the softmax over the candidates is biased by the proposal.
+        Q(w) = 1 for the special, target and source words, which are always in the set.
+    :param src: (batch_size, src_len) source text, oov words have been replaced with <unk>
+    :param trg_target: (batch_size, trg_len) target text, oov words have been replaced with <unk>
+    :return: LongTensor (num_candidates), sorted unique word indexes. <pad>=0 is always the first candidate thus ignore_index of criterion still holds
+             FloatTensor (num_candidates), log Q(w) of each candidate
+    '''
+    special_ids = [opt.word2id[w] for w in [pykp.io.PAD_WORD, pykp.io.BOS_WORD, pykp.io.EOS_WORD, pykp.io.UNK_WORD, pykp.io.SEP_WORD]]
+    negative_ids = np.floor(np.exp(np.random.uniform(0.0, np.log(opt.vocab_size + 1), size=opt.num_negative_samples))) - 1
+    negative_ids = np.clip(negative_ids, 0, opt.vocab_size - 1).astype(np.int64)
+
+    always_ids = np.unique(np.concatenate([np.asarray(special_ids, dtype=np.int64),
+                                           trg_target.data.cpu().numpy().reshape(-1),
+                                           src.data.cpu().numpy().reshape(-1)]))
+    candidate_ids = np.union1d(always_ids, negative_ids)
+    assert candidate_ids[0] == opt.word2id[pykp.io.PAD_WORD]
+
+    # log Q(w) = log(1 - (1 - P(w))^n), computed with log1p/expm1 as P(w) is tiny for the rare words
+    sample_probs = np.log((candidate_ids + 2.0) / (candidate_ids + 1.0)) / np.log(opt.vocab_size + 1.0)
+    candidate_log_q = np.log(-np.expm1(opt.num_negative_samples * np.log1p(-sample_probs)))
+    candidate_log_q[np.isin(candidate_ids, always_ids)] = 0.0
+
+    return torch.from_numpy(candidate_ids), torch.from_numpy(candidate_log_q.astype(np.float32))
+
+
 def train_ml(one2one_batch, model, optimizer, criterion, opt):
     src, src_len, trg, trg_target, trg_copy_target, src_oov, oov_lists = one2one_batch
     max_oov_number = max([len(oov) for oov in oov_lists])
 
+    candidate_ids, candidate_log_q = None, None
+    if opt.sampled_softmax:
+        candidate_ids, candidate_log_q = sample_softmax_candidates(src, trg_target, opt)
+        if torch.cuda.is_available():
+            candidate_ids = candidate_ids.cuda()
+            candidate_log_q = candidate_log_q.cuda()
+
     print("src size - ", src.size())
     print("target size - ", trg.size())
 
@@ -110,8 +153,15 @@ def train_ml(one2one_batch, model, optimizer, criterion, opt):
 
     optimizer.zero_grad()
 
-    decoder_log_probs, _, _ = model.forward(src, src_len, trg, src_oov, oov_lists)
+    decoder_log_probs, _, _ = model.forward(src, src_len, trg, src_oov, oov_lists, candidate_ids=candidate_ids, candidate_log_q=candidate_log_q)
 
+    # with sampled softmax the targets are the positions in the candidate set
+    if candidate_ids is not None:
+        output_size = candidate_ids.size(0)
+        trg_target = model.map_to_candidates(trg_target, candidate_ids)
+        trg_copy_target = model.map_to_candidates(trg_copy_target, candidate_ids)
+    else:
+        output_size = opt.vocab_size
 
     # simply average losses of all the predicitons
     # IMPORTANT, must use logits instead of probs to compute the loss, otherwise it's super super slow at the beginning (grads of probs are small)!
@@ -119,12 +169,12 @@ def train_ml(one2one_batch, model, optimizer, criterion, opt):
 
     if not opt.copy_attention:
         loss = criterion(
-            decoder_log_probs.contiguous().view(-1, opt.vocab_size),
+            decoder_log_probs.contiguous().view(-1, output_size),
             trg_target.contiguous().view(-1)
         )
     else:
         loss = criterion(
-            decoder_log_probs.contiguous().view(-1, opt.vocab_size + max_oov_number),
+            decoder_log_probs.contiguous().view(-1, output_size + max_oov_number),
             trg_copy_target.contiguous().view(-1)
         )
     if opt.train_rl:
@@ -147,7 +197,7 @@ def train_ml(one2one_batch, model, optimizer, criterion, opt):
     else:
         loss_value = loss.data.numpy()
 
-    return loss_value, decoder_log_probs
+    return loss_value, decoder_log_probs, candidate_ids
 
 
 def train_rl_0(one2many_batch, model, optimizer, generator, opt):
@@ -347,7 +397,7 @@ def train_rl(one2many_batch, model, optimizer, generator, opt, reward_cache):
         return train_rl_2(one2many_batch, model, optimizer, generator, opt, reward_cache)
 
 
-def brief_report(epoch, batch_i, one2one_batch, loss_ml, decoder_log_probs, opt):
+def brief_report(epoch, batch_i, one2one_batch, loss_ml, decoder_log_probs, opt, candidate_ids=None):
     logging.info('======================  %d  =========================' % (batch_i))
 
     logging.info('Epoch : %d Minibatch : %d, Loss=%.5f' % (epoch, batch_i, np.mean(loss_ml)))
@@ -368,10 +418,19 @@ def brief_report(epoch, batch_i, one2one_batch, loss_ml, decoder_log_probs, opt)
         trg_target = trg_target.data.numpy()
         trg_copy_target = trg_copy_target.data.numpy()
 
+    # nll is computed with the output positions, which are different from word indexes with sampled softmax
+    max_positions_pred = max_words_pred
+    if candidate_ids is not None:
+        candidate_ids = candidate_ids.cpu().numpy()
+        max_words_pred = np.where(max_positions_pred < len(candidate_ids),
+                                  candidate_ids[np.minimum(max_positions_pred, len(candidate_ids) - 1)],
+                                  max_positions_pred - len(candidate_ids) + opt.vocab_size)
+
     sampled_trg_idx = np.random.random_integers(low=0, high=len(trg) - 1, size=sampled_size)
     src = src[sampled_trg_idx]
     oov_lists = [oov_lists[i] for i in sampled_trg_idx]
     max_words_pred = [max_words_pred[i] for i in sampled_trg_idx]
+    max_positions_pred = [max_positions_pred[i] for i in sampled_trg_idx]
     decoder_log_probs = decoder_log_probs[sampled_trg_idx]
     if not opt.copy_attention:
         trg_target = [trg_target[i] for i in
@@ -379,9 +438,9 @@ def brief_report(epoch, batch_i, one2one_batch, loss_ml, decoder_log_probs, opt)
     else:
         trg_target = [trg_copy_target[i] for i in sampled_trg_idx]
 
-    for i, (src_wi, pred_wi, trg_i, oov_i) in enumerate(
-            zip(src, max_words_pred, trg_target, oov_lists)):
-        nll_prob = -np.sum([decoder_log_probs[i][l][pred_wi[l]] for l in range(len(trg_i))])
+    for i, (src_wi, pred_wi, pred_pi, trg_i, oov_i) in enumerate(
+            zip(src, max_words_pred, max_positions_pred, trg_target, oov_lists)):
+        nll_prob = -np.sum([decoder_log_probs[i][l][pred_pi[l]] for l in range(len(trg_i))])
         find_copy = np.any([x >= opt.vocab_size for x in src_wi])
         has_copy = np.any([x >= opt.vocab_size for x in trg_i])
 
@@ -407,7 +466,127 @@ def brief_report(epoch, batch_i, one2one_batch, loss_ml, decoder_log_probs, opt)
             ' [HAS COPY]' + str(trg_i) if has_copy else ''))
 
 
-def train_model(model, optimizer_ml, optimizer_rl, criterion, train_data_loader, valid_data_loader, test_data_loader, opt):
+def _async_valid_worker(opt, valid_dataset, test_dataset, task_queue, result_queue):
+    '''
+    Entry of the background validation process. Rebuild the model once, then for every snapshot in task_queue
+        load the weights and run beam search on the valid and test sets.
+    The worker is a daemon process thus it cannot fork DataLoader workers, batches are generated in-process.
+    '''
+    torch.set_num_threads(opt.async_valid_threads)
+
+    pin_memory = torch.cuda.is_available()
+    valid_data_loader = KeyphraseDataLoader(dataset=valid_dataset,
+                                            collate_fn=valid_dataset.collate_fn_one2many,
+                                            num_workers=0,
+                                            max_batch_example=opt.beam_search_batch_example,
+                                            max_batch_pair=opt.beam_search_batch_size,
+                                            pin_memory=pin_memory,
+                                            shuffle=False)
+    test_data_loader = KeyphraseDataLoader(dataset=test_dataset,
+                                           collate_fn=test_dataset.collate_fn_one2many,
+                                           num_workers=0,
+                                           max_batch_example=opt.beam_search_batch_example,
+                                           max_batch_pair=opt.beam_search_batch_size,
+                                           pin_memory=pin_memory,
+                                           shuffle=False)
+
+    if opt.cascading_model:
+        model = Seq2SeqLSTMAttentionCascading(opt)
+    else:
+        model = Seq2SeqLSTMAttention(opt)
+    if torch.cuda.is_available():
+        model = model.cuda()
+
+    generator = SequenceGenerator(model,
+                                  eos_id=opt.word2id[pykp.io.EOS_WORD],
+                                  beam_size=opt.beam_size,
+                                  max_sequence_length=opt.max_sent_length
+                                  )
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        epoch, batch_i, total_batch, state_dict = task
+        try:
+            model.load_state_dict(state_dict)
+            valid_score_dict = evaluate_beam_search(generator, valid_data_loader, opt, title='Validating, epoch=%d, batch=%d, total_batch=%d' % (epoch, batch_i, total_batch), epoch=epoch, predict_save_path=opt.pred_path + '/epoch%d_batch%d_total_batch%d' % (epoch, batch_i, total_batch))
+            test_score_dict = evaluate_beam_search(generator, test_data_loader, opt, title='Testing, epoch=%d, batch=%d, total_batch=%d' % (epoch, batch_i, total_batch), epoch=epoch, predict_save_path=opt.pred_path + '/epoch%d_batch%d_total_batch%d' % (epoch, batch_i, total_batch))
+            result_queue.put((total_batch, valid_score_dict, test_score_dict, None))
+        except Exception:
+            result_queue.put((total_batch, None, None, traceback.format_exc()))
+
+
+class AsyncValidator(object):
+    '''
+    Validate weight snapshots in a separate process so that training does not stall during beam search.
+    A snapshot is kept in memory until its scores come back, so the checkpoint saved for it is exactly the weights that were evaluated.
+    At most `max_pending` snapshots can be waiting or under evaluation, further submissions are skipped until one finishes.
+    '''
+
+    def __init__(self, opt, valid_dataset, test_dataset, max_pending=2):
+        ctx = torch.multiprocessing.get_context('spawn')
+        self.task_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.max_pending = max(1, max_pending)
+        # total_batch -> (epoch, batch_i, state_dict, ml_losses, rl_losses)
+        self.pending = collections.OrderedDict()
+
+        self.process = ctx.Process(target=_async_valid_worker,
+                                   args=(opt, valid_dataset, test_dataset, self.task_queue, self.result_queue))
+        self.process.daemon = True
+        self.process.start()
+        logging.info('Started background validation process (pid=%d, threads=%d, max pending snapshots=%d)' % (self.process.pid, opt.async_valid_threads, self.max_pending))
+
+    def is_full(self):
+        return len(self.pending) >= self.max_pending
+
+    def submit(self, epoch, batch_i, total_batch, model, ml_losses, rl_losses):
+        '''
+        Copy the current weights to cpu and hand them over to the validation process
+        '''
+        state_dict = collections.OrderedDict((k, v.detach().cpu().clone()) for k, v in model.state_dict().items())
+        self.pending[total_batch] = (epoch, batch_i, state_dict, ml_losses, rl_losses)
+        self.task_queue.put((epoch, batch_i, total_batch, state_dict))
+
+    def poll(self, block=False):
+        '''
+        Collect the finished validations
+        :param block: wait until every pending snapshot is evaluated
+        :return: list of (epoch, batch_i, total_batch, valid_score_dict, test_score_dict, ml_losses, rl_losses, state_dict)
+        '''
+        results = []
+        while len(self.pending) > 0:
+            try:
+                total_batch, valid_score_dict, test_score_dict, error = self.result_queue.get(block=block, timeout=10 if block else None)
+            except queue.Empty:
+                if block and self.process.is_alive():
+                    continue
+                if block:
+                    raise RuntimeError('Background validation process exited unexpectedly (exitcode=%s)' % str(self.process.exitcode))
+                break
+
+            epoch, batch_i, state_dict, ml_losses, rl_losses = self.pending.pop(total_batch)
+            if error is not None:
+                raise RuntimeError('Background validation failed @total_batch=%d:\n%s' % (total_batch, error))
+            results.append((epoch, batch_i, total_batch, valid_score_dict, test_score_dict, ml_losses, rl_losses, state_dict))
+
+        return results
+
+    def close(self):
+        '''
+        Wait for the pending snapshots and shut down the validation process
+        '''
+        results = self.poll(block=True)
+        self.task_queue.put(None)
+        self.process.join()
+        return results
+
+
+def train_model(model, optimizer_ml, optimizer_rl, criterion, train_data_loader, valid_data_loader, test_data_loader, opt, memory_profiler=None):
+    if memory_profiler is None:
+        memory_profiler = MemoryProfiler(None, enabled=False)
     generator = SequenceGenerator(model,
                                   eos_id=opt.word2id[pykp.io.EOS_WORD],
                                   beam_size=opt.beam_size,
@@ -450,6 +629,90 @@ def train_model(model, optimizer_ml, optimizer_rl, criterion, train_data_loader,
              test_history_losses) = torch.load(open(state_path, 'rb'))
             opt.start_epoch = epoch
 
+    def on_validation_done(epoch, batch_i, total_batch, valid_score_dict, test_score_dict, ml_losses, rl_losses, state_dict):
+        '''
+        Book-keeping after validating the weights of total_batch: plot the curves, update the early-stopping state and save the checkpoint
+        :param ml_losses/rl_losses: training losses accumulated since the previous validation
+        :param state_dict: the weights that were validated (may be older than the current model if validation ran in background)
+        :return: whether to stop training early
+        '''
+        nonlocal best_loss, stop_increasing
+
+        checkpoint_names.append('epoch=%d-batch=%d-total_batch=%d' % (epoch, batch_i, total_batch))
+
+        curve_names = []
+        scores = []
+        if opt.train_ml:
+            train_ml_history_losses.append(ml_losses)
+            scores += [train_ml_history_losses]
+            curve_names += ['Training ML Error']
+
+        if opt.train_rl:
+            train_rl_history_losses.append(rl_losses)
+            scores += [train_rl_history_losses]
+            curve_names += ['Training RL Reward']
+
+        valid_history_losses.append(valid_score_dict)
+        test_history_losses.append(test_score_dict)
+
+        scores += [[result_dict[name] for result_dict in valid_history_losses] for name in opt.report_score_names]
+        curve_names += ['Valid-' + name for name in opt.report_score_names]
+        scores += [[result_dict[name] for result_dict in test_history_losses] for name in opt.report_score_names]
+        curve_names += ['Test-' + name for name in opt.report_score_names]
+
+        scores = [np.asarray(s) for s in scores]
+        # Plot the learning curve
+        plot_learning_curve_and_write_csv(scores=scores,
+                                          curve_names=curve_names,
+                                          checkpoint_names=checkpoint_names,
+                                          title='Training Validation & Test',
+                                          save_path=opt.exp_path + '/[epoch=%d,batch=%d,total_batch=%d]train_valid_test_curve.png' % (epoch, batch_i, total_batch))
+
+        '''
+        determine if early stop training (whether f-score increased, before is if valid error decreased)
+        '''
+        valid_loss = np.average(valid_history_losses[-1][opt.report_score_names[0]])
+        is_best_loss = valid_loss > best_loss
+        rate_of_change = float(valid_loss - best_loss) / float(best_loss) if float(best_loss) > 0 else 0.0
+
+        # valid error doesn't increase
+        if rate_of_change <= 0:
+            stop_increasing += 1
+        else:
+            stop_increasing = 0
+
+        if is_best_loss:
+            logging.info('Validation: update best loss (%.4f --> %.4f), rate of change (ROC)=%.2f' % (
+                best_loss, valid_loss, rate_of_change * 100))
+        else:
+            logging.info('Validation: best loss is not updated for %d times (%.4f --> %.4f), rate of change (ROC)=%.2f' % (
+                stop_increasing, best_loss, valid_loss, rate_of_change * 100))
+
+        best_loss = max(valid_loss, best_loss)
+
+        # only store the checkpoints that make better validation performances
+        if total_batch > 1 and (total_batch % opt.save_model_every == 0 or is_best_loss):  # epoch >= opt.start_checkpoint_at and
+            # Save the checkpoint
+            logging.info('Saving checkpoint to: %s' % os.path.join(opt.model_path, '%s.epoch=%d.batch=%d.total_batch=%d.error=%f' % (opt.exp, epoch, batch_i, total_batch, valid_loss) + '.model'))
+            torch.save(
+                state_dict,
+                open(os.path.join(opt.model_path, '%s.epoch=%d.batch=%d.total_batch=%d' % (opt.exp, epoch, batch_i, total_batch) + '.model'), 'wb')
+            )
+            torch.save(
+                (epoch, total_batch, best_loss, stop_increasing, checkpoint_names, train_ml_history_losses, train_rl_history_losses, valid_history_losses, test_history_losses),
+                open(os.path.join(opt.model_path, '%s.epoch=%d.batch=%d.total_batch=%d' % (opt.exp, epoch, batch_i, total_batch) + '.state'), 'wb')
+            )
+
+        logging.info('*' * 50)
+        if stop_increasing >= opt.early_stop_tolerance:
+            logging.info('Have not increased for %d epoches, early stop training' % stop_increasing)
+            return True
+        return False
+
+    async_validator = None
+    if opt.async_valid:
+        async_validator = AsyncValidator(opt, valid_data_loader.dataset, test_data_loader.dataset, max_pending=opt.async_valid_queue_size)
+
     for epoch in range(opt.start_epoch, opt.epochs):
         if early_stop_flag:
             break
@@ -465,14 +728,15 @@ def train_model(model, optimizer_ml, optimizer_rl, criterion, train_data_loader,
 
             # Training
             if opt.train_ml:
-                loss_ml, decoder_log_probs = train_ml(one2one_batch, model, optimizer_ml, criterion, opt)
+                with memory_profiler.step(one2one_batch[0], one2one_batch[2]):
+                    loss_ml, decoder_log_probs, candidate_ids = train_ml(one2one_batch, model, optimizer_ml, criterion, opt)
                 train_ml_losses.append(loss_ml)
                 report_loss.append(('train_ml_loss', loss_ml))
                 report_loss.append(('PPL', loss_ml))
 
                 # Brief report
                 if batch_i % opt.report_every == 0:
-                    brief_report(epoch, batch_i, one2one_batch, loss_ml, decoder_log_probs, opt)
+                    brief_report(epoch, batch_i, one2one_batch, loss_ml, decoder_log_probs, opt, candidate_ids=candidate_ids)
 
             # do not apply rl in 0th epoch, need to get a resonable model before that.
             if opt.train_rl:
@@ -488,91 +752,49 @@ def train_model(model, optimizer_ml, optimizer_rl, criterion, train_data_loader,
             # Validate and save checkpoint
             if (opt.run_valid_every == -1 and batch_i == len(train_data_loader) - 1) or\
                (opt.run_valid_every > -1 and total_batch > 1 and total_batch % opt.run_valid_every == 0):
-                logging.info('*' * 50)
-                logging.info('Run validing and testing @Epoch=%d,#(Total batch)=%d' % (epoch, total_batch))
-                # valid_losses    = _valid_error(valid_data_loader, model, criterion, epoch, opt)
-                # valid_history_losses.append(valid_losses)
-                valid_score_dict = evaluate_beam_search(generator, valid_data_loader, opt, title='Validating, epoch=%d, batch=%d, total_batch=%d' % (epoch, batch_i, total_batch), epoch=epoch, predict_save_path=opt.pred_path + '/epoch%d_batch%d_total_batch%d' % (epoch, batch_i, total_batch))
-                test_score_dict = evaluate_beam_search(generator, test_data_loader, opt, title='Testing, epoch=%d, batch=%d, total_batch=%d' % (epoch, batch_i, total_batch), epoch=epoch, predict_save_path=opt.pred_path + '/epoch%d_batch%d_total_batch%d' % (epoch, batch_i, total_batch))
-
-                checkpoint_names.append('epoch=%d-batch=%d-total_batch=%d' % (epoch, batch_i, total_batch))
-
-                curve_names = []
-                scores = []
-                if opt.train_ml:
-                    train_ml_history_losses.append(copy.copy(train_ml_losses))
-                    scores += [train_ml_history_losses]
-                    curve_names += ['Training ML Error']
+                if async_validator is not None:
+                    if async_validator.is_full():
+                        logging.warning('Background validation is busy (%d snapshots pending), skip validating @Epoch=%d,#(Total batch)=%d' % (len(async_validator.pending), epoch, total_batch))
+                    else:
+                        logging.info('Submit weight snapshot for background validation @Epoch=%d,#(Total batch)=%d' % (epoch, total_batch))
+                        async_validator.submit(epoch, batch_i, total_batch, model, copy.copy(train_ml_losses), copy.copy(train_rl_losses))
+                        train_ml_losses = []
+                        train_rl_losses = []
+                else:
+                    logging.info('*' * 50)
+                    logging.info('Run validing and testing @Epoch=%d,#(Total batch)=%d' % (epoch, total_batch))
+                    # valid_losses    = _valid_error(valid_data_loader, model, criterion, epoch, opt)
+                    # valid_history_losses.append(valid_losses)
+                    valid_score_dict = evaluate_beam_search(generator, valid_data_loader, opt, title='Validating, epoch=%d, batch=%d, total_batch=%d' % (epoch, batch_i, total_batch), epoch=epoch, predict_save_path=opt.pred_path + '/epoch%d_batch%d_total_batch%d' % (epoch, batch_i, total_batch))
+                    test_score_dict = evaluate_beam_search(generator, test_data_loader, opt, title='Testing, epoch=%d, batch=%d, total_batch=%d' % (epoch, batch_i, total_batch), epoch=epoch, predict_save_path=opt.pred_path + '/epoch%d_batch%d_total_batch%d' % (epoch, batch_i, total_batch))
+
+                    early_stop_flag = on_validation_done(epoch, batch_i, total_batch, valid_score_dict, test_score_dict,
+                                                         copy.copy(train_ml_losses), copy.copy(train_rl_losses), model.state_dict())
                     train_ml_losses = []
-
-                if opt.train_rl:
-                    train_rl_history_losses.append(copy.copy(train_rl_losses))
-                    scores += [train_rl_history_losses]
-                    curve_names += ['Training RL Reward']
                     train_rl_losses = []
 
-                valid_history_losses.append(valid_score_dict)
-                test_history_losses.append(test_score_dict)
-
-                scores += [[result_dict[name] for result_dict in valid_history_losses] for name in opt.report_score_names]
-                curve_names += ['Valid-' + name for name in opt.report_score_names]
-                scores += [[result_dict[name] for result_dict in test_history_losses] for name in opt.report_score_names]
-                curve_names += ['Test-' + name for name in opt.report_score_names]
-
-                scores = [np.asarray(s) for s in scores]
-                # Plot the learning curve
-                plot_learning_curve_and_write_csv(scores=scores,
-                                                  curve_names=curve_names,
-                                                  checkpoint_names=checkpoint_names,
-                                                  title='Training Validation & Test',
-                                                  save_path=opt.exp_path + '/[epoch=%d,batch=%d,total_batch=%d]train_valid_test_curve.png' % (epoch, batch_i, total_batch))
-
-                '''
-                determine if early stop training (whether f-score increased, before is if valid error decreased)
-                '''
-                valid_loss = np.average(valid_history_losses[-1][opt.report_score_names[0]])
-                is_best_loss = valid_loss > best_loss
-                rate_of_change = float(valid_loss - best_loss) / float(best_loss) if float(best_loss) > 0 else 0.0
-
-                # valid error doesn't increase
-                if rate_of_change <= 0:
-                    stop_increasing += 1
-                else:
-                    stop_increasing = 0
+            # feed the finished background validations back to early-stopping
+            if async_validator is not None:
+                for result in async_validator.poll():
+                    logging.info('*' * 50)
+                    logging.info('Background validation finished @Epoch=%d,#(Total batch)=%d (current total batch=%d)' % (result[0], result[2], total_batch))
+                    early_stop_flag = on_validation_done(*result) or early_stop_flag
 
-                if is_best_loss:
-                    logging.info('Validation: update best loss (%.4f --> %.4f), rate of change (ROC)=%.2f' % (
-                        best_loss, valid_loss, rate_of_change * 100))
-                else:
-                    logging.info('Validation: best loss is not updated for %d times (%.4f --> %.4f), rate of change (ROC)=%.2f' % (
-                        stop_increasing, best_loss, valid_loss, rate_of_change * 100))
-
-                best_loss = max(valid_loss, best_loss)
-
-                # only store the checkpoints that make better validation performances
-                if total_batch > 1 and (total_batch % opt.save_model_every == 0 or is_best_loss):  # epoch >= opt.start_checkpoint_at and
-                    # Save the checkpoint
-                    logging.info('Saving checkpoint to: %s' % os.path.join(opt.model_path, '%s.epoch=%d.batch=%d.total_batch=%d.error=%f' % (opt.exp, epoch, batch_i, total_batch, valid_loss) + '.model'))
-                    torch.save(
-                        model.state_dict(),
-                        open(os.path.join(opt.model_path, '%s.epoch=%d.batch=%d.total_batch=%d' % (opt.exp, epoch, batch_i, total_batch) + '.model'), 'wb')
-                    )
-                    torch.save(
-                        (epoch, total_batch, best_loss, stop_increasing, checkpoint_names, train_ml_history_losses, train_rl_history_losses, valid_history_losses, test_history_losses),
-                        open(os.path.join(opt.model_path, '%s.epoch=%d.batch=%d.total_batch=%d' % (opt.exp, epoch, batch_i, total_batch) + '.state'), 'wb')
-                    )
-
-                if stop_increasing >= opt.early_stop_tolerance:
-                    logging.info('Have not increased for %d epoches, early stop training' % stop_increasing)
-                    early_stop_flag = True
-                    break
-                logging.info('*' * 50)
+            if early_stop_flag:
+                break
+
+    if async_validator is not None:
+        logging.info('Waiting for %d pending background validations' % len(async_validator.pending))
+        for result in async_validator.close():
+            logging.info('*' * 50)
+            logging.info('Background validation finished @Epoch=%d,#(Total batch)=%d' % (result[0], result[2]))
+            on_validation_done(*result)
 
 
 def load_data_vocab(opt, load_train=True):
 
     logging.info("Loading vocab from disk: %s" % (opt.vocab))
-    word2id, id2word, vocab = torch.load(opt.vocab, 'rb')
+    word2id, id2word, vocab = load_vocab(opt.vocab)
     pin_memory = torch.cuda.is_available()
 
     # one2one data loader
@@ -581,7 +803,10 @@ def load_data_vocab(opt, load_train=True):
     logging.info('======================  Dataset  =========================')
     # one2many data loader
     if load_train:
-        train_one2many = torch.load(opt.data + '.train.one2many.pt', 'rb')
+        train_one2many = load_examples(opt.data, 'train', mode='one2many')
+        if opt.max_train_examples > 0:
+            logging.info('Only use the first %d training examples' % opt.max_train_examples)
+            train_one2many = train_one2many[:opt.max_train_examples]
         train_one2many_dataset = KeyphraseDataset(train_one2many, word2id=word2id, id2word=id2word, type='one2many')
         train_one2many_loader = KeyphraseDataLoader(dataset=train_one2many_dataset,
                                                     collate_fn=train_one2many_dataset.collate_fn_one2many,
@@ -595,8 +820,8 @@ def load_data_vocab(opt, load_train=True):
     else:
         train_one2many_loader = None
 
-    valid_one2many = torch.load(opt.data + '.valid.one2many.pt', 'rb')
-    test_one2many = torch.load(opt.data + '.test.one2many.pt', 'rb')
+    valid_one2many = load_examples(opt.data, 'valid', mode='one2many')
+    test_one2many = load_examples(opt.data, 'test', mode='one2many')
 
     # !important. As it takes too long to do beam search, thus reduce the size of validation and test datasets
     valid_one2many = valid_one2many[:2000]
@@ -632,12 +857,14 @@ def load_data_vocab(opt, load_train=True):
 
     opt.word2id = word2id
     opt.id2word = id2word
-    opt.vocab = vocab
+    # the binary vocab has no word frequencies, keep opt.vocab as its path then
+    if vocab is not None:
+        opt.vocab = vocab
 
     logging.info('#(valid data size: #(one2many pair)=%d, #(one2one pair)=%d, #(batch)=%d' % (len(valid_one2many_loader.dataset), valid_one2many_loader.one2one_number(), len(valid_one2many_loader)))
     logging.info('#(test data size:  #(one2many pair)=%d, #(one2one pair)=%d, #(batch)=%d' % (len(test_one2many_loader.dataset), test_one2many_loader.one2one_number(), len(test_one2many_loader)))
 
-    logging.info('#(vocab)=%d' % len(vocab))
+    logging.info('#(vocab)=%d' % len(id2word))
     logging.info('#(vocab used)=%d' % opt.vocab_size)
 
     return train_one2many_loader, valid_one2many_loader, test_one2many_loader, word2id, id2word, vocab
@@ -680,6 +907,13 @@ def init_optimizer_criterion(model, opt):
     return optimizer_ml, optimizer_rl, criterion
 
 
+def init_quantized_model(model):
+    if torch.cuda.is_available():
+        raise ValueError('The int8 quantized model only runs on CPU, hide the GPUs with CUDA_VISIBLE_DEVICES="" to use it')
+    logging.info('Applying dynamic int8 quantization to the LSTM and Linear layers')
+    return quantize_model(model)
+
+
 def init_model(opt):
     logging.info('======================  Model Parameters  =========================')
 
@@ -700,15 +934,31 @@ def init_model(opt):
         #     open(os.path.join(opt.model_path, opt.exp + '.initial.model'), 'rb')
         # )
 
-        if torch.cuda.is_available():
-            checkpoint = torch.load(open(opt.train_from, 'rb'))
+        if opt.train_from.endswith('.int8.model'):
+            # a quantized checkpoint, build the quantized skeleton first then load the int8 weights.
+            # The packed int8 weights are not plain tensors, newer pytorch refuses to unpickle them unless weights_only=False
+            model = init_quantized_model(model)
+            try:
+                checkpoint = torch.load(open(opt.train_from, 'rb'), map_location=lambda storage, loc: storage, weights_only=False)
+            except TypeError:
+                checkpoint = torch.load(open(opt.train_from, 'rb'), map_location=lambda storage, loc: storage)
+            model.load_state_dict(checkpoint)
         else:
-            checkpoint = torch.load(
-                open(opt.train_from, 'rb'), map_location=lambda storage, loc: storage
-            )
-        # some compatible problems, keys are started with 'module.'
-        # checkpoint = dict([(k[7:], v) if k.startswith('module.') else (k, v) for k, v in checkpoint.items()])
-        model.load_state_dict(checkpoint)
+            if torch.cuda.is_available():
+                checkpoint = torch.load(open(opt.train_from, 'rb'))
+            else:
+                checkpoint = torch.load(
+                    open(opt.train_from, 'rb'), map_location=lambda storage, loc: storage
+                )
+            # some compatible problems, keys are started with 'module.'
+            # checkpoint = dict([(k[7:], v) if k.startswith('module.') else (k, v) for k, v in checkpoint.items()])
+            model.load_state_dict(checkpoint)
+
+            if opt.quantize:
+                model = init_quantized_model(model)
+                quantized_path = opt.train_from[: opt.train_from.rfind('.model')] + '.int8.model' if opt.train_from.endswith('.model') else opt.train_from + '.int8.model'
+                logging.info("saving int8 quantized model to %s" % quantized_path)
+                torch.save(model.state_dict(), open(quantized_path, 'wb'))
     else:
         # dump the meta-model
         torch.save(
@@ -740,10 +990,14 @@ def main():
         logging.info('Running on CPU!')
 
     try:
-        train_data_loader, valid_data_loader, test_data_loader, word2id, id2word, vocab = load_data_vocab(opt)
-        model = init_model(opt)
-        optimizer_ml, optimizer_rl, criterion = init_optimizer_criterion(model, opt)
-        train_model(model, optimizer_ml, optimizer_rl, criterion, train_data_loader, valid_data_loader, test_data_loader, opt)
+        with MemoryProfiler(os.path.join(opt.log_path, 'memory.jsonl'), every=opt.profile_memory_every, enabled=opt.profile_memory) as memory_profiler:
+            train_data_loader, valid_data_loader, test_data_loader, word2id, id2word, vocab = load_data_vocab(opt)
+            memory_profiler.profile_dataset('train', train_data_loader.dataset.examples)
+            memory_profiler.track_workers(train_data_loader)
+            model = init_model(opt)
+            optimizer_ml, optimizer_rl, criterion = init_optimizer_criterion(model, opt)
+            train_model(model, optimizer_ml, optimizer_rl, criterion, train_data_loader, valid_data_loader, test_data_loader, opt,
+                        memory_profiler=memory_profiler)
     except Exception as e:
         logging.error(e, exc_info=True)
         raise
@@ -2,9 +2,6 @@ from os.path import join, dirname
 import numpy as np
 import time
 import sys,logging
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
 import time
 
 def time_usage(func):
@@ -209,6 +206,11 @@ def plot_learning_curve_and_write_csv(scores, curve_names, checkpoint_names, tit
     ylim : tuple, shape (ymin, ymax), optional
         Defines minimum and maximum yvalues plotted.
     """
+    # matplotlib is slow to import and only needed for plotting
+    import matplotlib
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+
     train_sizes=np.linspace(1, len(scores[0]), len(scores[0]))
     plt.figure(dpi=500)
     plt.title(title)